@@ -2,6 +2,7 @@ import cx_Oracle
 import sys
 import eneel.utils as utils
 import decimal
+import math
 import os
 import re
 
@@ -10,11 +11,14 @@ import logging
 logger = logging.getLogger("main_logger")
 
 
-def run_export_cmd(cmd_commands):
+def run_export_cmd(cmd_commands, cancel_event=None):
     envs = [['NLS_LANG', 'SWEDISH_SWEDEN.AL32UTF8']]
     logger.debug(cmd_commands)
-    cmd_code, cmd_message = utils.run_cmd(cmd_commands, envs)
-    if cmd_code == 0:
+    cmd_code, cmd_message = utils.run_cmd(cmd_commands, envs, cancel_event)
+    if cancel_event is not None and cancel_event.is_set():
+        logger.debug(cmd_commands[2] + " cancelled")
+        return 0
+    elif cmd_code == 0:
         logger.debug(cmd_commands[2] + " exported")
         return 0
     else:
@@ -90,20 +94,33 @@ def generate_cmd_command(server, user, password, database, port, sql_file):
 
 
 def run_export_query(
-    server, user, password, database, port, query, file_path, delimiter
+    server,
+    user,
+    password,
+    database,
+    port,
+    query,
+    file_path,
+    delimiter,
+    cancel_event=None,
 ):
     # Generate SQL statement for extract
     select_stmt = generate_spool_query(query, delimiter)
 
-    spool_cmd = generate_spool_cmd(file_path, select_stmt)
+    sql_file = utils.strip_compression_extension(file_path).replace(".csv", ".sql")
+
+    # Spool compressed if file_path has a compression extension
+    with utils.compressed_output(file_path) as spool_file_path:
+        spool_cmd = generate_spool_cmd(spool_file_path, select_stmt)
 
-    sql_file = file_path.replace('.csv', '.sql')
-    with open(sql_file, "w") as text_file:
-        text_file.write(spool_cmd)
+        with open(sql_file, "w") as text_file:
+            text_file.write(spool_cmd)
 
-    cmd_commands = generate_cmd_command(server, user, password, database, port, sql_file)
+        cmd_commands = generate_cmd_command(
+            server, user, password, database, port, sql_file
+        )
 
-    total_row_count = run_export_cmd(cmd_commands)
+        total_row_count = run_export_cmd(cmd_commands, cancel_event)
 
     return total_row_count
 
@@ -128,6 +145,9 @@ class Database:
         read_only=False,
         table_parallel_loads=10,
         table_parallel_batch_size=1000000,
+        table_parallel_use_catalog_stats=False,
+        table_parallel_skip_empty_batches=False,
+        table_parallel_split_stragglers=False,
     ):
         try:
             server_db = "{}:{}/{}".format(server, port, database)
@@ -143,6 +163,9 @@ class Database:
             self._read_only = read_only
             self._table_parallel_loads = table_parallel_loads
             self._table_parallel_batch_size = table_parallel_batch_size
+            self._table_parallel_use_catalog_stats = table_parallel_use_catalog_stats
+            self._table_parallel_skip_empty_batches = table_parallel_skip_empty_batches
+            self._table_parallel_split_stragglers = table_parallel_split_stragglers
 
             os.environ["NLS_LANG"] = "SWEDISH_SWEDEN.AL32UTF8"
             self._conn = cx_Oracle.connect(user, password, server_db)
@@ -339,25 +362,193 @@ class Database:
         except:
             logger.debug("Failed getting min and max column value")
 
+    def get_row_estimate(self, schema, table, check_stale=False):
+        try:
+            sql = """SELECT t.NUM_ROWS, s.STALE_STATS
+            FROM ALL_TABLES t
+            LEFT JOIN ALL_TAB_STATISTICS s ON s.OWNER = t.OWNER
+            AND s.TABLE_NAME = t.TABLE_NAME AND s.OBJECT_TYPE = 'TABLE'
+            WHERE t.OWNER = :1 AND t.TABLE_NAME = :2"""
+            res = self.query(sql, [schema.upper(), table.upper()])
+            row_estimate, stale_stats = res[0]
+            if check_stale and stale_stats == "YES":
+                return None
+            if row_estimate:
+                return int(row_estimate)
+        except:
+            logger.debug("Failed getting row estimate")
+
+    def get_table_fingerprint(self, schema, table):
+        # The dml counts since the last analyze, and the stats of the last analyze.
+        # The counts are only current after a flush of the monitoring info, so no
+        # fingerprint if it can't be flushed
+        try:
+            self.cursor.execute("BEGIN DBMS_STATS.FLUSH_DATABASE_MONITORING_INFO; END;")
+            sql = """SELECT t.NUM_ROWS, t.LAST_ANALYZED,
+            m.INSERTS, m.UPDATES, m.DELETES, m.TRUNCATED, m.TIMESTAMP
+            FROM ALL_TABLES t
+            LEFT JOIN ALL_TAB_MODIFICATIONS m ON m.TABLE_OWNER = t.OWNER
+            AND m.TABLE_NAME = t.TABLE_NAME AND m.PARTITION_NAME IS NULL
+            WHERE t.OWNER = :1 AND t.TABLE_NAME = :2"""
+            res = self.query(sql, [schema.upper(), table.upper()])
+            if res:
+                return "|".join(str(value) for value in res[0])
+        except:
+            logger.debug("Failed getting table fingerprint")
+
     def get_min_max_batch(self, table_name, column):
         try:
-            sql = "SELECT MIN(" + column + "), MAX(" + column
-            sql += "), ceil((max( " + column + ") - min("
-            sql += (
-                column
-                + ")) / (count(*)/"
-                + str(self._table_parallel_batch_size)
-                + ".0)) FROM "
-                + table_name
-            )
+            # Row estimate from the catalog, and min and max from the index endpoints
+            row_count = None
+            if self._table_parallel_use_catalog_stats and not table_name.startswith(
+                "("
+            ):
+                schema, table = table_name.split(".", 1)
+                row_count = self.get_row_estimate(schema, table, check_stale=True)
+            if row_count:
+                sql = "SELECT (SELECT MIN(" + column + ") FROM " + table_name + "), "
+                sql += "(SELECT MAX(" + column + ") FROM " + table_name + ") FROM DUAL"
+                res = self.query(sql)
+                return utils.get_min_max_batch(
+                    res[0][0], res[0][1], row_count, self._table_parallel_batch_size
+                )
+
+            sql = "SELECT MIN(" + column + "), MAX(" + column + "), COUNT(*) FROM "
+            sql += table_name
             res = self.query(sql)
-            min_value = int(res[0][0])
-            max_value = int(res[0][1])
-            batch_size_key = int(res[0][2])
-            return min_value, max_value, batch_size_key
+            return utils.get_min_max_batch(
+                res[0][0], res[0][1], res[0][2], self._table_parallel_batch_size
+            )
         except:
             logger.debug("Failed getting min, max and batch column value")
 
+    def get_bucket_counts(self, table_name, column, min_value, batch_size_key):
+        # Rows in each batch_size_key bucket from min_value. Empty buckets are missing
+        try:
+            bucket = (
+                "FLOOR(("
+                + column
+                + " - "
+                + str(min_value)
+                + ") / "
+                + str(batch_size_key)
+                + ")"
+            )
+            sql = "SELECT " + bucket + ", COUNT(*) FROM " + table_name
+            sql += " WHERE " + column + " >= " + str(min_value)
+            sql += " GROUP BY " + bucket
+            res = self.query(sql)
+            return [(int(row[0]), int(row[1])) for row in res]
+        except:
+            logger.debug("Failed getting bucket counts")
+
+    def get_batch_boundaries(self, schema, table, column):
+        # Boundaries from NTILE over a sample of the column, so each batch holds
+        # about table_parallel_batch_size rows
+        try:
+            schema_table = schema + "." + table
+            row_count = self.get_row_estimate(schema, table)
+            if not row_count:
+                row_count = self.query("SELECT COUNT(*) FROM " + schema_table)[0][0]
+            num_batches = math.ceil(row_count / self._table_parallel_batch_size)
+            if num_batches < 2:
+                return []
+
+            # Sample about a million rows of large tables
+            sample = ""
+            if row_count > 1000000:
+                sample_percent = max(100000000 / row_count, 0.000001)
+                sample = " SAMPLE (" + str(sample_percent) + ")"
+
+            sql = "SELECT MIN(" + column + ") FROM (SELECT " + column
+            sql += ", NTILE(" + str(num_batches) + ") OVER (ORDER BY " + column
+            sql += ") batch_id FROM " + schema_table + sample
+            sql += " WHERE " + column + " IS NOT NULL)"
+            sql += " GROUP BY batch_id ORDER BY batch_id"
+            res = self.query(sql)
+
+            # The first value of every batch but the first
+            boundaries = []
+            for row in res[1:]:
+                if row[0] is not None and row[0] not in boundaries:
+                    boundaries.append(row[0])
+            return boundaries
+        except:
+            logger.debug("Failed getting batch boundaries")
+
+    def get_block_range_wheres(self, schema, table):
+        # ROWID ranges over the extents of the table with about
+        # table_parallel_batch_size rows each. Needs access to DBA_EXTENTS
+        try:
+            sql = """SELECT DBMS_ROWID.ROWID_CREATE(1, o.DATA_OBJECT_ID, e.RELATIVE_FNO, e.BLOCK_ID, 0),
+            e.BLOCKS
+            FROM DBA_EXTENTS e
+            JOIN ALL_OBJECTS o ON o.OWNER = e.OWNER
+            AND o.OBJECT_NAME = e.SEGMENT_NAME
+            AND NVL(o.SUBOBJECT_NAME, '-') = NVL(e.PARTITION_NAME, '-')
+            WHERE e.OWNER = :1 AND e.SEGMENT_NAME = :2
+            AND o.DATA_OBJECT_ID IS NOT NULL
+            ORDER BY o.DATA_OBJECT_ID, e.RELATIVE_FNO, e.BLOCK_ID"""
+            extents = self.query(sql, [schema.upper(), table.upper()])
+            if not extents:
+                return None
+            total_blocks = sum(blocks for start_rowid, blocks in extents)
+
+            # Split evenly in table_parallel_loads batches if never analyzed
+            sql = "SELECT NUM_ROWS, BLOCKS FROM ALL_TABLES WHERE OWNER = :1 AND TABLE_NAME = :2"
+            stats_rows, stats_blocks = self.query(sql, [schema.upper(), table.upper()])[
+                0
+            ]
+            if stats_rows and stats_blocks:
+                rows_per_block = stats_rows / stats_blocks
+                blocks_per_batch = self._table_parallel_batch_size / rows_per_block
+            else:
+                blocks_per_batch = total_blocks / self._table_parallel_loads
+
+            # A batch starts at the first extent after blocks_per_batch blocks
+            boundaries = []
+            batch_blocks = 0
+            for start_rowid, blocks in extents:
+                if batch_blocks >= blocks_per_batch:
+                    boundaries.append(start_rowid)
+                    batch_blocks = 0
+                batch_blocks += blocks
+            if not boundaries:
+                return [None]
+
+            # Contiguous ranges, so rows in extents added after the split are exported
+            literals = ["CHARTOROWID('" + boundary + "')" for boundary in boundaries]
+            wheres = ["ROWID < " + literals[0]]
+            for lower, upper in zip(literals, literals[1:]):
+                wheres.append("ROWID >= " + lower + " AND ROWID < " + upper)
+            wheres.append("ROWID >= " + literals[-1])
+            return wheres
+        except:
+            logger.debug("Failed getting block ranges")
+
+    def get_partitions(self, schema, table):
+        try:
+            sql = """SELECT PARTITION_NAME FROM ALL_TAB_PARTITIONS
+            WHERE TABLE_OWNER = :1 AND TABLE_NAME = :2
+            ORDER BY PARTITION_POSITION"""
+            res = self.query(sql, [schema.upper(), table.upper()])
+            return [row[0] for row in res]
+        except:
+            logger.debug("Failed getting partitions")
+
+    def get_datetime_literal(self, value):
+        if getattr(value, "microsecond", 0):
+            return (
+                "TO_TIMESTAMP('"
+                + value.strftime("%Y-%m-%d %H:%M:%S.%f")
+                + "', 'YYYY-MM-DD HH24:MI:SS.FF6')"
+            )
+        return (
+            "TO_DATE('"
+            + value.strftime("%Y-%m-%d %H:%M:%S")
+            + "', 'YYYY-MM-DD HH24:MI:SS')"
+        )
+
     def generate_export_query(
         self,
         columns,
@@ -366,6 +557,7 @@ class Database:
         replication_key=None,
         max_replication_key=None,
         parallelization_where=None,
+        partition=None,
     ):
         # Generate SQL statement for extract
         select_stmt = "SELECT "
@@ -376,6 +568,8 @@ class Database:
         select_stmt = select_stmt[:-2]
 
         select_stmt += " FROM " + schema + "." + table
+        if partition:
+            select_stmt += " PARTITION (" + partition + ")"
 
         # Where-claues for incremental replication
         if replication_key:
@@ -397,7 +591,7 @@ class Database:
 
         return select_stmt
 
-    def export_query(self, query, file_path, delimiter):
+    def export_query(self, query, file_path, delimiter, cancel_event=None):
         rowcounts = 0
         #rowcounts = run_export_query(
         run_export_query(
@@ -409,12 +603,54 @@ class Database:
             query,
             file_path,
             delimiter,
+            cancel_event=cancel_event,
         )
         return rowcounts
 
     def insert_from_table_and_drop(self, schema, to_table, from_table):
         return "Not implemented for this adapter"
 
+    def merge_from_table_and_drop(
+        self, schema, to_table, from_table, columns, primary_key, order_key=None
+    ):
+        return "Not implemented for this adapter"
+
+    def apply_changes_from_table_and_drop(
+        self, schema, to_table, from_table, columns, primary_key
+    ):
+        return "Not implemented for this adapter"
+
+    def stream_keys(self, table_name, key_columns, batch_size=10000, text_columns=None):
+        # The keys of the table sorted, fetched batch_size rows at a time. Errors
+        # are raised, so a failed stream is never taken for missing keys. Text keys
+        # are sorted binary, in the same order in every database
+        order_by = []
+        for column in key_columns:
+            if text_columns and column in text_columns:
+                order_by.append("NLSSORT(" + column + ", 'NLS_SORT=BINARY')")
+            else:
+                order_by.append(column)
+        key_list = ", ".join(key_columns)
+        sql = "SELECT " + key_list + " FROM " + table_name
+        sql += " WHERE " + " AND ".join(
+            column + " IS NOT NULL" for column in key_columns
+        )
+        sql += " ORDER BY " + ", ".join(order_by)
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(sql)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row)
+        finally:
+            cursor.close()
+
+    def delete_keys(self, schema, table, key_columns, keys):
+        return "Not implemented for this adapter"
+
     def switch_tables(self, schema, old_table, new_table):
         return "Not implemented for this adapter"
 
@@ -430,6 +666,9 @@ class Database:
     def create_log_table(self, schema, table):
         return "Not implemented for this adapter"
 
+    def get_load_durations(self, schema, table, project):
+        return []
+
     def log(
         self,
         schema,
@@ -4,6 +4,8 @@ import psycopg2.extras
 from time import time
 from datetime import datetime
 import eneel.utils as utils
+import math
+import uuid
 import re
 
 import logging
@@ -17,9 +19,9 @@ def run_import_file(
     db = Database(server, user, password, database, port)
     # Create and run the cmd
     sql = "COPY %s FROM STDIN WITH DELIMITER AS '%s'"
-    file = open(file_path, "r")
     try:
-        db.cursor.copy_expert(sql=sql % (schema_table, delimiter), file=file)
+        with utils.open_file(file_path, "r") as file:
+            db.cursor.copy_expert(sql=sql % (schema_table, delimiter), file=file)
         row_count = db.cursor.rowcount
         return row_count
     except psycopg2.Error as e:
@@ -29,14 +31,73 @@ def run_import_file(
 
 
 def run_export_query(
-    server, user, password, database, port, query, file_path, delimiter, rows=5000
+    server,
+    user,
+    password,
+    database,
+    port,
+    query,
+    file_path,
+    delimiter,
+    rows=5000,
+    cancel_event=None,
 ):
     db = Database(server, user, password, database, port)
     # Create and run the cmd
     sql = "COPY (%s) TO STDIN WITH DELIMITER AS '%s'"
-    file = open(file_path, "w", encoding="utf-8")
     try:
-        db.cursor.copy_expert(sql=sql % (query, delimiter), file=file)
+        with utils.cancel_on(cancel_event, db._conn.cancel), utils.open_file(
+            file_path, "w"
+        ) as file:
+            db.cursor.copy_expert(sql=sql % (query, delimiter), file=file)
+        row_count = db.cursor.rowcount
+        return row_count
+    except psycopg2.extensions.QueryCanceledError:
+        logger.debug("Cancelled export " + query)
+    except psycopg2.Error as e:
+        logger.error(e)
+    finally:
+        db.close()
+
+
+def run_import_stream(
+    server,
+    user,
+    password,
+    database,
+    port,
+    schema_table,
+    stream,
+    delimiter,
+    binary=False,
+):
+    db = Database(server, user, password, database, port)
+    # Create and run the cmd
+    if binary:
+        sql = "COPY %s FROM STDIN (FORMAT binary)" % schema_table
+    else:
+        sql = "COPY %s FROM STDIN WITH DELIMITER AS '%s'" % (schema_table, delimiter)
+    try:
+        db.cursor.copy_expert(sql=sql, file=stream)
+        row_count = db.cursor.rowcount
+        return row_count
+    except psycopg2.Error as e:
+        logger.error(e)
+    finally:
+        db.close()
+
+
+def run_export_query_to_stream(
+    server, user, password, database, port, query, stream, delimiter, binary=False
+):
+    db = Database(server, user, password, database, port)
+    # Create and run the cmd
+    if binary:
+        sql = "COPY (%s) TO STDOUT (FORMAT binary)" % query
+    else:
+        sql = "COPY (%s) TO STDOUT WITH DELIMITER AS '%s'" % (query, delimiter)
+    try:
+        db.cursor.copy_expert(sql=sql, file=stream)
         row_count = db.cursor.rowcount
         return row_count
     except psycopg2.Error as e:
@@ -72,6 +133,17 @@ def python_type_to_db_type(python_type):
         return python_type
 
 
+def get_hash_column(column):
+    # The column cast to the type it is created as in the target, so a source and
+    # its target are hashed on the same values
+    data_type = python_type_to_db_type(column[2])
+    if data_type == "varchar":
+        data_type = "text"
+    elif data_type == "numeric" and column[4] is not None:
+        data_type = "numeric(" + str(column[4]) + "," + str(column[5]) + ")"
+    return column[1] + "::" + data_type
+
+
 def db_type_to_python_type(db_type):
     if db_type[:3] == "int":
         return "int"
@@ -108,6 +180,10 @@ class Database:
         read_only=False,
         table_parallel_loads=10,
         table_parallel_batch_size=10000000,
+        table_parallel_use_catalog_stats=False,
+        table_parallel_skip_empty_batches=False,
+        table_parallel_split_stragglers=False,
+        binary_copy=True,
     ):
         try:
             conn_string = (
@@ -131,6 +207,10 @@ class Database:
             self._read_only = read_only
             self._table_parallel_loads = table_parallel_loads
             self._table_parallel_batch_size = table_parallel_batch_size
+            self._table_parallel_use_catalog_stats = table_parallel_use_catalog_stats
+            self._table_parallel_skip_empty_batches = table_parallel_skip_empty_batches
+            self._table_parallel_split_stragglers = table_parallel_split_stragglers
+            self._binary_copy = binary_copy
 
             self._conn = psycopg2.connect(conn_string)
             self._conn.autocommit = True
@@ -168,6 +248,17 @@ class Database:
         except psycopg2.Error as e:
             logger.error(e)
 
+    def execute_transaction(self, statements):
+        # Runs the statements in one transaction. Rolled back and raised on errors
+        self.cursor.execute("BEGIN")
+        try:
+            for statement in statements:
+                self.cursor.execute(statement)
+        except:
+            self.cursor.execute("ROLLBACK")
+            raise
+        self.cursor.execute("COMMIT")
+
     def execute_many(self, sql, values):
         try:
             return self.cursor.executemany(sql, values)
@@ -220,6 +311,19 @@ class Database:
         columns = self.query_columns(query)
         return columns
 
+    def get_column_types(self, schema, table):
+        # The types without modifiers, so a cast never truncates or rounds. The
+        # modifiers are still checked when the rows are copied into the table
+        try:
+            sql = """SELECT format_type(a.atttypid, NULL)
+            FROM pg_attribute a
+            WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+            ORDER BY a.attnum"""
+            res = self.query(sql, [schema + "." + table])
+            return [row[0] for row in res]
+        except:
+            logger.debug("Failed getting column types")
+
     def query_columns(self, query):
         try:
             query = "SELECT * FROM (" + query + ") q fetch first 1000 row only"
@@ -332,25 +436,267 @@ class Database:
         except:
             logger.debug("Failed getting min and max column value")
 
+    def get_row_estimate(self, schema, table, check_stale=False):
+        try:
+            sql = """SELECT c.reltuples::bigint, COALESCE(s.n_mod_since_analyze, 0)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+            WHERE n.nspname = %s AND c.relname = %s"""
+            res = self.query(sql, [schema.lower(), table.lower()])
+            row_estimate, modified_rows = res[0]
+            # Stale if more than 10% of the rows are modified since last analyze
+            if check_stale and modified_rows > row_estimate * 0.1:
+                return None
+            # reltuples is -1 or 0 when the table never has been analyzed
+            if row_estimate > 0:
+                return row_estimate
+        except:
+            logger.debug("Failed getting row estimate")
+
+    def get_table_fingerprint(self, schema, table):
+        # The tuple counters change with every write. relfilenode changes on truncate.
+        # The counters start over after a stats reset, so the reset time is included.
+        # They are not kept on a standby, so no fingerprint there
+        try:
+            if self.query("SELECT pg_is_in_recovery()")[0][0]:
+                return None
+            sql = """SELECT c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del,
+            pg_stat_get_db_stat_reset_time(d.oid)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_stat_user_tables s ON s.relid = c.oid
+            JOIN pg_database d ON d.datname = current_database()
+            WHERE n.nspname = %s AND c.relname = %s"""
+            res = self.query(sql, [schema.lower(), table.lower()])
+            if res:
+                return "|".join(str(value) for value in res[0])
+        except:
+            logger.debug("Failed getting table fingerprint")
+
     def get_min_max_batch(self, table_name, column):
         try:
-            sql = "SELECT MIN(" + column + "), MAX(" + column
-            sql += "), ceil((max( " + column + ") - min("
-            sql += (
-                column
-                + ")) / (count(*)/"
-                + str(self._table_parallel_batch_size)
-                + ".0)) FROM "
-                + table_name
-            )
+            # Row estimate from the catalog, and min and max from the index endpoints
+            row_count = None
+            if self._table_parallel_use_catalog_stats and not table_name.startswith(
+                "("
+            ):
+                schema, table = table_name.split(".", 1)
+                row_count = self.get_row_estimate(schema, table, check_stale=True)
+            if row_count:
+                sql = "SELECT (SELECT MIN(" + column + ") FROM " + table_name + "), "
+                sql += "(SELECT MAX(" + column + ") FROM " + table_name + ")"
+                res = self.query(sql)
+                return utils.get_min_max_batch(
+                    res[0][0], res[0][1], row_count, self._table_parallel_batch_size
+                )
+
+            sql = "SELECT MIN(" + column + "), MAX(" + column + "), COUNT(*) FROM "
+            sql += table_name
             res = self.query(sql)
-            min_value = res[0][0]
-            max_value = res[0][1]
-            batch_size_key = res[0][2]
-            return min_value, max_value, batch_size_key
+            return utils.get_min_max_batch(
+                res[0][0], res[0][1], res[0][2], self._table_parallel_batch_size
+            )
         except:
             logger.debug("Failed getting min, max and batch column value")
 
+    def get_bucket_counts(self, table_name, column, min_value, batch_size_key):
+        # Rows in each batch_size_key bucket from min_value. Empty buckets are missing
+        try:
+            bucket = (
+                "FLOOR(("
+                + column
+                + " - "
+                + str(min_value)
+                + ") / "
+                + str(batch_size_key)
+                + ")"
+            )
+            sql = "SELECT " + bucket + ", COUNT(*) FROM " + table_name
+            sql += " WHERE " + column + " >= " + str(min_value)
+            sql += " GROUP BY " + bucket
+            res = self.query(sql)
+            return [(int(row[0]), int(row[1])) for row in res]
+        except:
+            logger.debug("Failed getting bucket counts")
+
+    def get_range_hashes(
+        self,
+        table_name,
+        columns,
+        column,
+        min_value,
+        batch_size_key,
+        where=None,
+        limit_rows=None,
+    ):
+        # Rows and the sum of the row hashes in each batch_size_key bucket from
+        # min_value. The sum is the same whatever order the rows are read in.
+        # where and limit_rows filter the rows as the export does
+        try:
+            bucket = (
+                "FLOOR(("
+                + column
+                + " - "
+                + str(min_value)
+                + ") / "
+                + str(batch_size_key)
+                + ".0)"
+            )
+            row_hash = (
+                "('x' || SUBSTR(MD5(ROW("
+                + ", ".join(get_hash_column(col) for col in columns)
+                + ")::text), 1, 15))::bit(60)::bigint"
+            )
+            rows = "SELECT * FROM " + table_name
+            if where:
+                rows += " WHERE " + where
+            if limit_rows:
+                rows += " FETCH FIRST " + str(limit_rows) + " ROW ONLY"
+            sql = (
+                "SELECT "
+                + bucket
+                + ", COUNT(*), SUM("
+                + row_hash
+                + ") FROM ("
+                + rows
+                + ") q"
+            )
+            sql += " WHERE " + column + " IS NOT NULL"
+            sql += " GROUP BY " + bucket
+            res = self.query(sql)
+            return {int(row[0]): (int(row[1]), str(row[2])) for row in res}
+        except:
+            logger.debug("Failed getting range hashes")
+
+    def get_batch_boundaries(self, schema, table, column):
+        # Boundaries from the planner statistics histogram, so each batch holds
+        # about table_parallel_batch_size rows
+        try:
+            sql = """SELECT histogram_bounds::text::text[]
+            FROM pg_stats
+            WHERE schemaname = %s AND tablename = %s AND attname = %s"""
+            res = self.query(sql, [schema.lower(), table.lower(), column.lower()])
+            row_estimate = self.get_row_estimate(schema, table)
+            if not res or not res[0][0] or not row_estimate:
+                return None
+            histogram_bounds = res[0][0]
+            # The buckets between the bounds holds the same number of rows
+            bucket_rows = row_estimate / (len(histogram_bounds) - 1)
+            histogram = [(value, bucket_rows) for value in histogram_bounds[1:]]
+            return utils.get_histogram_boundaries(
+                histogram, self._table_parallel_batch_size
+            )
+        except:
+            logger.debug("Failed getting batch boundaries")
+
+    def get_block_range_wheres(self, schema, table):
+        # ctid ranges of whole pages with about table_parallel_batch_size rows each.
+        # Needs TID range scans from postgres 14, or every batch is a full scan
+        try:
+            if self._conn.server_version < 140000:
+                return None
+            sql = """SELECT pg_relation_size(c.oid) / current_setting('block_size')::int,
+            c.relpages, c.reltuples
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relname = %s"""
+            res = self.query(sql, [schema.lower(), table.lower()])
+            pages, stats_pages, stats_rows = res[0]
+            if pages < 2:
+                return [None]
+
+            # Split evenly in table_parallel_loads batches if never analyzed
+            if stats_pages > 0 and stats_rows > 0:
+                rows_per_page = stats_rows / stats_pages
+                pages_per_batch = math.ceil(
+                    self._table_parallel_batch_size / rows_per_page
+                )
+            else:
+                pages_per_batch = math.ceil(pages / self._table_parallel_loads)
+
+            block_starts = list(range(0, pages, max(pages_per_batch, 1)))
+            wheres = []
+            for start, end in zip(block_starts, block_starts[1:]):
+                wheres.append(
+                    "ctid >= '(" + str(start) + ",0)' AND ctid < '(" + str(end) + ",0)'"
+                )
+            # The last range is open for pages added after the split
+            wheres.append("ctid >= '(" + str(block_starts[-1]) + ",0)'")
+            return wheres
+        except:
+            logger.debug("Failed getting block ranges")
+
+    def get_partitions(self, schema, table):
+        # Leaf partitions of a declaratively partitioned table. Exported directly
+        try:
+            sql = """SELECT relid::regclass::text
+            FROM pg_partition_tree(%s::regclass)
+            WHERE isleaf AND relid <> %s::regclass
+            ORDER BY relid::regclass::text"""
+            schema_table = schema + "." + table
+            res = self.query(sql, [schema_table, schema_table])
+            return [row[0] for row in res]
+        except:
+            logger.debug("Failed getting partitions")
+
+    def get_replication_slot(self, slot_name):
+        # The confirmed lsn of the logical replication slot. Created if missing
+        try:
+            sql = "SELECT confirmed_flush_lsn::text FROM pg_replication_slots WHERE slot_name = %s"
+            res = self.query(sql, [slot_name])
+            if res:
+                return res[0][0]
+            sql = "SELECT lsn::text FROM pg_create_logical_replication_slot(%s, 'test_decoding')"
+            res = self.query(sql, [slot_name])
+            logger.debug("Created replication slot " + slot_name)
+            return res[0][0]
+        except:
+            logger.error("Failed getting replication slot " + slot_name)
+
+    def get_slot_changes(self, slot_name, table_name, batch_size=10000):
+        # The test_decoding changes of the table in the slot up to the current lsn.
+        # Peeked, so they stay in the slot until it is advanced after the changes
+        # are applied
+        try:
+            upto_lsn = self.query("SELECT pg_current_wal_lsn()::text")[0][0]
+            changes = self.stream_slot_changes(
+                slot_name, table_name, upto_lsn, batch_size
+            )
+            return upto_lsn, changes
+        except:
+            logger.error("Failed getting changes from replication slot " + slot_name)
+
+    def stream_slot_changes(self, slot_name, table_name, upto_lsn, batch_size=10000):
+        # Only the changes of the table are sent, batch_size rows at a time from a
+        # named cursor. Errors are raised, so the slot is never advanced past them
+        sql = """SELECT data
+        FROM pg_logical_slot_peek_changes(%s, %s::pg_lsn, NULL, 'skip-empty-xacts', '1')
+        WHERE lower(replace(split_part(data, ': ', 1), '"', '')) = %s"""
+        cursor = self._conn.cursor(
+            name="eneel_changes_" + uuid.uuid4().hex, withhold=True
+        )
+        try:
+            cursor.execute(sql, [slot_name, upto_lsn, "table " + table_name.lower()])
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row[0]
+        finally:
+            cursor.close()
+
+    def advance_replication_slot(self, slot_name, lsn):
+        try:
+            self.query(
+                "SELECT pg_replication_slot_advance(%s, %s::pg_lsn)", [slot_name, lsn]
+            )
+            return "RUN"
+        except:
+            logger.error("Failed advancing replication slot " + slot_name)
+            return "ERROR"
+
     def generate_export_query(
         self,
         columns,
@@ -359,6 +705,7 @@ class Database:
         replication_key=None,
         max_replication_key=None,
         parallelization_where=None,
+        partition=None,
     ):
 
         # Generate SQL statement for extract
@@ -369,7 +716,11 @@ class Database:
             select_stmt += column_name + ", "
         select_stmt = select_stmt[:-2]
 
-        select_stmt += " FROM " + schema + "." + table
+        # A partition is exported from the partition table
+        if partition:
+            select_stmt += " FROM " + partition
+        else:
+            select_stmt += " FROM " + schema + "." + table
 
         # Where-claues for incremental replication
         if replication_key:
@@ -391,7 +742,7 @@ class Database:
 
         return select_stmt
 
-    def export_query(self, query, file_path, delimiter, rows=5000):
+    def export_query(self, query, file_path, delimiter, rows=5000, cancel_event=None):
         rowcounts = run_export_query(
             self._server,
             self._user,
@@ -402,6 +753,21 @@ class Database:
             file_path,
             delimiter,
             rows=rows,
+            cancel_event=cancel_event,
+        )
+        return rowcounts
+
+    def export_query_to_stream(self, query, stream, delimiter, binary=False):
+        rowcounts = run_export_query_to_stream(
+            self._server,
+            self._user,
+            self._password,
+            self._database,
+            self._port,
+            query,
+            stream,
+            delimiter,
+            binary=binary,
         )
         return rowcounts
 
@@ -425,6 +791,191 @@ class Database:
         finally:
             return return_code
 
+    def has_unique_index(self, schema, table, columns):
+        # A primary key or unique index on exactly the columns, usable by ON CONFLICT
+        sql = """SELECT COUNT(*)
+        FROM pg_index i
+        WHERE i.indrelid = %s::regclass AND i.indisunique
+        AND i.indpred IS NULL AND i.indexprs IS NULL
+        AND array_length(i.indkey::int2[], 1) = %s
+        AND ARRAY(SELECT a.attname::text FROM pg_attribute a
+        WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)) @> %s::text[]"""
+        columns = [column.lower() for column in columns]
+        self.cursor.execute(sql, [schema + "." + table, len(columns), columns])
+        return self.cursor.fetchone()[0] > 0
+
+    def merge_from_table_and_drop(
+        self, schema, to_table, from_table, columns, primary_key, order_key=None
+    ):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        to_schema_table = schema + "." + to_table
+        from_schema_table = schema + "." + from_table
+        key_columns = ", ".join(primary_key)
+        select_columns = ", ".join(columns)
+        update_columns = [column for column in columns if column not in primary_key]
+        # The latest row of each key if the delta has several
+        order_by = key_columns
+        if order_key:
+            order_by += ", " + order_key + " DESC"
+        if update_columns:
+            conflict_action = "DO UPDATE SET " + ", ".join(
+                column + " = EXCLUDED." + column for column in update_columns
+            )
+        else:
+            conflict_action = "DO NOTHING"
+        try:
+            statements = []
+            # ON CONFLICT needs a unique index on the primary key
+            if not self.has_unique_index(schema, to_table, primary_key):
+                statements.append(
+                    "CREATE UNIQUE INDEX "
+                    + to_table
+                    + "_upsert_key ON "
+                    + to_schema_table
+                    + " ("
+                    + key_columns
+                    + ")"
+                )
+            statements.append(
+                "INSERT INTO "
+                + to_schema_table
+                + " ("
+                + select_columns
+                + ") SELECT DISTINCT ON ("
+                + key_columns
+                + ") "
+                + select_columns
+                + " FROM "
+                + from_schema_table
+                + " ORDER BY "
+                + order_by
+                + " ON CONFLICT ("
+                + key_columns
+                + ") "
+                + conflict_action
+            )
+            # The temp table is only dropped with a committed merge
+            statements.append("DROP TABLE " + from_schema_table)
+            self.execute_transaction(statements)
+            return_code = "RUN"
+        except Exception as e:
+            logger.error(e)
+            logger.error("Failed to merge_from_table_and_drop")
+            return_code = "ERROR"
+        finally:
+            return return_code
+
+    def apply_changes_from_table_and_drop(
+        self, schema, to_table, from_table, columns, primary_key
+    ):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        to_schema_table = schema + "." + to_table
+        from_schema_table = schema + "." + from_table
+        select_columns = ", ".join(columns)
+        try:
+            # Deleted and changed rows are removed, then the changed rows inserted.
+            # All in one transaction, so the changes are applied whole or not at all
+            self.execute_transaction(
+                [
+                    "DELETE FROM "
+                    + to_schema_table
+                    + " t USING "
+                    + from_schema_table
+                    + " s WHERE "
+                    + " AND ".join(
+                        "t." + column + " = s." + column for column in primary_key
+                    ),
+                    "INSERT INTO "
+                    + to_schema_table
+                    + " ("
+                    + select_columns
+                    + ") SELECT "
+                    + select_columns
+                    + " FROM "
+                    + from_schema_table
+                    + " WHERE eneel_op = 'U'",
+                    "DROP TABLE " + from_schema_table,
+                ]
+            )
+            return_code = "RUN"
+        except Exception as e:
+            logger.error(e)
+            logger.error("Failed to apply_changes_from_table_and_drop")
+            return_code = "ERROR"
+        finally:
+            return return_code
+
+    def replace_ranges_from_table_and_drop(self, schema, to_table, from_table, wheres):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        to_schema_table = schema + "." + to_table
+        from_schema_table = schema + "." + from_table
+        try:
+            # The rows of the changed ranges are replaced by the rows in the temp
+            # table, in one transaction so a failed insert leaves the target as it was
+            statements = [
+                "DELETE FROM " + to_schema_table + " WHERE " + where for where in wheres
+            ]
+            statements.append(
+                "INSERT INTO "
+                + to_schema_table
+                + " SELECT * FROM  "
+                + from_schema_table
+            )
+            statements.append("DROP TABLE " + from_schema_table)
+            self.execute_transaction(statements)
+            return_code = "RUN"
+        except Exception as e:
+            logger.error(e)
+            logger.error("Failed to replace_ranges_from_table_and_drop")
+            return_code = "ERROR"
+        finally:
+            return return_code
+
+    def stream_keys(self, table_name, key_columns, batch_size=10000, text_columns=None):
+        # The keys of the table sorted, fetched batch_size rows at a time. Errors
+        # are raised, so a failed stream is never taken for missing keys. Text keys
+        # are sorted binary, in the same order in every database
+        order_by = []
+        for column in key_columns:
+            if text_columns and column in text_columns:
+                order_by.append(column + ' COLLATE "C"')
+            else:
+                order_by.append(column)
+        key_list = ", ".join(key_columns)
+        sql = "SELECT " + key_list + " FROM " + table_name
+        sql += " WHERE " + " AND ".join(
+            column + " IS NOT NULL" for column in key_columns
+        )
+        sql += " ORDER BY " + ", ".join(order_by)
+        # Named cursors are read on the server in batches
+        cursor = self._conn.cursor(name="eneel_keys_" + uuid.uuid4().hex, withhold=True)
+        try:
+            cursor.execute(sql)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row)
+        finally:
+            cursor.close()
+
+    def delete_keys(self, schema, table, key_columns, keys):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        key_row = "(" + ", ".join(["%s"] * len(key_columns)) + ")"
+        sql = "DELETE FROM " + schema + "." + table
+        sql += " WHERE (" + ", ".join(key_columns) + ") IN ("
+        sql += ", ".join([key_row] * len(keys)) + ")"
+        try:
+            self.cursor.execute(sql, [value for key in keys for value in key])
+            return self.cursor.rowcount
+        except psycopg2.Error as e:
+            logger.error(e)
+
     def switch_tables(self, schema, old_table, new_table):
         if self._read_only:
             sys.exit("This source is readonly. Terminating load run")
@@ -472,6 +1023,23 @@ class Database:
         )
         return row_count
 
+    def import_stream(self, schema, table, stream, delimiter=",", binary=False):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        schema_table = schema + "." + table
+        row_count = run_import_stream(
+            self._server,
+            self._user,
+            self._password,
+            self._database,
+            self._port,
+            schema_table,
+            stream,
+            delimiter,
+            binary=binary,
+        )
+        return row_count
+
     def generate_create_table_ddl(self, schema, table, columns):
         try:
             create_table_sql = "CREATE TABLE " + schema + "." + table + "(\n"
@@ -567,6 +1135,21 @@ class Database:
         self.execute(ddl)
         logger.debug(full_table + " created")
 
+    def get_load_durations(self, schema, table, project):
+        try:
+            sql = "SELECT DISTINCT ON (target_table) target_table, "
+            sql += "EXTRACT(EPOCH FROM ended_at - started_at), imported_rows FROM "
+            sql += schema + "." + table
+            sql += (
+                " WHERE project = %s AND status = 'DONE' AND target_table IS NOT NULL"
+            )
+            sql += " ORDER BY target_table, ended_at DESC"
+            res = self.query(sql, [project])
+            return [(row[0], float(row[1]), row[2]) for row in res]
+        except:
+            logger.debug("Failed getting load durations")
+            return []
+
     def log(
         self,
         schema,
@@ -2,6 +2,7 @@ import os
 import sys
 import snowflake.connector
 from fsplit.filesplit import FileSplit
+import eneel.utils as utils
 
 import logging
 
@@ -71,20 +72,39 @@ def run_import_file(account,
         except:
             logger.error('Failed create stage: ' + file_path)
 
-        # Split files
+        # Snowflake can't load lz4, so those are decompressed first
+        compression = utils.get_compression(file_path)
+        if compression == "lz4":
+            plain_file_path = utils.strip_compression_extension(file_path)
+            utils.copy_file(file_path, plain_file_path)
+            os.remove(file_path)
+            file_path = plain_file_path
+            compression = None
 
+        # Split files. Compressed files are put as they are
+        if not compression:
+            fs = FileSplit(file=file_path, splitsize=50000000, output_dir=file_dir)
+            fs.split()
 
-        fs = FileSplit(file=file_path, splitsize=50000000, output_dir=file_dir)
-        fs.split()
-
-        os.remove(file_path)
+            os.remove(file_path)
 
         # put
         try:
-            files = file_path[:-4] + "*.csv"
-            put_sql = (
-                "PUT file://" + files + " @" + table_stage + " auto_compress=true;"
-            )
+            if compression:
+                put_sql = (
+                    "PUT file://"
+                    + file_path
+                    + " @"
+                    + table_stage
+                    + " auto_compress=false source_compression="
+                    + compression
+                    + ";"
+                )
+            else:
+                files = file_path[:-4] + "*.csv"
+                put_sql = (
+                    "PUT file://" + files + " @" + table_stage + " auto_compress=true;"
+                )
             logger.debug(put_sql)
             db.execute(put_sql)
         except:
@@ -242,6 +262,17 @@ class Database:
         except snowflake.connector.Error as e:
             logger.error(e)
 
+    def execute_transaction(self, statements):
+        # Runs the statements in one transaction. Rolled back and raised on errors
+        self.cursor.execute("BEGIN")
+        try:
+            for statement in statements:
+                self.cursor.execute(statement)
+        except:
+            self.cursor.execute("ROLLBACK")
+            raise
+        self.cursor.execute("COMMIT")
+
     def execute_many(self, sql, values):
         try:
             return self.cursor.executemany(sql, values)
@@ -368,20 +399,12 @@ class Database:
 
     def get_min_max_batch(self, table_name, column):
         try:
-            sql = "SELECT MIN(" + column + "), MAX(" + column
-            sql += "), ceil((max( " + column + ") - min("
-            sql += (
-                column
-                + ")) / (count(*)/"
-                + str(self._table_parallel_batch_size)
-                + ".0)) FROM "
-                + table_name
-            )
+            sql = "SELECT MIN(" + column + "), MAX(" + column + "), COUNT(*) FROM "
+            sql += table_name
             res = self.query(sql)
-            min_value = res[0][0]
-            max_value = res[0][1]
-            batch_size_key = res[0][2]
-            return min_value, max_value, batch_size_key
+            return utils.get_min_max_batch(
+                res[0][0], res[0][1], res[0][2], self._table_parallel_batch_size
+            )
         except:
             logger.debug("Failed getting min, max and batch column value")
 
@@ -401,6 +424,137 @@ class Database:
         except:
             logger.error("Failed to insert_from_table_and_drop")
 
+    def merge_from_table_and_drop(
+        self, schema, to_table, from_table, columns, primary_key, order_key=None
+    ):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        to_schema_table = schema + "." + to_table
+        from_schema_table = schema + "." + from_table
+        select_columns = ", ".join(columns)
+        update_columns = [column for column in columns if column not in primary_key]
+        # The latest row of each key if the delta has several
+        order_by = order_key + " DESC" if order_key else "NULL"
+        merge_sql = (
+            "MERGE INTO "
+            + to_schema_table
+            + " t USING (SELECT "
+            + select_columns
+            + " FROM "
+            + from_schema_table
+            + " QUALIFY ROW_NUMBER() OVER (PARTITION BY "
+            + ", ".join(primary_key)
+            + " ORDER BY "
+            + order_by
+            + ") = 1) s ON "
+            + " AND ".join("t." + column + " = s." + column for column in primary_key)
+        )
+        if update_columns:
+            merge_sql += " WHEN MATCHED THEN UPDATE SET " + ", ".join(
+                "t." + column + " = s." + column for column in update_columns
+            )
+        merge_sql += (
+            " WHEN NOT MATCHED THEN INSERT ("
+            + select_columns
+            + ") VALUES ("
+            + ", ".join("s." + column for column in columns)
+            + ")"
+        )
+        try:
+            # DDL commits in Snowflake, so the temp table is dropped after the merge
+            self.execute_transaction([merge_sql])
+            self.cursor.execute("DROP TABLE " + from_schema_table)
+            return_code = "RUN"
+        except Exception as e:
+            logger.error(e)
+            logger.error("Failed to merge_from_table_and_drop")
+            return_code = "ERROR"
+        finally:
+            return return_code
+
+    def apply_changes_from_table_and_drop(
+        self, schema, to_table, from_table, columns, primary_key
+    ):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        to_schema_table = schema + "." + to_table
+        from_schema_table = schema + "." + from_table
+        select_columns = ", ".join(columns)
+        try:
+            # Deleted and changed rows are removed, then the changed rows inserted.
+            # All in one transaction, so the changes are applied whole or not at all
+            self.execute_transaction(
+                [
+                    "DELETE FROM "
+                    + to_schema_table
+                    + " t USING "
+                    + from_schema_table
+                    + " s WHERE "
+                    + " AND ".join(
+                        "t." + column + " = s." + column for column in primary_key
+                    ),
+                    "INSERT INTO "
+                    + to_schema_table
+                    + " ("
+                    + select_columns
+                    + ") SELECT "
+                    + select_columns
+                    + " FROM "
+                    + from_schema_table
+                    + " WHERE eneel_op = 'U'",
+                ]
+            )
+            # DDL commits in Snowflake, so the temp table is dropped after the changes
+            self.cursor.execute("DROP TABLE " + from_schema_table)
+            return_code = "RUN"
+        except Exception as e:
+            logger.error(e)
+            logger.error("Failed to apply_changes_from_table_and_drop")
+            return_code = "ERROR"
+        finally:
+            return return_code
+
+    def stream_keys(self, table_name, key_columns, batch_size=10000, text_columns=None):
+        # The keys of the table sorted, fetched batch_size rows at a time. Errors
+        # are raised, so a failed stream is never taken for missing keys. Text keys
+        # are sorted binary, in the same order in every database
+        order_by = []
+        for column in key_columns:
+            if text_columns and column in text_columns:
+                order_by.append("COLLATE(" + column + ", 'utf8')")
+            else:
+                order_by.append(column)
+        key_list = ", ".join(key_columns)
+        sql = "SELECT " + key_list + " FROM " + table_name
+        sql += " WHERE " + " AND ".join(
+            column + " IS NOT NULL" for column in key_columns
+        )
+        sql += " ORDER BY " + ", ".join(order_by)
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(sql)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row)
+        finally:
+            cursor.close()
+
+    def delete_keys(self, schema, table, key_columns, keys):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        key_row = "(" + ", ".join(["%s"] * len(key_columns)) + ")"
+        sql = "DELETE FROM " + schema + "." + table
+        sql += " WHERE (" + ", ".join(key_columns) + ") IN ("
+        sql += ", ".join([key_row] * len(keys)) + ")"
+        try:
+            self.cursor.execute(sql, [value for key in keys for value in key])
+            return self.cursor.rowcount
+        except snowflake.connector.Error as e:
+            logger.error(e)
+
     def switch_tables(self, schema, old_table, new_table):
         if self._read_only:
             sys.exit("This source is readonly. Terminating load run")
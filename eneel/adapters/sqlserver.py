@@ -23,6 +23,41 @@ def run_import_file(
     delimiter,
 ):
 
+    return_code = "ERROR"
+    row_count = 0
+
+    try:
+        with utils.decompressed_input(file_path) as bcp_file_path:
+            return_code, row_count = run_bcp_in(
+                server,
+                database,
+                user,
+                password,
+                trusted_connection,
+                codepage,
+                schema,
+                table,
+                bcp_file_path,
+                delimiter,
+            )
+    except:
+        logger.error("Failed importing table")
+    return return_code, row_count
+
+
+def run_bcp_in(
+    server,
+    database,
+    user,
+    password,
+    trusted_connection,
+    codepage,
+    schema,
+    table,
+    file_path,
+    delimiter,
+):
+
     try:
         # Import data
         bcp_in = ["bcp"]
@@ -83,8 +118,34 @@ def run_export_query(
         file_path,
         delimiter,
         codepage='65001',
+        cancel_event=None,
+):
+    # Export data, compressed if file_path has a compression extension
+    with utils.compressed_output(file_path) as bcp_file_path:
+        return run_bcp_queryout(
+            server,
+            user,
+            password,
+            trusted_connection,
+            query,
+            bcp_file_path,
+            delimiter,
+            codepage,
+            cancel_event,
+        )
+
+
+def run_bcp_queryout(
+    server,
+    user,
+    password,
+    trusted_connection,
+    query,
+    file_path,
+    delimiter,
+    codepage="65001",
+    cancel_event=None,
 ):
-    # Export data
     # Generate bcp command
     bcp_out = ['bcp']
     bcp_out.append(query)
@@ -102,8 +163,10 @@ def run_export_query(
 
     logger.debug(bcp_out)
 
-    cmd_code, cmd_message = utils.run_cmd(bcp_out)
-    if cmd_code == 0:
+    cmd_code, cmd_message = utils.run_cmd(bcp_out, cancel_event=cancel_event)
+    if cancel_event is not None and cancel_event.is_set():
+        logger.debug("Cancelled export " + query)
+    elif cmd_code == 0:
         try:
             return_message = cmd_message.splitlines()
             row_count = int(return_message[-3].split()[0])
@@ -122,6 +185,19 @@ def run_export_query(
         logger.error("Error exportng " + query + " :" + cmd_message)
 
 
+def parse_histogram_key(base_type, value):
+    # Date and time keys are read as ISO 8601 strings, and returned as date and
+    # datetime so their literals are formatted by get_datetime_literal
+    if base_type == "date":
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    if base_type in ("datetime", "datetime2", "smalldatetime", "datetimeoffset"):
+        key = datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+        if len(value) > 20:
+            key = key.replace(microsecond=int(value[20:26].ljust(6, "0")))
+        return key
+    return value
+
+
 def python_type_to_db_type(python_type):
     if python_type == "str":
         return "nvarchar"
@@ -147,6 +223,20 @@ def python_type_to_db_type(python_type):
         return python_type
 
 
+def get_hash_column(column):
+    # The column cast to the type it is created as in the target, so a source and
+    # its target are hashed on the same values
+    data_type = python_type_to_db_type(column[2])
+    if data_type == "nvarchar":
+        if column[3] <= 0 or column[3] > 4000:
+            data_type = "nvarchar(MAX)"
+        else:
+            data_type = "nvarchar(" + str(column[3]) + ")"
+    elif data_type == "numeric":
+        data_type = "numeric(" + str(column[4]) + "," + str(column[5]) + ")"
+    return "CAST([" + column[1] + "] AS " + data_type + ")"
+
+
 class Database:
     def __init__(
         self,
@@ -164,6 +254,9 @@ class Database:
         table_parallel_loads=10,
         table_parallel_batch_size=10000000,
         table_where_clause=None,
+        table_parallel_use_catalog_stats=False,
+        table_parallel_skip_empty_batches=False,
+        table_parallel_split_stragglers=False,
     ):
         try:
             conn_string = (
@@ -197,6 +290,9 @@ class Database:
                 self._codepage = "65001"
             self._table_parallel_loads = table_parallel_loads
             self._table_parallel_batch_size = table_parallel_batch_size
+            self._table_parallel_use_catalog_stats = table_parallel_use_catalog_stats
+            self._table_parallel_skip_empty_batches = table_parallel_skip_empty_batches
+            self._table_parallel_split_stragglers = table_parallel_split_stragglers
             self._table_where_clause = table_where_clause
 
             self._conn = pyodbc.connect(conn_string, autocommit=True)
@@ -234,6 +330,17 @@ class Database:
         except pyodbc.Error as e:
             logger.error(e)
 
+    def execute_transaction(self, statements):
+        # Runs the statements in one transaction. Rolled back and raised on errors
+        self.cursor.execute("BEGIN TRANSACTION")
+        try:
+            for statement in statements:
+                self.cursor.execute(statement)
+        except:
+            self.cursor.execute("IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION")
+            raise
+        self.cursor.execute("COMMIT TRANSACTION")
+
     def execute_many(self, sql, values):
         try:
             return self.cursor.executemany(sql, values)
@@ -394,26 +501,209 @@ class Database:
         except:
             logger.debug("Failed getting min and max column value")
 
+    def get_row_estimate(self, schema, table, check_stale=False):
+        # The partition stats row counts are maintained, so never stale
+        try:
+            sql = """SELECT SUM(row_count)
+            FROM sys.dm_db_partition_stats
+            WHERE object_id = OBJECT_ID(?) AND index_id IN (0, 1)"""
+            res = self.query(sql, [schema + "." + table])
+            row_estimate = res[0][0]
+            if row_estimate:
+                return int(row_estimate)
+        except:
+            logger.debug("Failed getting row estimate")
+
+    def get_table_fingerprint(self, schema, table):
+        # The usage stats are reset on restart, so then the table is always loaded
+        try:
+            sql = """SELECT (SELECT MAX(last_user_update)
+            FROM sys.dm_db_index_usage_stats
+            WHERE database_id = DB_ID() AND object_id = OBJECT_ID(?)),
+            (SELECT modify_date FROM sys.objects WHERE object_id = OBJECT_ID(?)),
+            (SELECT SUM(rows) FROM sys.partitions
+            WHERE object_id = OBJECT_ID(?) AND index_id IN (0, 1))"""
+            full_table = schema + "." + table
+            res = self.query(sql, [full_table, full_table, full_table])
+            if res and res[0][0]:
+                return "|".join(str(value) for value in res[0])
+        except:
+            logger.debug("Failed getting table fingerprint")
+
     def get_min_max_batch(self, table_name, column):
         try:
-            sql = "SELECT MIN(" + column + "), MAX(" + column
-            sql += "), CEILING((max( " + column + ") - min("
-            sql += (
-                column
-                + ")) / (count(*)/"
-                + str(self._table_parallel_batch_size)
-                + ".0)) FROM "
-                + table_name
-                + " WITH (NOLOCK)"
-            )
+            # Row count from the catalog, and min and max from the index endpoints
+            row_count = None
+            if self._table_parallel_use_catalog_stats and not table_name.startswith(
+                "("
+            ):
+                schema, table = table_name.split(".", 1)
+                row_count = self.get_row_estimate(schema, table, check_stale=True)
+            if row_count:
+                sql = "SELECT (SELECT MIN(" + column + ") FROM " + table_name
+                sql += " WITH (NOLOCK)), (SELECT MAX(" + column + ") FROM "
+                sql += table_name + " WITH (NOLOCK))"
+                res = self.query(sql)
+                return utils.get_min_max_batch(
+                    res[0][0], res[0][1], row_count, self._table_parallel_batch_size
+                )
+
+            sql = "SELECT MIN(" + column + "), MAX(" + column + "), COUNT(*) FROM "
+            sql += table_name
+            # Table hints can't be used on the derived table of a query load
+            if not table_name.startswith("("):
+                sql += " WITH (NOLOCK)"
             res = self.query(sql)
-            min_value = int(res[0][0])
-            max_value = int(res[0][1])
-            batch_size_key = int(res[0][2])
-            return min_value, max_value, batch_size_key
+            return utils.get_min_max_batch(
+                res[0][0], res[0][1], res[0][2], self._table_parallel_batch_size
+            )
         except:
             logger.debug("Failed getting min, max and batch column value")
 
+    def get_bucket_counts(self, table_name, column, min_value, batch_size_key):
+        # Rows in each batch_size_key bucket from min_value. Empty buckets are missing
+        try:
+            bucket = (
+                "FLOOR(("
+                + column
+                + " - "
+                + str(min_value)
+                + ") / "
+                + str(batch_size_key)
+                + ")"
+            )
+            sql = "SELECT " + bucket + ", COUNT(*) FROM " + table_name
+            if not table_name.startswith("("):
+                sql += " WITH (NOLOCK)"
+            sql += " WHERE " + column + " >= " + str(min_value)
+            sql += " GROUP BY " + bucket
+            res = self.query(sql)
+            return [(int(row[0]), int(row[1])) for row in res]
+        except:
+            logger.debug("Failed getting bucket counts")
+
+    def get_range_hashes(
+        self,
+        table_name,
+        columns,
+        column,
+        min_value,
+        batch_size_key,
+        where=None,
+        limit_rows=None,
+    ):
+        # Rows and the sum of the row checksums in each batch_size_key bucket from
+        # min_value. The sum is the same whatever order the rows are read in.
+        # where and limit_rows filter the rows as the export does
+        try:
+            bucket = (
+                "FLOOR(("
+                + column
+                + " - "
+                + str(min_value)
+                + ") / "
+                + str(batch_size_key)
+                + ".0)"
+            )
+            row_hash = (
+                "CAST(BINARY_CHECKSUM("
+                + ", ".join(get_hash_column(col) for col in columns)
+                + ") AS BIGINT)"
+            )
+            rows = "SELECT "
+            if limit_rows:
+                rows += "TOP " + str(limit_rows) + " "
+            rows += "* FROM " + table_name
+            if where:
+                rows += " WHERE " + where
+            sql = (
+                "SELECT "
+                + bucket
+                + ", COUNT(*), SUM("
+                + row_hash
+                + ") FROM ("
+                + rows
+                + ") q"
+            )
+            sql += " WHERE " + column + " IS NOT NULL"
+            sql += " GROUP BY " + bucket
+            res = self.query(sql)
+            return {int(row[0]): (int(row[1]), str(row[2])) for row in res}
+        except:
+            logger.debug("Failed getting range hashes")
+
+    def get_batch_boundaries(self, schema, table, column):
+        # Boundaries from the histogram of the first statistics on the column, so
+        # each batch holds about table_parallel_batch_size rows
+        try:
+            # Offsets are switched to UTC, as literals without offset are in UTC
+            sql = """SELECT CONVERT(sysname, SQL_VARIANT_PROPERTY(h.range_high_key, 'BaseType')),
+                CASE SQL_VARIANT_PROPERTY(h.range_high_key, 'BaseType')
+                WHEN 'datetimeoffset' THEN CONVERT(nvarchar(4000), CONVERT(datetime2,
+                    SWITCHOFFSET(CONVERT(datetimeoffset, h.range_high_key), '+00:00')), 126)
+                WHEN 'date' THEN CONVERT(nvarchar(4000), h.range_high_key, 126)
+                WHEN 'datetime' THEN CONVERT(nvarchar(4000), h.range_high_key, 126)
+                WHEN 'datetime2' THEN CONVERT(nvarchar(4000), h.range_high_key, 126)
+                WHEN 'smalldatetime' THEN CONVERT(nvarchar(4000), h.range_high_key, 126)
+                ELSE CONVERT(nvarchar(4000), h.range_high_key) END,
+                h.range_rows + h.equal_rows
+            FROM sys.dm_db_stats_histogram(OBJECT_ID(?), (
+                SELECT TOP 1 sc.stats_id
+                FROM sys.stats_columns sc
+                WHERE sc.object_id = OBJECT_ID(?)
+                AND sc.stats_column_id = 1
+                AND COL_NAME(sc.object_id, sc.column_id) = ?
+                ORDER BY sc.stats_id)) h
+            ORDER BY h.step_number"""
+            schema_table = schema + "." + table
+            res = self.query(sql, [schema_table, schema_table, column])
+            if not res:
+                return None
+            histogram = [
+                (parse_histogram_key(base_type, value), float(rows))
+                for base_type, value, rows in res
+            ]
+            return utils.get_histogram_boundaries(
+                histogram, self._table_parallel_batch_size
+            )
+        except:
+            logger.debug("Failed getting batch boundaries")
+
+    def get_partitions(self, schema, table):
+        # $PARTITION filters for each partition of the table's partition function
+        try:
+            sql = """SELECT pf.name, c.name, p.partition_number
+            FROM sys.indexes i
+            JOIN sys.partition_schemes ps ON ps.data_space_id = i.data_space_id
+            JOIN sys.partition_functions pf ON pf.function_id = ps.function_id
+            JOIN sys.index_columns ic ON ic.object_id = i.object_id
+                AND ic.index_id = i.index_id AND ic.partition_ordinal = 1
+            JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+            JOIN sys.partitions p ON p.object_id = i.object_id AND p.index_id = i.index_id
+            WHERE i.object_id = OBJECT_ID(?) AND i.index_id IN (0, 1)
+            ORDER BY p.partition_number"""
+            res = self.query(sql, [schema + "." + table])
+            partitions = []
+            for function_name, column_name, partition_number in res:
+                partitions.append(
+                    "$PARTITION.["
+                    + function_name
+                    + "](["
+                    + column_name
+                    + "]) = "
+                    + str(partition_number)
+                )
+            return partitions
+        except:
+            logger.debug("Failed getting partitions")
+
+    def get_datetime_literal(self, value):
+        # Formats that doesn't depend on the language or dateformat settings
+        if not isinstance(value, datetime):
+            return "'" + value.strftime("%Y%m%d") + "'"
+        milliseconds = "%03d" % (value.microsecond // 1000)
+        return "'" + value.strftime("%Y-%m-%dT%H:%M:%S.") + milliseconds + "'"
+
     def generate_export_query(
         self,
         columns,
@@ -422,6 +712,7 @@ class Database:
         replication_key=None,
         max_replication_key=None,
         parallelization_where=None,
+        partition=None,
     ):
         # Generate SQL statement for extract
         select_stmt = "SELECT "
@@ -455,7 +746,13 @@ class Database:
         else:
             replication_where = None
 
-        wheres = replication_where, self._table_where_clause, parallelization_where
+        # A partition is a $PARTITION filter
+        wheres = (
+            replication_where,
+            self._table_where_clause,
+            parallelization_where,
+            partition,
+        )
         wheres = [x for x in wheres if x is not None]
         if len(wheres) > 0:
             select_stmt += " WHERE " + wheres[0]
@@ -463,7 +760,7 @@ class Database:
                 select_stmt += " AND " + where
         return select_stmt
 
-    def export_query(self, query, file_path, delimiter):
+    def export_query(self, query, file_path, delimiter, cancel_event=None):
         rowcounts = run_export_query(
             self._server,
             self._user,
@@ -472,6 +769,7 @@ class Database:
             query,
             file_path,
             delimiter,
+            cancel_event=cancel_event,
         )
         return rowcounts
 
@@ -495,6 +793,169 @@ class Database:
         finally:
             return return_code
 
+    def merge_from_table_and_drop(
+        self, schema, to_table, from_table, columns, primary_key, order_key=None
+    ):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        to_schema_table = schema + "." + to_table
+        from_schema_table = schema + "." + from_table
+        select_columns = ", ".join(columns)
+        update_columns = [column for column in columns if column not in primary_key]
+        # The latest row of each key if the delta has several
+        order_by = order_key + " DESC" if order_key else "(SELECT NULL)"
+        merge_sql = (
+            "MERGE INTO "
+            + to_schema_table
+            + " AS t USING (SELECT "
+            + select_columns
+            + " FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY "
+            + ", ".join(primary_key)
+            + " ORDER BY "
+            + order_by
+            + ") AS eneel_row_number FROM "
+            + from_schema_table
+            + ") d WHERE eneel_row_number = 1) AS s ON "
+            + " AND ".join("t." + column + " = s." + column for column in primary_key)
+        )
+        if update_columns:
+            merge_sql += " WHEN MATCHED THEN UPDATE SET " + ", ".join(
+                "t." + column + " = s." + column for column in update_columns
+            )
+        merge_sql += (
+            " WHEN NOT MATCHED THEN INSERT ("
+            + select_columns
+            + ") VALUES ("
+            + ", ".join("s." + column for column in columns)
+            + ");"
+        )
+        try:
+            # The temp table is only dropped with a committed merge
+            self.execute_transaction([merge_sql, "DROP TABLE " + from_schema_table])
+            return_code = "RUN"
+        except Exception as e:
+            logger.error(e)
+            logger.error("Failed to merge_from_table_and_drop")
+            return_code = "ERROR"
+        finally:
+            return return_code
+
+    def apply_changes_from_table_and_drop(
+        self, schema, to_table, from_table, columns, primary_key
+    ):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        to_schema_table = schema + "." + to_table
+        from_schema_table = schema + "." + from_table
+        select_columns = ", ".join(columns)
+        try:
+            # Deleted and changed rows are removed, then the changed rows inserted.
+            # All in one transaction, so the changes are applied whole or not at all
+            self.execute_transaction(
+                [
+                    "DELETE t FROM "
+                    + to_schema_table
+                    + " t INNER JOIN "
+                    + from_schema_table
+                    + " s ON "
+                    + " AND ".join(
+                        "t." + column + " = s." + column for column in primary_key
+                    ),
+                    "INSERT INTO "
+                    + to_schema_table
+                    + " ("
+                    + select_columns
+                    + ") SELECT "
+                    + select_columns
+                    + " FROM "
+                    + from_schema_table
+                    + " WHERE eneel_op = 'U'",
+                    "DROP TABLE " + from_schema_table,
+                ]
+            )
+            return_code = "RUN"
+        except Exception as e:
+            logger.error(e)
+            logger.error("Failed to apply_changes_from_table_and_drop")
+            return_code = "ERROR"
+        finally:
+            return return_code
+
+    def replace_ranges_from_table_and_drop(self, schema, to_table, from_table, wheres):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        to_schema_table = schema + "." + to_table
+        from_schema_table = schema + "." + from_table
+        try:
+            # The rows of the changed ranges are replaced by the rows in the temp
+            # table, in one transaction so a failed insert leaves the target as it was
+            statements = [
+                "DELETE FROM " + to_schema_table + " WHERE " + where for where in wheres
+            ]
+            statements.append(
+                "INSERT INTO "
+                + to_schema_table
+                + " SELECT * FROM  "
+                + from_schema_table
+            )
+            statements.append("DROP TABLE " + from_schema_table)
+            self.execute_transaction(statements)
+            return_code = "RUN"
+        except Exception as e:
+            logger.error(e)
+            logger.error("Failed to replace_ranges_from_table_and_drop")
+            return_code = "ERROR"
+        finally:
+            return return_code
+
+    def stream_keys(self, table_name, key_columns, batch_size=10000, text_columns=None):
+        # The keys of the table sorted, fetched batch_size rows at a time. Errors
+        # are raised, so a failed stream is never taken for missing keys. Text keys
+        # are sorted binary, in the same order in every database
+        order_by = []
+        for column in key_columns:
+            if text_columns and column in text_columns:
+                order_by.append(column + " COLLATE Latin1_General_BIN2")
+            else:
+                order_by.append(column)
+        key_list = ", ".join(key_columns)
+        sql = "SELECT " + key_list + " FROM " + table_name
+        sql += " WHERE " + " AND ".join(
+            column + " IS NOT NULL" for column in key_columns
+        )
+        sql += " ORDER BY " + ", ".join(order_by)
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(sql)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row)
+        finally:
+            cursor.close()
+
+    def delete_keys(self, schema, table, key_columns, keys):
+        if self._read_only:
+            sys.exit("This source is readonly. Terminating load run")
+        key_where = "(" + " AND ".join(column + " = ?" for column in key_columns) + ")"
+        # At most 2100 parameters in a statement
+        keys_per_statement = 2000 // len(key_columns)
+        deleted_row_count = 0
+        try:
+            for start in range(0, len(keys), keys_per_statement):
+                statement_keys = keys[start : start + keys_per_statement]
+                sql = "DELETE FROM " + schema + "." + table
+                sql += " WHERE " + " OR ".join([key_where] * len(statement_keys))
+                self.cursor.execute(
+                    sql, [value for key in statement_keys for value in key]
+                )
+                deleted_row_count += self.cursor.rowcount
+            return deleted_row_count
+        except pyodbc.Error as e:
+            logger.error(e)
+
     def switch_tables(self, schema, old_table, new_table):
         if self._read_only:
             sys.exit("This source is readonly. Terminating load run")
@@ -699,6 +1160,22 @@ from  """
         view2_ddl += " where source_table is not null"
         self.execute(view2_ddl)
 
+    def get_load_durations(self, schema, table, project):
+        try:
+            sql = "SELECT target_table, DATEDIFF(ms, started_at, ended_at) / 1000.0, imported_rows"
+            sql += " FROM (SELECT target_table, started_at, ended_at, imported_rows,"
+            sql += " ROW_NUMBER() OVER (PARTITION BY target_table ORDER BY ended_at DESC) AS rn FROM "
+            sql += schema + "." + table
+            sql += (
+                " WHERE project = ? AND status = 'DONE' AND target_table IS NOT NULL) l"
+            )
+            sql += " WHERE rn = 1"
+            res = self.query(sql, [project])
+            return [(row[0], float(row[1]), row[2]) for row in res]
+        except:
+            logger.debug("Failed getting load durations")
+            return []
+
     def log(
         self,
         schema,
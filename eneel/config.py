@@ -48,7 +48,15 @@ def connection_from_config(connection_info):
     table_parallel_batch_size = connection_info.get("credentials").get(
         "table_parallel_batch_size", 1000000
     )
-    # print(table_parallel_batch_size)
+    table_parallel_use_catalog_stats = connection_info.get("credentials").get(
+        "table_parallel_use_catalog_stats", False
+    )
+    table_parallel_skip_empty_batches = connection_info.get("credentials").get(
+        "table_parallel_skip_empty_batches", False
+    )
+    table_parallel_split_stragglers = connection_info.get("credentials").get(
+        "table_parallel_split_stragglers", False
+    )
     if connection_info.get("type") == "oracle":
         return oracle.Database(
             server,
@@ -61,6 +69,9 @@ def connection_from_config(connection_info):
             read_only,
             table_parallel_loads,
             table_parallel_batch_size,
+            table_parallel_use_catalog_stats=table_parallel_use_catalog_stats,
+            table_parallel_skip_empty_batches=table_parallel_skip_empty_batches,
+            table_parallel_split_stragglers=table_parallel_split_stragglers,
         )
     elif connection_info.get("type") == "sqlserver":
         odbc_driver = connection_info["credentials"].get("driver")
@@ -81,8 +92,12 @@ def connection_from_config(connection_info):
             codepage,
             table_parallel_loads,
             table_parallel_batch_size,
+            table_parallel_use_catalog_stats=table_parallel_use_catalog_stats,
+            table_parallel_skip_empty_batches=table_parallel_skip_empty_batches,
+            table_parallel_split_stragglers=table_parallel_split_stragglers,
         )
     elif connection_info.get("type") == "postgres":
+        binary_copy = connection_info.get("credentials").get("binary_copy", True)
         return postgres.Database(
             server,
             user,
@@ -94,6 +109,10 @@ def connection_from_config(connection_info):
             read_only,
             table_parallel_loads,
             table_parallel_batch_size,
+            table_parallel_use_catalog_stats=table_parallel_use_catalog_stats,
+            table_parallel_skip_empty_batches=table_parallel_skip_empty_batches,
+            table_parallel_split_stragglers=table_parallel_split_stragglers,
+            binary_copy=binary_copy,
         )
     elif connection_info.get('type') == 'snowflake':
         account = connection_info['credentials'].get('account')
@@ -198,7 +217,24 @@ class Project:
         self.temp_path = os.path.abspath(self.temp_path)
         self.keep_tempfiles = self.project.get("keep_tempfiles", False)
 
+        # Replication state of incremental loads, kept between runs
+        if self.project.get("state_path"):
+            self.state_path = os.path.join(self.project["state_path"], project_name)
+            self.state_path = os.path.abspath(self.state_path)
+            self.project["state_path"] = self.state_path
+        else:
+            self.state_path = None
+
+        temp_compression = self.project.get("temp_compression")
+        if temp_compression and temp_compression not in utils.COMPRESSION_EXTENSIONS:
+            sys.exit("temp_compression " + str(temp_compression) + " not supported")
+
         self.workers = self.project.get("parallel_loads", 1)
+        self.scheduling = self.project.get("scheduling", "config_order")
+        self.max_source_sessions = self.project.get("max_source_sessions")
+        self.max_target_sessions = self.project.get("max_target_sessions")
+        self.batch_queue = self.project.get("batch_queue", "per_load")
+        self.batch_workers = self.project.get("batch_workers", self.workers)
 
         self.loads = self.get_loads()
 
@@ -1,12 +1,493 @@
 from concurrent.futures import ThreadPoolExecutor as ThreadExecutor
+from concurrent.futures import wait, FIRST_COMPLETED
+import collections
+import datetime
+import itertools
 import os
+import queue
+import re
+import statistics
+import threading
+import time
 import eneel.printer as printer
+import eneel.state as state
+import eneel.utils as utils
 from glob import glob
 
 import logging
 
 logger = logging.getLogger("main_logger")
 
+# Split on the physical location of the rows, without a parallelization_key
+BLOCK_RANGE_METHODS = ("ctid", "rowid")
+STRAGGLER_FACTOR = 3
+LOG_BASED_OP_COLUMN = "eneel_op"
+DELETE_BATCH_SIZE = 1000
+STRAGGLER_MIN_SECONDS = 30
+
+
+def database_session(database):
+    # Waits for a free session if the project limits concurrent sessions
+    return utils.session_slot(getattr(database, "_sessions", None))
+
+
+def export_file(source, query, file_path, delimiter, cancel_event=None):
+    with database_session(source):
+        if cancel_event is not None:
+            return source.export_query(
+                query, file_path, delimiter, cancel_event=cancel_event
+            )
+        return source.export_query(query, file_path, delimiter)
+
+
+def import_file(target, target_schema, target_table, file_path, delimiter):
+    # Nothing to import from the empty file of an empty batch
+    if os.path.isfile(file_path) and os.path.getsize(file_path) == 0:
+        return 0
+    with database_session(target):
+        return target.import_file(target_schema, target_table, file_path, delimiter)
+
+
+def get_key_literal(source, value):
+    if isinstance(value, datetime.date) and hasattr(source, "get_datetime_literal"):
+        return source.get_datetime_literal(value)
+    return "'" + str(value) + "'"
+
+
+def get_boundary_wheres(source, parallelization_key, boundaries):
+    # Half open ranges between the boundaries. The first and last ranges are open
+    # so rows outside of the statistics are exported, and NULL keys goes in the first
+    if not boundaries:
+        return [None]
+    literals = [get_key_literal(source, boundary) for boundary in boundaries]
+    wheres = [
+        "("
+        + parallelization_key
+        + " < "
+        + literals[0]
+        + " OR "
+        + parallelization_key
+        + " IS NULL)"
+    ]
+    for lower, upper in zip(literals, literals[1:]):
+        wheres.append(
+            parallelization_key
+            + " >= "
+            + lower
+            + " AND "
+            + parallelization_key
+            + " < "
+            + upper
+        )
+    wheres.append(parallelization_key + " >= " + literals[-1])
+    return wheres
+
+
+def get_key_ranges(source, table_name, parallelization_key):
+    min_max_batch = source.get_min_max_batch(table_name, parallelization_key)
+    # No ranges for empty tables or keys that can't be split
+    if not min_max_batch:
+        logger.debug(f"{table_name} can't be split on {parallelization_key}")
+        return None, None, None, []
+    (
+        min_parallelization_key,
+        max_parallelization_key,
+        batch_size_key,
+    ) = min_max_batch
+    logger.debug(
+        f"{table_name} parallelization_key=  {parallelization_key}, min: {min_parallelization_key}, max: {max_parallelization_key}, batch_size: {batch_size_key}"
+    )
+
+    # Date and timestamp keys are split in boundaries instead
+    if isinstance(min_parallelization_key, datetime.date):
+        return min_parallelization_key, max_parallelization_key, batch_size_key, None
+
+    # Drop the empty batches of gappy keys and merge the small ones
+    if getattr(source, "_table_parallel_skip_empty_batches", False):
+        bucket_counts = source.get_bucket_counts(
+            table_name, parallelization_key, min_parallelization_key, batch_size_key
+        )
+        if bucket_counts:
+            ranges = utils.merge_bucket_ranges(
+                bucket_counts,
+                min_parallelization_key,
+                batch_size_key,
+                source._table_parallel_batch_size,
+            )
+            logger.debug(f"{table_name} non empty batches: {len(ranges)}")
+            return (
+                min_parallelization_key,
+                max_parallelization_key,
+                batch_size_key,
+                ranges,
+            )
+
+    ranges = []
+    batch_start = min_parallelization_key
+    while batch_start <= max_parallelization_key:
+        ranges.append((batch_start, batch_start + batch_size_key - 1))
+        batch_start += batch_size_key
+
+    return min_parallelization_key, max_parallelization_key, batch_size_key, ranges
+
+
+def get_range_where(parallelization_key, batch_range):
+    start, end = batch_range
+    return parallelization_key + " between " + str(start) + " and " + str(end)
+
+
+def get_range_wheres(
+    source, table_name, parallelization_key, parallelization_method=None
+):
+    (
+        min_parallelization_key,
+        max_parallelization_key,
+        batch_size_key,
+        ranges,
+    ) = get_key_ranges(source, table_name, parallelization_key)
+
+    # Date and timestamp keys in intervals of even size, or by day or hour
+    if ranges is None:
+        interval = batch_size_key
+        if parallelization_method in ("day", "hour"):
+            interval = parallelization_method
+        boundaries = utils.get_datetime_boundaries(
+            min_parallelization_key, max_parallelization_key, interval
+        )
+        return get_boundary_wheres(source, parallelization_key, boundaries)
+
+    if not ranges:
+        return [None]
+
+    return [get_range_where(parallelization_key, batch_range) for batch_range in ranges]
+
+
+def get_parallelization_wheres(
+    source,
+    source_schema,
+    source_table,
+    parallelization_key,
+    parallelization_method=None,
+    replication_key=None,
+    max_replication_key=None,
+):
+    if parallelization_method in BLOCK_RANGE_METHODS:
+        wheres = None
+        if hasattr(source, "get_block_range_wheres"):
+            wheres = source.get_block_range_wheres(source_schema, source_table)
+        if wheres:
+            logger.debug(
+                f"{source_schema}.{source_table} {parallelization_method} ranges: {len(wheres)}"
+            )
+            return wheres
+        logger.debug(
+            source_schema
+            + "."
+            + source_table
+            + " can't be split with "
+            + parallelization_method
+        )
+        if not parallelization_key:
+            return [None]
+
+    # The histogram is of the whole table, so incremental loads uses ranges
+    if parallelization_method == "histogram" and not max_replication_key:
+        boundaries = None
+        if hasattr(source, "get_batch_boundaries"):
+            boundaries = source.get_batch_boundaries(
+                source_schema, source_table, parallelization_key
+            )
+        if boundaries is not None:
+            logger.debug(
+                f"{source_schema}.{source_table} parallelization_key=  {parallelization_key}, boundaries: {len(boundaries)}"
+            )
+            return get_boundary_wheres(source, parallelization_key, boundaries)
+        logger.debug(
+            source_schema
+            + "."
+            + source_table
+            + " has no histogram for "
+            + parallelization_key
+            + ". Using min and max ranges"
+        )
+
+    return get_range_wheres(
+        source,
+        get_delta_table_name(
+            source_schema, source_table, replication_key, max_replication_key
+        ),
+        parallelization_key,
+        parallelization_method,
+    )
+
+
+def get_export_querys(
+    source,
+    source_schema,
+    source_table,
+    columns,
+    replication_key=None,
+    max_replication_key=None,
+    parallelization_key=None,
+    parallelization_method=None,
+):
+    # One query per partition of partitioned tables
+    if parallelization_method == "partition":
+        partitions = None
+        if hasattr(source, "get_partitions"):
+            partitions = source.get_partitions(source_schema, source_table)
+        if partitions:
+            logger.debug(
+                f"{source_schema}.{source_table} partitions: {len(partitions)}"
+            )
+            return [
+                source.generate_export_query(
+                    columns,
+                    source_schema,
+                    source_table,
+                    replication_key,
+                    max_replication_key,
+                    partition=partition,
+                )
+                for partition in partitions
+            ]
+        logger.debug(source_schema + "." + source_table + " is not partitioned")
+
+    # One query for the whole table if no parallelization_key
+    if not parallelization_key and parallelization_method not in BLOCK_RANGE_METHODS:
+        query = source.generate_export_query(
+            columns,
+            source_schema,
+            source_table,
+            replication_key,
+            max_replication_key,
+        )
+        logger.debug("Export query: " + query)
+        return [query]
+
+    parallelization_wheres = get_parallelization_wheres(
+        source,
+        source_schema,
+        source_table,
+        parallelization_key,
+        parallelization_method,
+        replication_key,
+        max_replication_key,
+    )
+
+    querys = []
+    for parallelization_where in parallelization_wheres:
+        query = source.generate_export_query(
+            columns,
+            source_schema,
+            source_table,
+            replication_key,
+            max_replication_key,
+            parallelization_where,
+        )
+        querys.append(query)
+
+    return querys
+
+
+def get_replication_where(replication_key, max_replication_key):
+    return replication_key + " > '" + max_replication_key + "'"
+
+
+def get_wrapped_query(query, columns, where=None):
+    # Rows of the query filtered on where. Columns are listed by name and not as *,
+    # as the oracle spool query wraps each selected column
+    wrapped_query = "SELECT " + ", ".join(column[1] for column in columns)
+    wrapped_query += " FROM (" + query.strip().rstrip(";") + ") q"
+    if where:
+        wrapped_query += " WHERE " + where
+    return wrapped_query
+
+
+def get_incremental_query(query, columns, replication_key, max_replication_key):
+    # New rows of the wrapped query
+    return get_wrapped_query(
+        query, columns, get_replication_where(replication_key, max_replication_key)
+    )
+
+
+def get_delta_table_name(
+    source_schema, source_table, replication_key=None, max_replication_key=None
+):
+    # Ranges of incremental loads are split over the new rows only
+    full_source_table = source_schema + "." + source_table
+    if not (replication_key and max_replication_key):
+        return full_source_table
+    return (
+        "(SELECT * FROM "
+        + full_source_table
+        + " WHERE "
+        + get_replication_where(replication_key, max_replication_key)
+        + ") d"
+    )
+
+
+def get_query_export_querys(
+    source,
+    query,
+    parallelization_key=None,
+    parallelization_method=None,
+    columns=None,
+):
+    # One query if no parallelization_key
+    if not parallelization_key:
+        return [query]
+
+    # Batches are filtered on the wrapped query
+    table_name = "(" + query.strip().rstrip(";") + ") q"
+    parallelization_wheres = get_range_wheres(
+        source, table_name, parallelization_key, parallelization_method
+    )
+
+    if not columns:
+        columns = source.query_columns(query)
+
+    return [
+        get_wrapped_query(query, columns, parallelization_where)
+        for parallelization_where in parallelization_wheres
+    ]
+
+
+def get_export_file_paths(temp_path_load, file_name, num_files, temp_compression=None):
+    extension = ".csv" + utils.get_compression_extension(temp_compression)
+    if num_files == 1:
+        return [os.path.join(temp_path_load, file_name + extension)]
+
+    file_paths = []
+    for batch_id in range(1, num_files + 1):
+        batch_file_name = file_name + "_" + str(batch_id) + "_" + extension
+        file_paths.append(os.path.join(temp_path_load, batch_file_name))
+    return file_paths
+
+
+def get_export_files(temp_path_load):
+    export_files = glob(os.path.join(temp_path_load, "*.csv"))
+    for extension in utils.COMPRESSION_EXTENSIONS.values():
+        export_files += glob(os.path.join(temp_path_load, "*.csv" + extension))
+    return export_files
+
+
+def run_export_querys(source, querys, file_paths, csv_delimiter):
+    total_row_count = 0
+
+    table_workers = source._table_parallel_loads
+    if len(querys) < table_workers:
+        table_workers = len(querys)
+
+    num_querys = len(querys)
+
+    with ThreadExecutor(max_workers=table_workers) as executor:
+        for row_count in executor.map(
+            export_file,
+            [source] * num_querys,
+            querys,
+            file_paths,
+            [csv_delimiter] * num_querys,
+        ):
+            total_row_count += row_count
+
+    return total_row_count
+
+
+def get_export_file_path(temp_path_load, file_name, batch_id, temp_compression=None):
+    extension = ".csv" + utils.get_compression_extension(temp_compression)
+    batch_file_name = file_name + "_" + str(batch_id) + "_" + extension
+    return os.path.join(temp_path_load, batch_file_name)
+
+
+def get_straggler(running, durations, now):
+    # The longest running batch, if it runs far longer than the finished ones
+    if not durations:
+        return None
+    limit = STRAGGLER_FACTOR * max(statistics.median(durations), STRAGGLER_MIN_SECONDS)
+    straggler = None
+    for future, (batch_range, file_path, cancel_event, started) in running.items():
+        if cancel_event.is_set() or batch_range[0] >= batch_range[1]:
+            continue
+        if now - started > limit and (
+            straggler is None or started < running[straggler][3]
+        ):
+            straggler = future
+    return straggler
+
+
+def run_export_ranges(
+    source,
+    ranges,
+    make_query,
+    temp_path_load,
+    file_name,
+    csv_delimiter,
+    temp_compression=None,
+):
+    # Exports the key ranges in parallel. When workers are idle and a batch runs far
+    # longer than the median, it is cancelled and its range is exported in sub ranges
+    total_row_count = 0
+    table_workers = source._table_parallel_loads
+    pending = collections.deque(ranges)
+    running = {}
+    durations = []
+    batch_id = 0
+
+    with ThreadExecutor(max_workers=table_workers) as executor:
+        while pending or running:
+            while pending and len(running) < table_workers:
+                batch_range = pending.popleft()
+                batch_id += 1
+                file_path = get_export_file_path(
+                    temp_path_load, file_name, batch_id, temp_compression
+                )
+                cancel_event = threading.Event()
+                future = executor.submit(
+                    export_file,
+                    source,
+                    make_query(batch_range),
+                    file_path,
+                    csv_delimiter,
+                    cancel_event,
+                )
+                running[future] = (batch_range, file_path, cancel_event, time.time())
+
+            done, not_done = wait(running, timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch_range, file_path, cancel_event, started = running.pop(future)
+                row_count = future.result()
+                if cancel_event.is_set():
+                    # Cancelled straggler, its range is exported again in sub ranges
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                    continue
+                if row_count is None:
+                    raise Exception("Failed exporting " + make_query(batch_range))
+                durations.append(time.time() - started)
+                total_row_count += row_count
+
+            idle_workers = table_workers - len(running)
+            if pending or not idle_workers:
+                continue
+            straggler = get_straggler(running, durations, time.time())
+            if straggler is not None:
+                batch_range, file_path, cancel_event, started = running[straggler]
+                cancel_event.set()
+                sub_ranges = utils.split_range(
+                    batch_range[0], batch_range[1], idle_workers + 1
+                )
+                logger.debug(
+                    file_name
+                    + " straggler "
+                    + str(batch_range)
+                    + " split in "
+                    + str(len(sub_ranges))
+                )
+                pending.extend(sub_ranges)
+
+    return total_row_count
+
 
 def export_table(
     return_code,
@@ -21,96 +502,79 @@ def export_table(
     replication_key=None,
     max_replication_key=None,
     parallelization_key=None,
+    parallelization_method=None,
+    temp_compression=None,
 ):
 
     total_row_count = 0
 
     # Export table
     try:
-        if parallelization_key:
-            (
-                min_parallelization_key,
-                max_parallelization_key,
-                batch_size_key,
-            ) = source.get_min_max_batch(
-                source_schema + "." + source_table, parallelization_key
-            )
-            logger.debug(f"{source_schema}.{source_table} parallelization_key=  {parallelization_key}, min: {min_parallelization_key}, max: {max_parallelization_key}, batch_size: {batch_size_key}")
-            batch_id = 1
-            batch_start = min_parallelization_key
-
-            file_paths = []
-            querys = []
-            csv_delimiters = []
-
-            while batch_start <= max_parallelization_key:
-                file_name = (
-                    source._database
-                    + "_"
-                    + source_schema
-                    + "_"
-                    + source_table
-                    + "_"
-                    + str(batch_id)
-                    + "_"
-                    + ".csv"
-                )
-                file_path = os.path.join(temp_path_load, file_name)
-
-                # parallelization_where = source.get_parallelization_where(batch_start, batch_size_key)
-                parallelization_where = (
-                    parallelization_key
-                    + " between "
-                    + str(batch_start)
-                    + " and "
-                    + str(batch_start + batch_size_key - 1)
-                )
-                query = source.generate_export_query(
+        file_name = source._database + "_" + source_schema + "_" + source_table
+
+        # Key ranges with straggler batches split while running
+        ranges = None
+        if (
+            getattr(source, "_table_parallel_split_stragglers", False)
+            and parallelization_key
+            and parallelization_method in (None, "range")
+        ):
+            ranges = get_key_ranges(
+                source,
+                get_delta_table_name(
+                    source_schema, source_table, replication_key, max_replication_key
+                ),
+                parallelization_key,
+            )[3]
+
+        if ranges:
+
+            def make_query(batch_range):
+                return source.generate_export_query(
                     columns,
                     source_schema,
                     source_table,
                     replication_key,
                     max_replication_key,
-                    parallelization_where,
+                    get_range_where(parallelization_key, batch_range),
                 )
 
-                file_paths.append(file_path)
-                querys.append(query)
-                csv_delimiters.append(csv_delimiter)
-
-                batch_start += batch_size_key
-                batch_id += 1
-
-            table_workers = source._table_parallel_loads
-            if len(querys) < table_workers:
-                table_workers = len(querys)
-
-            try:
-                with ThreadExecutor(max_workers=table_workers) as executor:
-                    for row_count in executor.map(
-                        source.export_query, querys, file_paths, csv_delimiters
-                    ):
-                        total_row_count += row_count
-            except Exception as e:
-                logger.error(e)
-
-        else:
-
-            file_name = (
-                source._database + "_" + source_schema + "_" + source_table + ".csv"
+            total_row_count = run_export_ranges(
+                source,
+                ranges,
+                make_query,
+                temp_path_load,
+                file_name,
+                csv_delimiter,
+                temp_compression,
             )
-            file_path = os.path.join(temp_path_load, file_name)
-
-            query = source.generate_export_query(
-                columns,
+        else:
+            querys = get_export_querys(
+                source,
                 source_schema,
                 source_table,
+                columns,
                 replication_key,
                 max_replication_key,
+                parallelization_key,
+                parallelization_method,
             )
-            logger.debug('Export query: ' + query)
 
-            total_row_count = source.export_query(query, file_path, csv_delimiter)
+            file_paths = get_export_file_paths(
+                temp_path_load, file_name, len(querys), temp_compression
+            )
+
+            if len(querys) > 1:
+                try:
+                    total_row_count = run_export_querys(
+                        source, querys, file_paths, csv_delimiter
+                    )
+                except Exception as e:
+                    logger.error(e)
+            else:
+                total_row_count = export_file(
+                    source, querys[0], file_paths[0], csv_delimiter
+                )
 
         return_code = "RUN"
     except:
@@ -133,25 +597,28 @@ def export_query(
     temp_path_load,
     csv_delimiter,
     parallelization_key=None,
+    temp_compression=None,
+    parallelization_method=None,
 ):
     total_row_count = 0
     # Export table
     try:
-        if parallelization_key:
-            printer.print_load_line(
-                index,
-                total,
-                return_code,
-                load_name,
-                msg="parallelization not implemented",
-            )
+        querys = get_query_export_querys(
+            source, query, parallelization_key, parallelization_method
+        )
 
-        file_name = load_name + ".csv"
-        file_path = os.path.join(temp_path_load, file_name)
+        file_paths = get_export_file_paths(
+            temp_path_load, load_name, len(querys), temp_compression
+        )
 
-        # query = source.generate_export_query(columns, source_schema, source_table,
-        #                                        replication_key, max_replication_key)
-        total_row_count = source.export_query(query, file_path, csv_delimiter)
+        if len(querys) > 1:
+            total_row_count = run_export_querys(
+                source, querys, file_paths, csv_delimiter
+            )
+        else:
+            total_row_count = export_file(
+                source, querys[0], file_paths[0], csv_delimiter
+            )
 
         if total_row_count is not None:
             return_code = "RUN"
@@ -201,12 +668,14 @@ def import_into_temp_table(
     load_name=None,
 ):
     try:
-        csv_files = glob(os.path.join(temp_path_load, "*.csv"))
+        csv_files = get_export_files(temp_path_load)
+        targets = []
         target_schemas = []
         target_table_tmps = []
         temp_path_loads = []
         delimiters = []
         for file_path in csv_files:
+            targets.append(target)
             target_schemas.append(target_schema)
             target_table_tmps.append(target_table_tmp)
             temp_path_loads.append(file_path)
@@ -221,7 +690,8 @@ def import_into_temp_table(
         try:
             with ThreadExecutor(max_workers=table_workers) as executor:
                 for row_count in executor.map(
-                    target.import_file,
+                    import_file,
+                    targets,
                     target_schemas,
                     target_table_tmps,
                     temp_path_loads,
@@ -243,6 +713,685 @@ def import_into_temp_table(
         return return_code, total_row_count
 
 
+def supports_streaming(source, target):
+    return hasattr(source, "export_query_to_stream") and hasattr(
+        target, "import_stream"
+    )
+
+
+def supports_binary_copy(source, target):
+    # Binary COPY between postgres databases, unless turned off on either side
+    return (
+        source._dialect == "postgres"
+        and target._dialect == "postgres"
+        and source._binary_copy
+        and target._binary_copy
+    )
+
+
+def get_binary_copy_query(query, column_types):
+    # The binary format of a value depends on its type, so the columns are cast to
+    # the types of the target table. They are renamed by position in the alias
+    aliases = ["c" + str(i) for i in range(len(column_types))]
+    select_stmt = "SELECT "
+    for alias, column_type in zip(aliases, column_types):
+        select_stmt += "q." + alias + "::" + column_type + ", "
+    select_stmt = select_stmt[:-2]
+    select_stmt += " FROM (" + query + ") q(" + ", ".join(aliases) + ")"
+    return select_stmt
+
+
+def export_to_stream(source, query, stream, delimiter, binary=False):
+    try:
+        return source.export_query_to_stream(query, stream, delimiter, binary=binary)
+    finally:
+        stream.close()
+
+
+def stream_query_into_table(
+    source, target, target_schema, target_table, query, delimiter, binary=False
+):
+    stream = utils.StreamPipe()
+    # Both sessions are taken together, source first, so transfers can't deadlock
+    with database_session(source), database_session(target), ThreadExecutor(
+        max_workers=1
+    ) as exporter:
+        export = exporter.submit(
+            export_to_stream, source, query, stream, delimiter, binary
+        )
+        try:
+            import_row_count = target.import_stream(
+                target_schema, target_table, stream, delimiter, binary=binary
+            )
+        finally:
+            # Release a blocked export if the import stopped reading
+            stream.abort()
+        export_row_count = export.result()
+
+    if export_row_count is None or import_row_count is None:
+        raise Exception("Failed streaming " + query)
+
+    return export_row_count, import_row_count
+
+
+def stream_querys(source, target, target_schema, target_table, querys, delimiter):
+    total_export_row_count = 0
+    total_import_row_count = 0
+
+    table_workers = min(
+        source._table_parallel_loads, target._table_parallel_loads, len(querys)
+    )
+
+    # Postgres to postgres is streamed in binary, without formatting and parsing
+    # the values as text
+    binary = False
+    if supports_binary_copy(source, target):
+        column_types = target.get_column_types(target_schema, target_table)
+        if column_types:
+            querys = [get_binary_copy_query(query, column_types) for query in querys]
+            binary = True
+
+    num_querys = len(querys)
+    with ThreadExecutor(max_workers=table_workers) as executor:
+        for export_row_count, import_row_count in executor.map(
+            stream_query_into_table,
+            [source] * num_querys,
+            [target] * num_querys,
+            [target_schema] * num_querys,
+            [target_table] * num_querys,
+            querys,
+            [delimiter] * num_querys,
+            [binary] * num_querys,
+        ):
+            total_export_row_count += export_row_count
+            total_import_row_count += import_row_count
+
+    return total_export_row_count, total_import_row_count
+
+
+def export_file_to_queue(source, query, file_path, delimiter, file_queue):
+    row_count = export_file(source, query, file_path, delimiter)
+    if row_count is None:
+        raise Exception("Failed exporting " + query)
+    file_queue.put(file_path)
+    return row_count
+
+
+def import_files_from_queue(
+    target, target_schema, target_table, delimiter, file_queue, keep_tempfiles=False
+):
+    total_row_count = 0
+    error = None
+    while True:
+        file_path = file_queue.get()
+        if file_path is None:
+            break
+        # Keep draining the queue after a failure so exports don't block
+        if error:
+            continue
+        try:
+            row_count = import_file(
+                target, target_schema, target_table, file_path, delimiter
+            )
+            if row_count is None:
+                raise Exception("Failed importing " + file_path)
+            total_row_count += row_count
+            # Imported files are removed right away, so the temp dir stays small
+            if not keep_tempfiles:
+                utils.delete_file(file_path)
+        except Exception as e:
+            error = e
+    if error:
+        raise error
+    return total_row_count
+
+
+def pipeline_querys(
+    source,
+    target,
+    target_schema,
+    target_table,
+    querys,
+    file_paths,
+    delimiter,
+    keep_tempfiles=False,
+):
+    total_export_row_count = 0
+    total_import_row_count = 0
+
+    num_querys = len(querys)
+    export_workers = min(source._table_parallel_loads, num_querys)
+    import_workers = min(target._table_parallel_loads, num_querys)
+
+    # Bounded so exports wait for the imports instead of filling the temp dir
+    file_queue = queue.Queue(maxsize=import_workers)
+
+    with ThreadExecutor(max_workers=import_workers) as importer:
+        imports = [
+            importer.submit(
+                import_files_from_queue,
+                target,
+                target_schema,
+                target_table,
+                delimiter,
+                file_queue,
+                keep_tempfiles,
+            )
+            for i in range(import_workers)
+        ]
+        try:
+            with ThreadExecutor(max_workers=export_workers) as exporter:
+                for row_count in exporter.map(
+                    export_file_to_queue,
+                    [source] * num_querys,
+                    querys,
+                    file_paths,
+                    [delimiter] * num_querys,
+                    [file_queue] * num_querys,
+                ):
+                    total_export_row_count += row_count
+        finally:
+            for i in range(import_workers):
+                file_queue.put(None)
+        for future in imports:
+            total_import_row_count += future.result()
+
+    return total_export_row_count, total_import_row_count
+
+
+def supports_fifo(source, target):
+    # Snowflake needs a materialized file to split and put
+    return utils.supports_fifo() and target._dialect in ("postgres", "sqlserver")
+
+
+def fifo_query_into_table(
+    source, target, target_schema, target_table, query, fifo_path, delimiter
+):
+    os.mkfifo(fifo_path)
+    try:
+        # Both sessions are taken together, source first, so transfers can't deadlock
+        with database_session(source), database_session(target), ThreadExecutor(
+            max_workers=2
+        ) as executor:
+            export = executor.submit(source.export_query, query, fifo_path, delimiter)
+            load = executor.submit(
+                target.import_file, target_schema, target_table, fifo_path, delimiter
+            )
+            # Release the other side if it is, or will be, waiting to open the fifo
+            done, not_done = wait([export, load], return_when=FIRST_COMPLETED)
+            if export in done:
+                waiting, mode = load, os.O_WRONLY
+            else:
+                waiting, mode = export, os.O_RDONLY
+            while not waiting.done():
+                utils.unblock_fifo(fifo_path, mode)
+                wait([waiting], timeout=1)
+            export_row_count = export.result()
+            import_row_count = load.result()
+    finally:
+        utils.delete_file(fifo_path)
+
+    if export_row_count is None or import_row_count is None:
+        raise Exception("Failed transfer through fifo " + query)
+
+    return export_row_count, import_row_count
+
+
+def fifo_querys(
+    source, target, target_schema, target_table, querys, fifo_paths, delimiter
+):
+    total_export_row_count = 0
+    total_import_row_count = 0
+
+    table_workers = min(
+        source._table_parallel_loads, target._table_parallel_loads, len(querys)
+    )
+
+    num_querys = len(querys)
+    with ThreadExecutor(max_workers=table_workers) as executor:
+        for export_row_count, import_row_count in executor.map(
+            fifo_query_into_table,
+            [source] * num_querys,
+            [target] * num_querys,
+            [target_schema] * num_querys,
+            [target_table] * num_querys,
+            querys,
+            fifo_paths,
+            [delimiter] * num_querys,
+        ):
+            total_export_row_count += export_row_count
+            total_import_row_count += import_row_count
+
+    return total_export_row_count, total_import_row_count
+
+
+def supports_transfer_mode(transfer_mode, source, target):
+    if transfer_mode == "stream":
+        return supports_streaming(source, target)
+    if transfer_mode == "fifo":
+        return supports_fifo(source, target)
+    return transfer_mode == "pipeline"
+
+
+def transfer_querys(
+    source,
+    target,
+    target_schema,
+    target_table,
+    querys,
+    temp_path_load,
+    file_name,
+    delimiter,
+    transfer_mode,
+    temp_compression=None,
+    keep_tempfiles=False,
+):
+    if transfer_mode == "stream":
+        return stream_querys(
+            source, target, target_schema, target_table, querys, delimiter
+        )
+
+    if transfer_mode == "fifo":
+        fifo_paths = get_export_file_paths(temp_path_load, file_name, len(querys))
+        return fifo_querys(
+            source, target, target_schema, target_table, querys, fifo_paths, delimiter
+        )
+
+    file_paths = get_export_file_paths(
+        temp_path_load, file_name, len(querys), temp_compression
+    )
+    return pipeline_querys(
+        source,
+        target,
+        target_schema,
+        target_table,
+        querys,
+        file_paths,
+        delimiter,
+        keep_tempfiles,
+    )
+
+
+def transfer_table(
+    return_code,
+    index,
+    total,
+    source,
+    source_schema,
+    source_table,
+    columns,
+    temp_path_load,
+    csv_delimiter,
+    target,
+    target_schema,
+    target_table_tmp,
+    replication_key=None,
+    max_replication_key=None,
+    parallelization_key=None,
+    parallelization_method=None,
+    transfer_mode="stream",
+    temp_compression=None,
+    keep_tempfiles=False,
+):
+    export_row_count = 0
+    import_row_count = 0
+    try:
+        querys = get_export_querys(
+            source,
+            source_schema,
+            source_table,
+            columns,
+            replication_key,
+            max_replication_key,
+            parallelization_key,
+            parallelization_method,
+        )
+        file_name = source._database + "_" + source_schema + "_" + source_table
+        export_row_count, import_row_count = transfer_querys(
+            source,
+            target,
+            target_schema,
+            target_table_tmp,
+            querys,
+            temp_path_load,
+            file_name,
+            csv_delimiter,
+            transfer_mode,
+            temp_compression,
+            keep_tempfiles,
+        )
+        return_code = "RUN"
+    except Exception as e:
+        logger.error(e)
+        return_code = "ERROR"
+        full_source_table = source_schema + "." + source_table
+        printer.print_load_line(
+            index, total, return_code, full_source_table, msg="failed to transfer"
+        )
+    finally:
+        return return_code, export_row_count, import_row_count
+
+
+def transfer_query(
+    return_code,
+    index,
+    total,
+    source,
+    load_name,
+    query,
+    temp_path_load,
+    csv_delimiter,
+    target,
+    target_schema,
+    target_table_tmp,
+    transfer_mode="stream",
+    temp_compression=None,
+    parallelization_key=None,
+    parallelization_method=None,
+    keep_tempfiles=False,
+):
+    export_row_count = 0
+    import_row_count = 0
+    try:
+        querys = get_query_export_querys(
+            source, query, parallelization_key, parallelization_method
+        )
+        export_row_count, import_row_count = transfer_querys(
+            source,
+            target,
+            target_schema,
+            target_table_tmp,
+            querys,
+            temp_path_load,
+            load_name,
+            csv_delimiter,
+            transfer_mode,
+            temp_compression,
+            keep_tempfiles,
+        )
+        return_code = "RUN"
+    except Exception as e:
+        logger.error(e)
+        return_code = "ERROR"
+        printer.print_load_line(
+            index, total, return_code, load_name, msg="failed to transfer"
+        )
+    finally:
+        return return_code, export_row_count, import_row_count
+
+
+def get_replication_slot_name(source_schema, source_table):
+    # Slot names may only have lower case letters, numbers and underscores
+    slot_name = "eneel_" + source_schema + "_" + source_table
+    return re.sub("[^a-z0-9_]", "_", slot_name.lower())[:63]
+
+
+def get_change_columns(columns):
+    # The columns of the change table, with the op of each row last
+    return columns + [(len(columns), LOG_BASED_OP_COLUMN, "str", 1, None, None)]
+
+
+def export_changes(
+    source, slot_name, full_source_table, columns, key_columns, file_path, delimiter
+):
+    # The last change of each key in the slot to a file in the postgres export
+    # format. Returns the lsn read up to, the rows and if the table was truncated
+    upto_lsn, changes = source.get_slot_changes(slot_name, full_source_table)
+    table_changes = []
+    truncated = False
+    for data in changes:
+        change = utils.parse_test_decoding(data)
+        if change is None or change[0].lower() != full_source_table.lower():
+            continue
+        table_name, action, new_values, old_values = change
+        if action == "TRUNCATE":
+            truncated = True
+            continue
+        table_changes.append((action, new_values, old_values))
+
+    if truncated:
+        return upto_lsn, 0, truncated
+
+    latest_changes = utils.get_latest_changes(table_changes, key_columns)
+    with open(file_path, "w", encoding="utf-8") as file:
+        for op, values in latest_changes:
+            row = [
+                utils.copy_text_value(values.get(column[1]), delimiter)
+                for column in columns
+            ]
+            file.write(delimiter.join(row + [op]) + "\n")
+    logger.debug(full_source_table + " changes: " + str(len(latest_changes)))
+    return upto_lsn, len(latest_changes), truncated
+
+
+def apply_changes_from_table_and_drop_tmp(
+    return_code,
+    index,
+    total,
+    target,
+    target_schema,
+    target_table,
+    target_table_tmp,
+    columns,
+    primary_key,
+    load_name=None,
+):
+    try:
+        return_code = target.apply_changes_from_table_and_drop(
+            target_schema,
+            target_table,
+            target_table_tmp,
+            [column[1] for column in columns],
+            primary_key,
+        )
+    except:
+        return_code = "ERROR"
+        printer.print_load_line(
+            index,
+            total,
+            "ERROR",
+            load_name,
+            msg="failed applying changes from temptable",
+        )
+    finally:
+        return return_code
+
+
+def get_diff_ranges(
+    source,
+    target,
+    source_schema,
+    source_table,
+    target_schema,
+    target_table,
+    columns,
+    parallelization_key,
+):
+    # Key ranges where the rows in the target differs from the source. The hashes
+    # are computed on both sides at the same time
+    min_max_batch = source.get_min_max_batch(
+        source_schema + "." + source_table, parallelization_key
+    )
+    if not min_max_batch or isinstance(min_max_batch[0], datetime.date):
+        raise Exception(parallelization_key + " can't be split in numeric ranges")
+    min_parallelization_key, max_parallelization_key, batch_size_key = min_max_batch
+
+    # The source rows are filtered as in the export
+    with ThreadExecutor(max_workers=2) as executor:
+        source_hashes = executor.submit(
+            source.get_range_hashes,
+            source_schema + "." + source_table,
+            columns,
+            parallelization_key,
+            min_parallelization_key,
+            batch_size_key,
+            source._table_where_clause,
+            source._limit_rows,
+        )
+        target_hashes = executor.submit(
+            target.get_range_hashes,
+            target_schema + "." + target_table,
+            columns,
+            parallelization_key,
+            min_parallelization_key,
+            batch_size_key,
+        )
+        source_hashes = source_hashes.result()
+        target_hashes = target_hashes.result()
+    if source_hashes is None or target_hashes is None:
+        raise Exception("Failed getting range hashes")
+
+    ranges = utils.get_changed_ranges(
+        source_hashes, target_hashes, min_parallelization_key, batch_size_key
+    )
+    logger.debug(
+        f"{source_schema}.{source_table} changed ranges: {len(ranges)} of {len(source_hashes)}"
+    )
+    return ranges
+
+
+def delete_missing_keys(
+    source, target, full_source_table, target_schema, target_table, columns, key_columns
+):
+    # Deletes the rows in the target whose keys are gone from the source. The keys
+    # are merged as two sorted streams. The deleted keys are collected first, since
+    # the target can't delete while its key stream is open
+    text_columns = [column[1] for column in columns if column[2] == "str"]
+    source_keys = source.stream_keys(
+        full_source_table, key_columns, text_columns=text_columns
+    )
+    target_keys = target.stream_keys(
+        target_schema + "." + target_table, key_columns, text_columns=text_columns
+    )
+    try:
+        # An empty source would delete the whole target
+        first_source_key = next(source_keys, None)
+        if first_source_key is None:
+            logger.debug(full_source_table + " has no keys. No rows deleted")
+            return 0
+        deleted_keys = list(
+            utils.get_deleted_keys(
+                itertools.chain([first_source_key], source_keys), target_keys
+            )
+        )
+    finally:
+        source_keys.close()
+        target_keys.close()
+    logger.debug(f"{full_source_table} deleted keys: {len(deleted_keys)}")
+
+    deleted_row_count = 0
+    for start in range(0, len(deleted_keys), DELETE_BATCH_SIZE):
+        row_count = target.delete_keys(
+            target_schema,
+            target_table,
+            key_columns,
+            deleted_keys[start : start + DELETE_BATCH_SIZE],
+        )
+        if row_count is None:
+            raise Exception(
+                "Failed deleting keys from " + target_schema + "." + target_table
+            )
+        deleted_row_count += row_count
+    return deleted_row_count
+
+
+def delete_missing_rows(
+    return_code,
+    index,
+    total,
+    source,
+    full_source_table,
+    target,
+    target_schema,
+    target_table,
+    columns,
+    key_columns,
+    load_name=None,
+):
+    try:
+        if not key_columns:
+            raise Exception("primary_key needed to detect deletes")
+        deleted_row_count = delete_missing_keys(
+            source,
+            target,
+            full_source_table,
+            target_schema,
+            target_table,
+            columns,
+            key_columns,
+        )
+        logger.debug(
+            target_schema
+            + "."
+            + target_table
+            + " deleted rows: "
+            + str(deleted_row_count)
+        )
+        return_code = "RUN"
+    except Exception as e:
+        logger.error(e)
+        return_code = "ERROR"
+        printer.print_load_line(
+            index, total, return_code, load_name, msg="failed deleting rows"
+        )
+    finally:
+        return return_code
+
+
+def get_table_fingerprint(source, source_schema, source_table):
+    # A cheap signal from the source catalog that changes when the table changes
+    if not hasattr(source, "get_table_fingerprint"):
+        return None
+    return source.get_table_fingerprint(source_schema, source_table)
+
+
+def is_table_unchanged(state_path, full_target_table, fingerprint):
+    if not fingerprint:
+        return False
+    load_state = state.read_state(state_path, full_target_table)
+    return load_state.get("fingerprint") == fingerprint
+
+
+def get_max_replication_key(
+    target, full_target_table, replication_key, state_path=None
+):
+    # The max replication key of the last load from the state, or from the target
+    if state_path:
+        load_state = state.read_state(state_path, full_target_table)
+        if load_state.get("replication_key") == replication_key and load_state.get(
+            "max_replication_key"
+        ):
+            logger.debug(full_target_table + " max " + replication_key + " from state")
+            return load_state["max_replication_key"]
+    return target.get_max_column_value(full_target_table, replication_key)
+
+
+def get_new_max_replication_key(
+    target, target_schema, target_table_tmp, replication_key, max_replication_key=None
+):
+    # The max replication key after the load, from the new rows in the temp table
+    new_max_replication_key = target.get_max_column_value(
+        target_schema + "." + target_table_tmp, replication_key
+    )
+    return new_max_replication_key or max_replication_key
+
+
+def save_max_replication_key(
+    state_path, full_target_table, replication_key, max_replication_key
+):
+    if not state_path:
+        return
+    if max_replication_key:
+        state.update_state(
+            state_path,
+            full_target_table,
+            replication_key=replication_key,
+            max_replication_key=str(max_replication_key),
+        )
+    else:
+        state.delete_state(state_path, full_target_table)
+
+
 def switch_table(
     return_code,
     index,
@@ -285,4 +1434,35 @@ def insert_from_table_and_drop_tmp(
             index, total, "ERROR", load_name, msg="failed import from temptable"
         )
     finally:
-        return return_code
\ No newline at end of file
+        return return_code
+
+
+def merge_from_table_and_drop_tmp(
+    return_code,
+    index,
+    total,
+    target,
+    target_schema,
+    target_table,
+    target_table_tmp,
+    columns,
+    primary_key,
+    replication_key=None,
+    load_name=None,
+):
+    try:
+        return_code = target.merge_from_table_and_drop(
+            target_schema,
+            target_table,
+            target_table_tmp,
+            [column[1] for column in columns],
+            primary_key,
+            replication_key,
+        )
+    except:
+        return_code = "ERROR"
+        printer.print_load_line(
+            index, total, "ERROR", load_name, msg="failed merge from temptable"
+        )
+    finally:
+        return return_code
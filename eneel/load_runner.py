@@ -1,6 +1,9 @@
 import eneel.utils as utils
 import eneel.load_strategies as load_strategies
+import eneel.load_functions as load_functions
 from concurrent.futures import ProcessPoolExecutor as ProcessExecutor
+from concurrent.futures import wait, FIRST_COMPLETED
+from multiprocessing import Manager
 import os
 import eneel.printer as printer
 from time import time
@@ -39,6 +42,8 @@ def run_project(project_name, connections_path=None, target=None):
     # Set number of workers
     if project.num_tables_to_load < workers:
         workers = project.num_tables_to_load
+    if project.batch_queue == "shared":
+        workers = project.batch_workers
     start_msg = (
         "Start loading "
         + str(project.num_tables_to_load)
@@ -73,11 +78,50 @@ def run_project(project_name, connections_path=None, target=None):
             for load in project.loads:
                 load["logdbs"] = None
 
+    # Order loads
+    loads = project.loads
+    if project.scheduling == "largest_first":
+        try:
+            source = config.connection_from_config(project.source_conninfo)
+            load_costs = get_load_costs(
+                project, source, logdb if project.logdb else None
+            )
+            source.close()
+            if any(cost is not None for cost in load_costs):
+                loads = order_loads_by_cost(loads, load_costs)
+                printer.print_output_line("Loads scheduled largest first")
+            else:
+                logger.warning("No load cost estimates. Loads in config order")
+        except Exception as e:
+            logger.debug(e)
+            logger.debug("Failed estimating load costs. Loads in config order")
+
+    # Session limits shared by all load processes
+    manager = None
+    if project.max_source_sessions or project.max_target_sessions:
+        manager = Manager()
+        source_sessions = None
+        target_sessions = None
+        if project.max_source_sessions:
+            source_sessions = manager.BoundedSemaphore(project.max_source_sessions)
+        if project.max_target_sessions:
+            target_sessions = manager.BoundedSemaphore(project.max_target_sessions)
+        for load in loads:
+            load.update(
+                {"source_sessions": source_sessions, "target_sessions": target_sessions}
+            )
+
     # Execute parallel load
     load_results = []
-    with ProcessExecutor(max_workers=workers) as executor:
-        for result in executor.map(run_load, project.loads):
-            load_results.append(result)
+    if project.batch_queue == "shared":
+        load_results = run_batch_queue(loads, workers)
+    else:
+        with ProcessExecutor(max_workers=workers) as executor:
+            for result in executor.map(run_load, loads):
+                load_results.append(result)
+
+    if manager:
+        manager.shutdown()
 
     # Parse result from parallel loads
     load_successes = 0
@@ -143,6 +187,483 @@ def run_project(project_name, connections_path=None, target=None):
 
 
 
+def get_load_target_table(project_load):
+    if project_load.get("schema"):
+        schema = project_load.get("schema")
+        table = project_load.get("table")
+        return (
+            schema.get("target_schema")
+            + "."
+            + schema.get("table_prefix", "")
+            + table.get("table_name")
+            + schema.get("table_suffix", "")
+        )
+    return (
+        project_load.get("target_schema")
+        + "."
+        + project_load.get("query").get("table_name")
+    )
+
+
+def get_load_costs(project, source, logdb=None):
+    # Seconds of the last successful run for loads with history. Other loads are
+    # estimated from the source row count and the rows/sec of the history. Row
+    # counts are only used as costs when no load has history, so the costs are
+    # never a mix of seconds and rows
+    load_durations = {}
+    history_rows = 0
+    history_seconds = 0
+    if logdb and hasattr(logdb, "get_load_durations"):
+        for target_table, seconds, imported_rows in logdb.get_load_durations(
+            project.logdb["schema"], project.logdb["table"], project.project_name
+        ):
+            load_durations[target_table] = seconds
+            if imported_rows and seconds > 0:
+                history_rows += imported_rows
+                history_seconds += seconds
+
+    rows_per_sec = None
+    if history_rows and history_seconds:
+        rows_per_sec = history_rows / history_seconds
+
+    load_costs = []
+    missing_costs = 0
+    for project_load in project.loads:
+        target_table = get_load_target_table(project_load)
+        cost = load_durations.get(target_table)
+        if (
+            cost is None
+            and project_load.get("schema")
+            and hasattr(source, "get_row_estimate")
+        ):
+            row_estimate = source.get_row_estimate(
+                project_load.get("schema").get("source_schema"),
+                project_load.get("table").get("table_name"),
+            )
+            if row_estimate is not None:
+                if rows_per_sec:
+                    cost = row_estimate / rows_per_sec
+                elif not load_durations:
+                    cost = row_estimate
+        if cost is None:
+            missing_costs += 1
+        load_costs.append(cost)
+        logger.debug(target_table + " estimated cost: " + str(cost))
+
+    if missing_costs:
+        logger.warning(
+            str(missing_costs)
+            + " of "
+            + str(len(load_costs))
+            + " loads have no cost estimate. They are scheduled at the median cost"
+        )
+
+    return load_costs
+
+
+def order_loads_by_cost(loads, load_costs):
+    # Longest processing time first. Loads without an estimate get the median cost
+    known_costs = sorted(cost for cost in load_costs if cost is not None)
+    if not known_costs:
+        return loads
+    median_cost = known_costs[len(known_costs) // 2]
+    load_costs = [median_cost if cost is None else cost for cost in load_costs]
+
+    ordered = sorted(zip(load_costs, range(len(loads))), key=lambda x: -x[0])
+    return [loads[i] for cost, i in ordered]
+
+
+# Connections reused by all batches a worker process runs
+_batch_connections = {}
+
+
+def get_batch_connection(role, conninfo, sessions=None):
+    database = _batch_connections.get(role)
+    if database is None:
+        database = config.connection_from_config(conninfo)
+        _batch_connections[role] = database
+    database._sessions = sessions
+    return database
+
+
+def run_batch_queue(loads, workers):
+    # All loads share one pool of workers. The batches of a load are queued as
+    # soon as it is prepared, and the load is finished when its last batch is done
+    load_results = []
+    load_states = {}
+
+    with ProcessExecutor(max_workers=workers) as executor:
+        steps = {}
+        for project_load in loads:
+            # Change data capture, diff and skipped loads are run in one step
+            table = project_load.get("table") or {}
+            if table.get("replication_method") in ("LOG_BASED", "DIFF") or table.get(
+                "skip_if_unchanged"
+            ):
+                future = executor.submit(run_load, project_load)
+                steps[future] = ("load", project_load.get("load_order"))
+                continue
+            future = executor.submit(prepare_load, project_load)
+            steps[future] = ("prepare", project_load.get("load_order"))
+
+        while steps:
+            done, not_done = wait(steps, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, load_order = steps.pop(future)
+
+                if step == "prepare":
+                    try:
+                        load_plan = future.result()
+                    except Exception as e:
+                        logger.error(e)
+                        load_plan = None
+                    if not load_plan or load_plan["return_code"] == "ERROR":
+                        load_results.append("ERROR")
+                        continue
+                    load_state = {
+                        "load_plan": load_plan,
+                        "return_code": "RUN",
+                        "export_row_count": 0,
+                        "import_row_count": 0,
+                        "batches": [],
+                    }
+                    load_states[load_order] = load_state
+                    for batch in load_plan["batches"]:
+                        batch_future = executor.submit(run_load_batch, load_plan, batch)
+                        steps[batch_future] = ("batch", load_order)
+                        load_state["batches"].append(batch_future)
+
+                elif step == "batch":
+                    load_state = load_states[load_order]
+                    load_state["batches"].remove(future)
+                    if not future.cancelled():
+                        try:
+                            (
+                                return_code,
+                                export_row_count,
+                                import_row_count,
+                            ) = future.result()
+                        except Exception as e:
+                            logger.error(e)
+                            return_code, export_row_count, import_row_count = (
+                                "ERROR",
+                                0,
+                                0,
+                            )
+                        load_state["export_row_count"] += export_row_count
+                        load_state["import_row_count"] += import_row_count
+                        # Skip the rest of a failed load
+                        if (
+                            return_code == "ERROR"
+                            and load_state["return_code"] != "ERROR"
+                        ):
+                            load_state["return_code"] = "ERROR"
+                            for batch_future in load_state["batches"]:
+                                batch_future.cancel()
+
+                else:
+                    try:
+                        load_results.append(future.result())
+                    except Exception as e:
+                        logger.error(e)
+                        load_results.append("ERROR")
+                    continue
+
+                # Finish the load when all its batches are done
+                load_state = load_states[load_order]
+                if not load_state["batches"]:
+                    finish_future = executor.submit(
+                        finish_load,
+                        load_state["load_plan"],
+                        load_state["return_code"],
+                        load_state["export_row_count"],
+                        load_state["import_row_count"],
+                    )
+                    steps[finish_future] = ("finish", load_order)
+
+    return load_results
+
+
+def prepare_load(project_load):
+    # Common attributes
+    index = project_load.get("load_order")
+    total = project_load.get("num_tables_to_load")
+    project_name = project_load.get("project_name")
+    project = project_load.get("project")
+    temp_path = project_load.get("temp_path")
+
+    load_plan = {
+        "project_load": project_load,
+        "return_code": "ERROR",
+        "start_time": time(),
+        "batches": [],
+    }
+
+    # Start logger. Seems to persist over load jobs when process are reused
+    import eneel.logger as logger
+
+    logger = logger.get_logger(project_name)
+
+    # Remove duplicated handler if any
+    for handler in logger.handlers[2:]:
+        logger.removeHandler(handler)
+
+    source = get_batch_connection(
+        "source",
+        project_load.get("source_conninfo"),
+        project_load.get("source_sessions"),
+    )
+    target = get_batch_connection(
+        "target",
+        project_load.get("target_conninfo"),
+        project_load.get("target_sessions"),
+    )
+
+    if project_load.get("schema"):
+        schema = project_load.get("schema")
+        table = project_load.get("table")
+
+        # Load details
+        source_schema = schema.get("source_schema")
+        target_schema = schema.get("target_schema")
+        source_table = table.get("table_name")
+        load_name = source_schema + "." + source_table
+        target_table = (
+            schema.get("table_prefix", "")
+            + table.get("table_name")
+            + schema.get("table_suffix", "")
+        )
+        query = None
+        file_name = source._database + "_" + source_schema + "_" + source_table
+        load_settings = table
+
+        # If source doesn't exist
+        if not source.check_table_exist(load_name):
+            printer.print_load_line(
+                index, total, "ERROR", load_name, msg="does not exist in source"
+            )
+            return load_plan
+
+        temp_path_load = os.path.join(temp_path, source_schema, source_table)
+
+        # Columns to load
+        columns = source.table_columns(source_schema, source_table)
+        columns = source.remove_unsupported_columns(columns)
+    else:
+        query_item = project_load.get("query")
+        source_schema = None
+        source_table = None
+        load_name = query_item.get("query_name")
+        query = query_item.get("query")
+        target_schema = project_load.get("target_schema")
+        target_table = query_item.get("table_name")
+        file_name = load_name
+        load_settings = query_item
+
+        temp_path_load = os.path.join(temp_path, "queries", load_name)
+
+        # Columns to load
+        columns = source.query_columns(query)
+
+    utils.delete_path(temp_path_load)
+    utils.create_path(temp_path_load)
+
+    # Load type and settings
+    replication_method = load_settings.get("replication_method", "FULL_TABLE")
+    parallelization_key = load_settings.get("parallelization_key")
+    parallelization_method = load_settings.get("parallelization_method")
+    replication_key = load_settings.get("replication_key")
+
+    printer.print_load_line(
+        index, total, "START", load_name + " (" + replication_method + ")"
+    )
+
+    if replication_method not in ("FULL_TABLE", "INCREMENTAL", "UPSERT"):
+        printer.print_load_line(
+            index, total, "ERROR", load_name, msg="replication_method not valid"
+        )
+        return load_plan
+
+    return_code, querys, finish_step = load_strategies.prepare_batches(
+        "START",
+        index,
+        total,
+        source,
+        source_schema,
+        source_table,
+        query,
+        columns,
+        target,
+        target_schema,
+        target_table,
+        load_name,
+        replication_method=replication_method,
+        replication_key=replication_key,
+        parallelization_key=parallelization_key,
+        parallelization_method=parallelization_method,
+        primary_key=load_settings.get("primary_key", []),
+        state_path=project.get("state_path"),
+    )
+
+    batch_id = 1
+    for query in querys:
+        load_plan["batches"].append(
+            {"query": query, "file_name": file_name + "_" + str(batch_id)}
+        )
+        batch_id += 1
+
+    load_plan.update(
+        {
+            "return_code": return_code,
+            "load_name": load_name,
+            "log_source_table": load_name if source_table else "query",
+            "target_schema": target_schema,
+            "target_table": target_table,
+            "temp_path_load": temp_path_load,
+            "finish_step": finish_step,
+            "columns": columns,
+            "primary_key": load_settings.get("primary_key"),
+            "replication_key": replication_key,
+            "delete_key": load_settings.get("primary_key", [])
+            if source_table and load_settings.get("detect_deletes")
+            else None,
+        }
+    )
+    return load_plan
+
+
+def run_load_batch(load_plan, batch):
+    # Export and import one batch of a load into its temp table
+    project_load = load_plan["project_load"]
+    project = project_load.get("project")
+
+    source = get_batch_connection(
+        "source",
+        project_load.get("source_conninfo"),
+        project_load.get("source_sessions"),
+    )
+    target = get_batch_connection(
+        "target",
+        project_load.get("target_conninfo"),
+        project_load.get("target_sessions"),
+    )
+
+    # A single batch in file mode is an export followed by an import
+    transfer_mode = project.get("transfer_mode", "file")
+    if not load_functions.supports_transfer_mode(transfer_mode, source, target):
+        transfer_mode = "pipeline"
+
+    return load_functions.transfer_query(
+        "RUN",
+        project_load.get("load_order"),
+        project_load.get("num_tables_to_load"),
+        source,
+        batch["file_name"],
+        batch["query"],
+        load_plan["temp_path_load"],
+        project.get("csv_delimiter", "|"),
+        target,
+        load_plan["target_schema"],
+        load_plan["target_table"] + "_tmp",
+        transfer_mode=transfer_mode,
+        temp_compression=project.get("temp_compression"),
+        keep_tempfiles=project.get("keep_tempfiles", False),
+    )
+
+
+def finish_load(load_plan, return_code, export_row_count, import_row_count):
+    project_load = load_plan["project_load"]
+    project = project_load.get("project")
+    index = project_load.get("load_order")
+    total = project_load.get("num_tables_to_load")
+    load_name = load_plan["load_name"]
+    target_schema = load_plan["target_schema"]
+    target_table = load_plan["target_table"]
+
+    target = get_batch_connection(
+        "target",
+        project_load.get("target_conninfo"),
+        project_load.get("target_sessions"),
+    )
+
+    if return_code != "ERROR":
+        return_code = load_strategies.finish_batches(
+            return_code,
+            index,
+            total,
+            target,
+            target_schema,
+            target_table,
+            load_name,
+            load_plan["finish_step"],
+            columns=load_plan["columns"],
+            primary_key=load_plan["primary_key"],
+            replication_key=load_plan["replication_key"],
+            state_path=project.get("state_path"),
+        )
+
+    # Rows deleted in the source
+    if (
+        return_code == "DONE"
+        and load_plan["delete_key"] is not None
+        and load_plan["finish_step"] != "switch"
+    ):
+        source = get_batch_connection(
+            "source",
+            project_load.get("source_conninfo"),
+            project_load.get("source_sessions"),
+        )
+        return_code = load_functions.delete_missing_rows(
+            return_code,
+            index,
+            total,
+            source,
+            load_name,
+            target,
+            target_schema,
+            target_table,
+            load_plan["columns"],
+            load_strategies.get_key_columns(load_plan["delete_key"]),
+            load_name,
+        )
+        if return_code == "RUN":
+            return_code = "DONE"
+
+    # delete temp folder
+    if not project.get("keep_tempfiles", False):
+        utils.delete_path(load_plan["temp_path_load"])
+
+    # Load end, and execution time
+    end_time = time()
+    execution_time = end_time - load_plan["start_time"]
+
+    printer.print_load_line(
+        index, total, return_code, load_name, str(import_row_count), execution_time
+    )
+
+    if project_load.get("logdb"):
+        logdb = config.connection_from_config(project_load.get("logdb")["conninfo"])
+
+        load_started_at = datetime.fromtimestamp(load_plan["start_time"])
+        load_ended_at = datetime.fromtimestamp(end_time)
+        logdb.log(
+            project_load.get("logdb")["schema"],
+            project_load.get("logdb")["table"],
+            project=project_load.get("project_name"),
+            project_started_at=project_load.get("project_started_at"),
+            source_table=load_plan["log_source_table"],
+            target_table=target_schema + "." + target_table,
+            started_at=load_started_at,
+            ended_at=load_ended_at,
+            status=return_code,
+            exported_rows=export_row_count,
+            imported_rows=import_row_count,
+        )
+        logdb.close()
+
+    return return_code
+
+
 def run_load(project_load):
     # Common attributes
     load_order = project_load.get("load_order")
@@ -186,7 +707,15 @@ def run_load(project_load):
     source = config.connection_from_config(source_conninfo)
     target = config.connection_from_config(target_conninfo)
 
+    # Project wide limits of concurrent export and import sessions
+    source._sessions = project_load.get("source_sessions")
+    target._sessions = project_load.get("target_sessions")
+
     csv_delimiter = project.get("csv_delimiter", "|")
+    transfer_mode = project.get("transfer_mode", "file")
+    temp_compression = project.get("temp_compression")
+    keep_tempfiles = project.get("keep_tempfiles", False)
+    state_path = project.get("state_path")
 
     if project_load.get("schema"):
         # Project and load info
@@ -226,7 +755,11 @@ def run_load(project_load):
         # Load type and settings
         replication_method = table.get("replication_method", "FULL_TABLE")
         parallelization_key = table.get("parallelization_key")
+        parallelization_method = table.get("parallelization_method")
         replication_key = table.get("replication_key")
+        delete_key = None
+        if table.get("detect_deletes"):
+            delete_key = table.get("primary_key", [])
 
         return_code = "START"
         table_msg = full_source_table + " (" + replication_method + ")"
@@ -248,6 +781,12 @@ def run_load(project_load):
                 target_schema,
                 target_table,
                 parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+                state_path=state_path,
+                skip_if_unchanged=table.get("skip_if_unchanged", False),
             )
 
         # Incremental replication
@@ -267,6 +806,95 @@ def run_load(project_load):
                 target_table,
                 replication_key=replication_key,
                 parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+                state_path=state_path,
+                delete_key=delete_key,
+            )
+
+        # Incremental replication merged on the primary key
+        elif replication_method == "UPSERT":
+            (
+                return_code,
+                export_row_count,
+                import_row_count,
+            ) = load_strategies.strategy_incremental(
+                return_code,
+                index,
+                total,
+                source,
+                source_schema,
+                source_table,
+                columns,
+                temp_path_load,
+                csv_delimiter,
+                target,
+                target_schema,
+                target_table,
+                replication_key=replication_key,
+                parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+                primary_key=table.get("primary_key", []),
+                state_path=state_path,
+                delete_key=delete_key,
+            )
+
+        # Only the key ranges that differs between source and target
+        elif replication_method == "DIFF":
+            (
+                return_code,
+                export_row_count,
+                import_row_count,
+            ) = load_strategies.strategy_diff(
+                return_code,
+                index,
+                total,
+                source,
+                source_schema,
+                source_table,
+                columns,
+                temp_path_load,
+                csv_delimiter,
+                target,
+                target_schema,
+                target_table,
+                parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+            )
+
+        # Change data capture from the source log
+        elif replication_method == "LOG_BASED":
+            (
+                return_code,
+                export_row_count,
+                import_row_count,
+            ) = load_strategies.strategy_log_based(
+                return_code,
+                index,
+                total,
+                source,
+                source_schema,
+                source_table,
+                columns,
+                temp_path_load,
+                csv_delimiter,
+                target,
+                target_schema,
+                target_table,
+                primary_key=table.get("primary_key"),
+                parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
             )
 
         else:
@@ -345,6 +973,7 @@ def run_load(project_load):
         # Load type and settings
         replication_method = query_item.get("replication_method", "FULL_TABLE")
         parallelization_key = query_item.get("parallelization_key")
+        parallelization_method = query_item.get("parallelization_method")
         replication_key = query_item.get("replication_key")
 
         return_code = "START"
@@ -367,16 +996,67 @@ def run_load(project_load):
                 target_schema,
                 target_table,
                 parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
             )
 
         # Incremental replication
         elif replication_method == "INCREMENTAL":
-            printer.print_load_line(
+            (
+                return_code,
+                export_row_count,
+                import_row_count,
+            ) = load_strategies.strategy_incremental_query(
+                return_code,
                 index,
                 total,
-                "ERROR",
+                source,
                 query_name,
-                msg="INCREMENTAL not implemented for queries",
+                query,
+                columns,
+                temp_path_load,
+                csv_delimiter,
+                target,
+                target_schema,
+                target_table,
+                replication_key=replication_key,
+                parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+                state_path=state_path,
+            )
+
+        # Incremental replication merged on the primary key
+        elif replication_method == "UPSERT":
+            (
+                return_code,
+                export_row_count,
+                import_row_count,
+            ) = load_strategies.strategy_incremental_query(
+                return_code,
+                index,
+                total,
+                source,
+                query_name,
+                query,
+                columns,
+                temp_path_load,
+                csv_delimiter,
+                target,
+                target_schema,
+                target_table,
+                replication_key=replication_key,
+                parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+                primary_key=query_item.get("primary_key", []),
+                state_path=state_path,
             )
 
         else:
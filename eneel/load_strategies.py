@@ -1,61 +1,51 @@
 import eneel.load_functions as load_functions
 import eneel.printer as printer
+import eneel.state as state
 
 import logging
 
 logger = logging.getLogger("main_logger")
 
 
-def strategy_full_table_load(
+def get_key_columns(primary_key):
+    # A primary_key of one column or a list of columns
+    if not primary_key:
+        return []
+    if isinstance(primary_key, str):
+        return [primary_key]
+    return list(primary_key)
+
+
+def load_temp_table(
     return_code,
     index,
     total,
     source,
     source_schema,
     source_table,
+    query,
     columns,
     temp_path_load,
     csv_delimiter,
     target,
     target_schema,
-    target_table,
-    parallelization_key,
+    target_table_tmp,
+    load_name,
+    replication_key=None,
+    max_replication_key=None,
+    parallelization_key=None,
+    parallelization_method=None,
+    transfer_mode="file",
+    temp_compression=None,
+    keep_tempfiles=False,
 ):
     # Set initial returns
     return_code = "ERROR"
     export_row_count = 0
     import_row_count = 0
 
-    # Full source table
-    full_source_table = source_schema + "." + source_table
-
-    try:
-        # Temp table
-        target_table_tmp = target_table + "_tmp"
-
-        # Export table
-        try:
-            return_code, temp_path_load, delimiter, export_row_count = load_functions.export_table(
-                return_code,
-                index,
-                total,
-                source,
-                source_schema,
-                source_table,
-                columns,
-                temp_path_load,
-                csv_delimiter,
-                replication_key=None,
-                max_replication_key=None,
-                parallelization_key=parallelization_key,
-            )
-        except Exception as e:
-            logger.error(e)
-            return_code = "ERROR"
-
-        if return_code == "ERROR":
-            return return_code, export_row_count, import_row_count
-
+    # Direct transfers need the temp table before the export starts
+    if load_functions.supports_transfer_mode(transfer_mode, source, target):
         # Create temp table
         try:
             return_code = load_functions.create_temp_table(
@@ -66,7 +56,7 @@ def strategy_full_table_load(
                 target_schema,
                 target_table_tmp,
                 columns,
-                full_source_table,
+                load_name,
             )
         except Exception as e:
             logger.error(e)
@@ -75,22 +65,231 @@ def strategy_full_table_load(
         if return_code == "ERROR":
             return return_code, export_row_count, import_row_count
 
-        # Import into temp table
+        # Transfer from source into temp table
         try:
-            return_code, import_row_count = load_functions.import_into_temp_table(
+            if query:
+                (
+                    return_code,
+                    export_row_count,
+                    import_row_count,
+                ) = load_functions.transfer_query(
+                    return_code,
+                    index,
+                    total,
+                    source,
+                    load_name,
+                    query,
+                    temp_path_load,
+                    csv_delimiter,
+                    target,
+                    target_schema,
+                    target_table_tmp,
+                    transfer_mode=transfer_mode,
+                    temp_compression=temp_compression,
+                    keep_tempfiles=keep_tempfiles,
+                    parallelization_key=parallelization_key,
+                    parallelization_method=parallelization_method,
+                )
+            else:
+                (
+                    return_code,
+                    export_row_count,
+                    import_row_count,
+                ) = load_functions.transfer_table(
+                    return_code,
+                    index,
+                    total,
+                    source,
+                    source_schema,
+                    source_table,
+                    columns,
+                    temp_path_load,
+                    csv_delimiter,
+                    target,
+                    target_schema,
+                    target_table_tmp,
+                    replication_key=replication_key,
+                    max_replication_key=max_replication_key,
+                    parallelization_key=parallelization_key,
+                    parallelization_method=parallelization_method,
+                    transfer_mode=transfer_mode,
+                    temp_compression=temp_compression,
+                    keep_tempfiles=keep_tempfiles,
+                )
+        except Exception as e:
+            logger.error(e)
+            return_code = "ERROR"
+
+        return return_code, export_row_count, import_row_count
+
+    # Export table
+    try:
+        if query:
+            (
+                return_code,
+                temp_path_load,
+                delimiter,
+                export_row_count,
+            ) = load_functions.export_query(
                 return_code,
                 index,
                 total,
-                target,
-                target_schema,
-                target_table_tmp,
+                source,
+                load_name,
+                query,
+                temp_path_load,
+                csv_delimiter,
+                parallelization_key,
+                temp_compression=temp_compression,
+                parallelization_method=parallelization_method,
+            )
+        else:
+            (
+                return_code,
                 temp_path_load,
                 delimiter,
-                full_source_table,
+                export_row_count,
+            ) = load_functions.export_table(
+                return_code,
+                index,
+                total,
+                source,
+                source_schema,
+                source_table,
+                columns,
+                temp_path_load,
+                csv_delimiter,
+                replication_key=replication_key,
+                max_replication_key=max_replication_key,
+                parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                temp_compression=temp_compression,
             )
-        except Exception as e:
-            logger.error(e)
-            return_code = "ERROR"
+    except Exception as e:
+        logger.error(e)
+        return_code = "ERROR"
+
+    if return_code == "ERROR":
+        return return_code, export_row_count, import_row_count
+
+    # Create temp table
+    try:
+        return_code = load_functions.create_temp_table(
+            return_code,
+            index,
+            total,
+            target,
+            target_schema,
+            target_table_tmp,
+            columns,
+            load_name,
+        )
+    except Exception as e:
+        logger.error(e)
+        return_code = "ERROR"
+
+    if return_code == "ERROR":
+        return return_code, export_row_count, import_row_count
+
+    # Import into temp table
+    try:
+        return_code, import_row_count = load_functions.import_into_temp_table(
+            return_code,
+            index,
+            total,
+            target,
+            target_schema,
+            target_table_tmp,
+            temp_path_load,
+            delimiter,
+            load_name,
+        )
+    except Exception as e:
+        logger.error(e)
+        return_code = "ERROR"
+
+    return return_code, export_row_count, import_row_count
+
+
+def strategy_full_table_load(
+    return_code,
+    index,
+    total,
+    source,
+    source_schema,
+    source_table,
+    columns,
+    temp_path_load,
+    csv_delimiter,
+    target,
+    target_schema,
+    target_table,
+    parallelization_key,
+    parallelization_method=None,
+    transfer_mode="file",
+    temp_compression=None,
+    keep_tempfiles=False,
+    state_path=None,
+    skip_if_unchanged=False,
+):
+    # Set initial returns
+    return_code = "ERROR"
+    export_row_count = 0
+    import_row_count = 0
+
+    # Full source table
+    full_source_table = source_schema + "." + source_table
+
+    try:
+        # Temp table
+        target_table_tmp = target_table + "_tmp"
+
+        full_target_table = target_schema + "." + target_table
+
+        # Skip the load if the source is unchanged since the last load. The
+        # fingerprint is taken first, so changes during the load are seen next run
+        fingerprint = None
+        if skip_if_unchanged and state_path:
+            fingerprint = load_functions.get_table_fingerprint(
+                source, source_schema, source_table
+            )
+            if target.check_table_exist(
+                full_target_table
+            ) and load_functions.is_table_unchanged(
+                state_path, full_target_table, fingerprint
+            ):
+                printer.print_load_line(
+                    index,
+                    total,
+                    "RUN",
+                    full_source_table,
+                    msg="unchanged since last load. Skipped",
+                )
+                return_code = "DONE"
+                return return_code, export_row_count, import_row_count
+
+        # Export and import into temp table
+        return_code, export_row_count, import_row_count = load_temp_table(
+            return_code,
+            index,
+            total,
+            source,
+            source_schema,
+            source_table,
+            None,
+            columns,
+            temp_path_load,
+            csv_delimiter,
+            target,
+            target_schema,
+            target_table_tmp,
+            full_source_table,
+            parallelization_key=parallelization_key,
+            parallelization_method=parallelization_method,
+            transfer_mode=transfer_mode,
+            temp_compression=temp_compression,
+            keep_tempfiles=keep_tempfiles,
+        )
 
         if return_code == "ERROR":
             return return_code, export_row_count, import_row_count
@@ -114,6 +313,9 @@ def strategy_full_table_load(
         if return_code == "ERROR":
             return return_code, export_row_count, import_row_count
 
+        if fingerprint:
+            state.update_state(state_path, full_target_table, fingerprint=fingerprint)
+
         # Return success
         if return_code == "RUN":
             return_code = "DONE"
@@ -140,6 +342,10 @@ def strategy_full_query_load(
     target_schema,
     target_table,
     parallelization_key=None,
+    parallelization_method=None,
+    transfer_mode="file",
+    temp_compression=None,
+    keep_tempfiles=False,
 ):
     # Set initial returns
     return_code = "ERROR"
@@ -150,60 +356,28 @@ def strategy_full_query_load(
         # Temp table
         target_table_tmp = target_table + "_tmp"
 
-        # Export table
-        try:
-            return_code, temp_path_load, delimiter, export_row_count = load_functions.export_query(
-                return_code,
-                index,
-                total,
-                source,
-                query_name,
-                query,
-                temp_path_load,
-                csv_delimiter,
-                parallelization_key,
-            )
-        except Exception as e:
-            logger.error(e)
-            return_code = "ERROR"
-
-        if return_code == "ERROR":
-            return return_code, export_row_count, import_row_count
-
-        # Create temp table
-        try:
-            return_code = load_functions.create_temp_table(
-                return_code,
-                index,
-                total,
-                target,
-                target_schema,
-                target_table_tmp,
-                columns,
-                query_name,
-            )
-        except Exception as e:
-            logger.error(e)
-            return_code = "ERROR"
-
-        if return_code == "ERROR":
-            return return_code, export_row_count, import_row_count
-
-        # Import into temp table
-        try:
-            return_code, import_row_count = load_functions.import_into_temp_table(
-                return_code,
-                index,
-                total,
-                target,
-                target_schema,
-                target_table_tmp,
-                temp_path_load,
-                delimiter,
-            )
-        except Exception as e:
-            logger.error(e)
-            return_code = "ERROR"
+        # Export and import into temp table
+        return_code, export_row_count, import_row_count = load_temp_table(
+            return_code,
+            index,
+            total,
+            source,
+            None,
+            None,
+            query,
+            columns,
+            temp_path_load,
+            csv_delimiter,
+            target,
+            target_schema,
+            target_table_tmp,
+            query_name,
+            parallelization_key=parallelization_key,
+            parallelization_method=parallelization_method,
+            transfer_mode=transfer_mode,
+            temp_compression=temp_compression,
+            keep_tempfiles=keep_tempfiles,
+        )
 
         if return_code == "ERROR":
             return return_code, export_row_count, import_row_count
@@ -251,6 +425,13 @@ def strategy_incremental(
     target_table,
     replication_key=None,
     parallelization_key=None,
+    parallelization_method=None,
+    transfer_mode="file",
+    temp_compression=None,
+    keep_tempfiles=False,
+    primary_key=None,
+    state_path=None,
+    delete_key=None,
 ):
     # Set initial returns
     return_code = "ERROR"
@@ -285,10 +466,25 @@ def strategy_incremental(
             )
             return return_code, export_row_count, import_row_count
 
+        # Upserts needs the primary key columns
+        key_columns = get_key_columns(primary_key)
+        column_names = [column[1] for column in columns]
+        if primary_key is not None and (
+            not key_columns or not set(key_columns).issubset(column_names)
+        ):
+            printer.print_load_line(
+                index,
+                total,
+                return_code,
+                full_source_table,
+                msg="primary key not found in table",
+            )
+            return return_code, export_row_count, import_row_count
+
         # Get max replication key in target
         if target.check_table_exist(full_target_table):
-            max_replication_key = target.get_max_column_value(
-                full_target_table, replication_key
+            max_replication_key = load_functions.get_max_replication_key(
+                target, full_target_table, replication_key, state_path
             )
             logger.debug(full_target_table + ' Max ' + replication_key + ' = ' + max_replication_key)
 
@@ -318,44 +514,83 @@ def strategy_incremental(
                 target_schema,
                 target_table,
                 parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+            )
+
+            # The next load starts from the max in the target
+            load_functions.save_max_replication_key(
+                state_path, full_target_table, replication_key, None
             )
 
         else:
-            # Export new rows
-            try:
-                return_code, temp_path_load, delimiter, export_row_count = load_functions.export_table(
-                    return_code,
-                    index,
-                    total,
-                    source,
-                    source_schema,
-                    source_table,
-                    columns,
-                    temp_path_load,
-                    csv_delimiter,
-                    replication_key=replication_key,
-                    max_replication_key=max_replication_key,
-                    parallelization_key=parallelization_key,
-                )
-            except Exception as e:
-                logger.error(e)
-                return_code = "ERROR"
+            # Export new rows and import into temp table
+            return_code, export_row_count, import_row_count = load_temp_table(
+                return_code,
+                index,
+                total,
+                source,
+                source_schema,
+                source_table,
+                None,
+                columns,
+                temp_path_load,
+                csv_delimiter,
+                target,
+                target_schema,
+                target_table_tmp,
+                full_source_table,
+                replication_key=replication_key,
+                max_replication_key=max_replication_key,
+                parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+            )
 
             if return_code == "ERROR":
                 return return_code, export_row_count, import_row_count
 
-            # Create temp table
-            try:
-                return_code = load_functions.create_temp_table(
-                    return_code,
-                    index,
-                    total,
+            # New max replication key for the state
+            if state_path:
+                max_replication_key = load_functions.get_new_max_replication_key(
                     target,
                     target_schema,
                     target_table_tmp,
-                    columns,
-                    full_source_table,
+                    replication_key,
+                    max_replication_key,
                 )
+
+            # Merge on the primary key, or insert into, and drop
+            try:
+                if key_columns:
+                    return_code = load_functions.merge_from_table_and_drop_tmp(
+                        return_code,
+                        index,
+                        total,
+                        target,
+                        target_schema,
+                        target_table,
+                        target_table_tmp,
+                        columns,
+                        key_columns,
+                        replication_key,
+                        full_source_table,
+                    )
+                else:
+                    return_code = load_functions.insert_from_table_and_drop_tmp(
+                        return_code,
+                        index,
+                        total,
+                        target,
+                        target_schema,
+                        target_table,
+                        target_table_tmp,
+                        full_source_table,
+                    )
             except Exception as e:
                 logger.error(e)
                 return_code = "ERROR"
@@ -363,38 +598,220 @@ def strategy_incremental(
             if return_code == "ERROR":
                 return return_code, export_row_count, import_row_count
 
-            # Import into temp table
-            try:
-                return_code, import_row_count = load_functions.import_into_temp_table(
-                    return_code,
+            load_functions.save_max_replication_key(
+                state_path, full_target_table, replication_key, max_replication_key
+            )
+
+            # Rows deleted in the source
+            if delete_key is not None:
+                return_code = load_functions.delete_missing_rows(
+                    return_code,
                     index,
                     total,
+                    source,
+                    full_source_table,
                     target,
                     target_schema,
-                    target_table_tmp,
-                    temp_path_load,
-                    delimiter,
+                    target_table,
+                    columns,
+                    get_key_columns(delete_key),
                     full_source_table,
                 )
-            except Exception as e:
-                logger.error(e)
-                return_code = "ERROR"
+                if return_code == "ERROR":
+                    return return_code, export_row_count, import_row_count
+
+            # Return success
+            if return_code == "RUN":
+                return_code = "DONE"
+    except:
+        printer.print_load_line(
+            index, total, return_code, full_source_table, msg="load failed"
+        )
+    finally:
+        return return_code, export_row_count, import_row_count
+
+
+def strategy_incremental_query(
+    return_code,
+    index,
+    total,
+    source,
+    query_name,
+    query,
+    columns,
+    temp_path_load,
+    csv_delimiter,
+    target,
+    target_schema,
+    target_table,
+    replication_key=None,
+    parallelization_key=None,
+    parallelization_method=None,
+    transfer_mode="file",
+    temp_compression=None,
+    keep_tempfiles=False,
+    primary_key=None,
+    state_path=None,
+):
+    # Set initial returns
+    return_code = "ERROR"
+    export_row_count = 0
+    import_row_count = 0
+
+    try:
+        # Temp table
+        target_table_tmp = target_table + "_tmp"
+
+        full_target_table = target_schema + "." + target_table
+
+        if not replication_key:
+            printer.print_load_line(
+                index, total, return_code, query_name, msg="replication key not defined"
+            )
+            return return_code, export_row_count, import_row_count
+
+        if replication_key not in [column[1] for column in columns]:
+            printer.print_load_line(
+                index,
+                total,
+                return_code,
+                query_name,
+                msg="replication key not found in query",
+            )
+            return return_code, export_row_count, import_row_count
+
+        # Upserts needs the primary key columns
+        key_columns = get_key_columns(primary_key)
+        column_names = [column[1] for column in columns]
+        if primary_key is not None and (
+            not key_columns or not set(key_columns).issubset(column_names)
+        ):
+            printer.print_load_line(
+                index,
+                total,
+                return_code,
+                query_name,
+                msg="primary key not found in query",
+            )
+            return return_code, export_row_count, import_row_count
+
+        # Get max replication key in target
+        if target.check_table_exist(full_target_table):
+            max_replication_key = load_functions.get_max_replication_key(
+                target, full_target_table, replication_key, state_path
+            )
+            logger.debug(
+                full_target_table
+                + " Max "
+                + replication_key
+                + " = "
+                + max_replication_key
+            )
+
+        else:
+            max_replication_key = None
+            printer.print_load_line(
+                index,
+                total,
+                "RUN",
+                full_target_table,
+                msg="does not exist in target. Starts FULL_TABLE load",
+            )
+
+        # If no max replication key, do full load
+        if not max_replication_key:
+            return_code, export_row_count, import_row_count = strategy_full_query_load(
+                return_code,
+                index,
+                total,
+                source,
+                query_name,
+                query,
+                columns,
+                temp_path_load,
+                csv_delimiter,
+                target,
+                target_schema,
+                target_table,
+                parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+            )
+
+            # The next load starts from the max in the target
+            load_functions.save_max_replication_key(
+                state_path, full_target_table, replication_key, None
+            )
+
+        else:
+            # Export new rows of the query and import into temp table
+            incremental_query = load_functions.get_incremental_query(
+                query, columns, replication_key, max_replication_key
+            )
+            return_code, export_row_count, import_row_count = load_temp_table(
+                return_code,
+                index,
+                total,
+                source,
+                None,
+                None,
+                incremental_query,
+                columns,
+                temp_path_load,
+                csv_delimiter,
+                target,
+                target_schema,
+                target_table_tmp,
+                query_name,
+                parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+            )
 
             if return_code == "ERROR":
                 return return_code, export_row_count, import_row_count
 
-            # Insert into and drop
-            try:
-                return_code = load_functions.insert_from_table_and_drop_tmp(
-                    return_code,
-                    index,
-                    total,
+            # New max replication key for the state
+            if state_path:
+                max_replication_key = load_functions.get_new_max_replication_key(
                     target,
                     target_schema,
-                    target_table,
                     target_table_tmp,
-                    full_source_table,
+                    replication_key,
+                    max_replication_key,
                 )
+
+            # Merge on the primary key, or insert into, and drop
+            try:
+                if key_columns:
+                    return_code = load_functions.merge_from_table_and_drop_tmp(
+                        return_code,
+                        index,
+                        total,
+                        target,
+                        target_schema,
+                        target_table,
+                        target_table_tmp,
+                        columns,
+                        key_columns,
+                        replication_key,
+                        query_name,
+                    )
+                else:
+                    return_code = load_functions.insert_from_table_and_drop_tmp(
+                        return_code,
+                        index,
+                        total,
+                        target,
+                        target_schema,
+                        target_table,
+                        target_table_tmp,
+                        query_name,
+                    )
             except Exception as e:
                 logger.error(e)
                 return_code = "ERROR"
@@ -402,12 +819,570 @@ def strategy_incremental(
             if return_code == "ERROR":
                 return return_code, export_row_count, import_row_count
 
+            load_functions.save_max_replication_key(
+                state_path, full_target_table, replication_key, max_replication_key
+            )
+
             # Return success
             if return_code == "RUN":
                 return_code = "DONE"
     except:
+        printer.print_load_line(
+            index, total, return_code, query_name, msg="load failed"
+        )
+    finally:
+        return return_code, export_row_count, import_row_count
+
+
+def strategy_log_based(
+    return_code,
+    index,
+    total,
+    source,
+    source_schema,
+    source_table,
+    columns,
+    temp_path_load,
+    csv_delimiter,
+    target,
+    target_schema,
+    target_table,
+    primary_key=None,
+    parallelization_key=None,
+    parallelization_method=None,
+    transfer_mode="file",
+    temp_compression=None,
+    keep_tempfiles=False,
+):
+    # Set initial returns
+    return_code = "ERROR"
+    export_row_count = 0
+    import_row_count = 0
+
+    full_source_table = source_schema + "." + source_table
+
+    try:
+        # Temp table
+        target_table_tmp = target_table + "_tmp"
+
+        full_target_table = target_schema + "." + target_table
+
+        if not hasattr(source, "get_slot_changes"):
+            printer.print_load_line(
+                index,
+                total,
+                return_code,
+                full_source_table,
+                msg="LOG_BASED not supported by source",
+            )
+            return return_code, export_row_count, import_row_count
+
+        key_columns = get_key_columns(primary_key)
+        if not key_columns or not set(key_columns).issubset(
+            [column[1] for column in columns]
+        ):
+            printer.print_load_line(
+                index,
+                total,
+                return_code,
+                full_source_table,
+                msg="primary key not found in table",
+            )
+            return return_code, export_row_count, import_row_count
+
+        # The slot is created before the first full load, so no changes are missed
+        slot_name = load_functions.get_replication_slot_name(
+            source_schema, source_table
+        )
+        if not source.get_replication_slot(slot_name):
+            printer.print_load_line(
+                index,
+                total,
+                return_code,
+                full_source_table,
+                msg="failed getting replication slot",
+            )
+            return return_code, export_row_count, import_row_count
+
+        upto_lsn = None
+        truncated = False
+        if target.check_table_exist(full_target_table):
+            file_path = load_functions.get_export_file_paths(
+                temp_path_load, slot_name, 1
+            )[0]
+            upto_lsn, export_row_count, truncated = load_functions.export_changes(
+                source,
+                slot_name,
+                full_source_table,
+                columns,
+                key_columns,
+                file_path,
+                csv_delimiter,
+            )
+        else:
+            printer.print_load_line(
+                index,
+                total,
+                "RUN",
+                full_target_table,
+                msg="does not exist in target. Starts FULL_TABLE load",
+            )
+
+        # Full load the first time, and when the source table has been truncated
+        if not upto_lsn or truncated:
+            return_code, export_row_count, import_row_count = strategy_full_table_load(
+                return_code,
+                index,
+                total,
+                source,
+                source_schema,
+                source_table,
+                columns,
+                temp_path_load,
+                csv_delimiter,
+                target,
+                target_schema,
+                target_table,
+                parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+            )
+            if return_code == "ERROR":
+                return return_code, export_row_count, import_row_count
+            return_code = "RUN"
+
+        elif export_row_count:
+            # Changes into temp table, with the op of each row
+            change_columns = load_functions.get_change_columns(columns)
+            return_code = load_functions.create_temp_table(
+                return_code,
+                index,
+                total,
+                target,
+                target_schema,
+                target_table_tmp,
+                change_columns,
+                full_source_table,
+            )
+            if return_code == "ERROR":
+                return return_code, export_row_count, import_row_count
+
+            return_code, import_row_count = load_functions.import_into_temp_table(
+                return_code,
+                index,
+                total,
+                target,
+                target_schema,
+                target_table_tmp,
+                temp_path_load,
+                csv_delimiter,
+                full_source_table,
+            )
+            if return_code == "ERROR":
+                return return_code, export_row_count, import_row_count
+
+            # Delete and insert the changed rows
+            return_code = load_functions.apply_changes_from_table_and_drop_tmp(
+                return_code,
+                index,
+                total,
+                target,
+                target_schema,
+                target_table,
+                target_table_tmp,
+                columns,
+                key_columns,
+                full_source_table,
+            )
+            if return_code == "ERROR":
+                return return_code, export_row_count, import_row_count
+
+        else:
+            return_code = "RUN"
+
+        # Applied changes are removed from the slot
+        if upto_lsn:
+            return_code = source.advance_replication_slot(slot_name, upto_lsn)
+            if return_code == "ERROR":
+                return return_code, export_row_count, import_row_count
+
+        # Return success
+        if return_code == "RUN":
+            return_code = "DONE"
+    except Exception as e:
+        logger.error(e)
+        return_code = "ERROR"
         printer.print_load_line(
             index, total, return_code, full_source_table, msg="load failed"
         )
     finally:
         return return_code, export_row_count, import_row_count
+
+
+def strategy_diff(
+    return_code,
+    index,
+    total,
+    source,
+    source_schema,
+    source_table,
+    columns,
+    temp_path_load,
+    csv_delimiter,
+    target,
+    target_schema,
+    target_table,
+    parallelization_key=None,
+    parallelization_method=None,
+    transfer_mode="file",
+    temp_compression=None,
+    keep_tempfiles=False,
+):
+    # Set initial returns
+    return_code = "ERROR"
+    export_row_count = 0
+    import_row_count = 0
+
+    full_source_table = source_schema + "." + source_table
+
+    try:
+        # Temp table
+        target_table_tmp = target_table + "_tmp"
+
+        full_target_table = target_schema + "." + target_table
+
+        # Hashes are only comparable when computed the same way on both sides
+        if (
+            not hasattr(source, "get_range_hashes")
+            or source._dialect != target._dialect
+        ):
+            printer.print_load_line(
+                index,
+                total,
+                return_code,
+                full_source_table,
+                msg="DIFF needs source and target of the same database type",
+            )
+            return return_code, export_row_count, import_row_count
+
+        if not parallelization_key:
+            printer.print_load_line(
+                index,
+                total,
+                return_code,
+                full_source_table,
+                msg="parallelization key not defined",
+            )
+            return return_code, export_row_count, import_row_count
+
+        if not target.check_table_exist(full_target_table):
+            printer.print_load_line(
+                index,
+                total,
+                "RUN",
+                full_target_table,
+                msg="does not exist in target. Starts FULL_TABLE load",
+            )
+            return_code, export_row_count, import_row_count = strategy_full_table_load(
+                return_code,
+                index,
+                total,
+                source,
+                source_schema,
+                source_table,
+                columns,
+                temp_path_load,
+                csv_delimiter,
+                target,
+                target_schema,
+                target_table,
+                parallelization_key=parallelization_key,
+                parallelization_method=parallelization_method,
+                transfer_mode=transfer_mode,
+                temp_compression=temp_compression,
+                keep_tempfiles=keep_tempfiles,
+            )
+            return return_code, export_row_count, import_row_count
+
+        # Only the ranges with other hashes in the target are loaded
+        ranges = load_functions.get_diff_ranges(
+            source,
+            target,
+            source_schema,
+            source_table,
+            target_schema,
+            target_table,
+            columns,
+            parallelization_key,
+        )
+        if not ranges:
+            return_code = "DONE"
+            return return_code, export_row_count, import_row_count
+
+        wheres = [
+            load_functions.get_range_where(parallelization_key, batch_range)
+            for batch_range in ranges
+        ]
+        querys = [
+            source.generate_export_query(
+                columns, source_schema, source_table, parallelization_where=where
+            )
+            for where in wheres
+        ]
+        file_name = source._database + "_" + source_schema + "_" + source_table
+        file_paths = load_functions.get_export_file_paths(
+            temp_path_load, file_name, len(querys), temp_compression
+        )
+        export_row_count = load_functions.run_export_querys(
+            source, querys, file_paths, csv_delimiter
+        )
+
+        return_code = load_functions.create_temp_table(
+            return_code,
+            index,
+            total,
+            target,
+            target_schema,
+            target_table_tmp,
+            columns,
+            full_source_table,
+        )
+        if return_code == "ERROR":
+            return return_code, export_row_count, import_row_count
+
+        return_code, import_row_count = load_functions.import_into_temp_table(
+            return_code,
+            index,
+            total,
+            target,
+            target_schema,
+            target_table_tmp,
+            temp_path_load,
+            csv_delimiter,
+            full_source_table,
+        )
+        if return_code == "ERROR":
+            return return_code, export_row_count, import_row_count
+
+        # Replace the changed ranges
+        return_code = target.replace_ranges_from_table_and_drop(
+            target_schema, target_table, target_table_tmp, wheres
+        )
+        if return_code == "ERROR":
+            return return_code, export_row_count, import_row_count
+
+        # Return success
+        if return_code == "RUN":
+            return_code = "DONE"
+    except Exception as e:
+        logger.error(e)
+        return_code = "ERROR"
+        printer.print_load_line(
+            index, total, return_code, full_source_table, msg="load failed"
+        )
+    finally:
+        return return_code, export_row_count, import_row_count
+
+
+def prepare_batches(
+    return_code,
+    index,
+    total,
+    source,
+    source_schema,
+    source_table,
+    query,
+    columns,
+    target,
+    target_schema,
+    target_table,
+    load_name,
+    replication_method="FULL_TABLE",
+    replication_key=None,
+    parallelization_key=None,
+    parallelization_method=None,
+    primary_key=None,
+    state_path=None,
+):
+    # First step of a load in the shared batch queue. Creates the temp table and
+    # returns the export querys and how the temp table is finished
+    return_code = "ERROR"
+    querys = []
+    finish_step = "switch"
+    max_replication_key = None
+
+    target_table_tmp = target_table + "_tmp"
+    full_target_table = target_schema + "." + target_table
+
+    try:
+        if replication_method in ("INCREMENTAL", "UPSERT"):
+            if not replication_key:
+                printer.print_load_line(
+                    index,
+                    total,
+                    return_code,
+                    load_name,
+                    msg="replication key not defined",
+                )
+                return return_code, querys, finish_step
+
+            if replication_key not in [column[1] for column in columns]:
+                printer.print_load_line(
+                    index,
+                    total,
+                    return_code,
+                    load_name,
+                    msg="replication key not found in table",
+                )
+                return return_code, querys, finish_step
+
+            # Get max replication key in target
+            if target.check_table_exist(full_target_table):
+                max_replication_key = load_functions.get_max_replication_key(
+                    target, full_target_table, replication_key, state_path
+                )
+            else:
+                printer.print_load_line(
+                    index,
+                    total,
+                    "RUN",
+                    full_target_table,
+                    msg="does not exist in target. Starts FULL_TABLE load",
+                )
+
+            if replication_method == "UPSERT":
+                key_columns = get_key_columns(primary_key)
+                column_names = [column[1] for column in columns]
+                if not key_columns or not set(key_columns).issubset(column_names):
+                    printer.print_load_line(
+                        index,
+                        total,
+                        return_code,
+                        load_name,
+                        msg="primary key not found in table",
+                    )
+                    return return_code, querys, finish_step
+
+            if max_replication_key:
+                finish_step = "merge" if replication_method == "UPSERT" else "insert"
+
+        # Export querys
+        if query:
+            if max_replication_key:
+                query = load_functions.get_incremental_query(
+                    query, columns, replication_key, max_replication_key
+                )
+            querys = load_functions.get_query_export_querys(
+                source, query, parallelization_key, parallelization_method, columns
+            )
+        else:
+            querys = load_functions.get_export_querys(
+                source,
+                source_schema,
+                source_table,
+                columns,
+                replication_key if max_replication_key else None,
+                max_replication_key,
+                parallelization_key,
+                parallelization_method,
+            )
+
+        # Create temp table
+        return_code = load_functions.create_temp_table(
+            return_code,
+            index,
+            total,
+            target,
+            target_schema,
+            target_table_tmp,
+            columns,
+            load_name,
+        )
+    except Exception as e:
+        logger.error(e)
+        return_code = "ERROR"
+        printer.print_load_line(
+            index, total, return_code, load_name, msg="failed preparing load"
+        )
+    finally:
+        return return_code, querys, finish_step
+
+
+def finish_batches(
+    return_code,
+    index,
+    total,
+    target,
+    target_schema,
+    target_table,
+    load_name,
+    finish_step="switch",
+    columns=None,
+    primary_key=None,
+    replication_key=None,
+    state_path=None,
+):
+    # Last step of a load in the shared batch queue, when all batches are imported
+    target_table_tmp = target_table + "_tmp"
+    full_target_table = target_schema + "." + target_table
+    max_replication_key = None
+
+    try:
+        # New max replication key for the state
+        if state_path and finish_step in ("merge", "insert"):
+            max_replication_key = load_functions.get_new_max_replication_key(
+                target, target_schema, target_table_tmp, replication_key
+            )
+
+        if finish_step == "merge":
+            return_code = load_functions.merge_from_table_and_drop_tmp(
+                return_code,
+                index,
+                total,
+                target,
+                target_schema,
+                target_table,
+                target_table_tmp,
+                columns,
+                get_key_columns(primary_key),
+                replication_key,
+                load_name,
+            )
+        elif finish_step == "insert":
+            return_code = load_functions.insert_from_table_and_drop_tmp(
+                return_code,
+                index,
+                total,
+                target,
+                target_schema,
+                target_table,
+                target_table_tmp,
+                load_name,
+            )
+        else:
+            return_code = load_functions.switch_table(
+                return_code,
+                index,
+                total,
+                target,
+                target_schema,
+                target_table,
+                target_table_tmp,
+                load_name,
+            )
+    except Exception as e:
+        logger.error(e)
+        return_code = "ERROR"
+
+    # Return success
+    if return_code == "RUN":
+        # Kept as is when there are no new rows. Full loads starts from the target
+        if finish_step == "switch" or max_replication_key:
+            load_functions.save_max_replication_key(
+                state_path, full_target_table, replication_key, max_replication_key
+            )
+        return_code = "DONE"
+
+    return return_code
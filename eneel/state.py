@@ -0,0 +1,46 @@
+import os
+import yaml
+import eneel.utils as utils
+
+import logging
+
+logger = logging.getLogger("main_logger")
+
+
+def get_state_file(state_path, load_name):
+    # One state file per target table
+    return os.path.join(state_path, load_name + ".yml")
+
+
+def read_state(state_path, load_name):
+    state_file = get_state_file(state_path, load_name)
+    if not os.path.exists(state_file):
+        return {}
+    try:
+        with open(state_file) as file:
+            return utils.load_yaml(file) or {}
+    except:
+        logger.debug("Could not read state " + state_file)
+        return {}
+
+
+def write_state(state_path, load_name, state):
+    utils.create_path(state_path)
+    state_file = get_state_file(state_path, load_name)
+    # Written to a temp file first, so a failed run never leaves half a state
+    try:
+        with open(state_file + ".tmp", "w") as file:
+            yaml.safe_dump(state, file, default_flow_style=False)
+        os.replace(state_file + ".tmp", state_file)
+    except:
+        logger.error("Could not write state " + state_file)
+
+
+def delete_state(state_path, load_name):
+    utils.delete_file(get_state_file(state_path, load_name))
+
+
+def update_state(state_path, load_name, **values):
+    state = read_state(state_path, load_name)
+    state.update(values)
+    write_state(state_path, load_name, state)
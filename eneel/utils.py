@@ -2,8 +2,16 @@ import os
 import sys
 import subprocess
 import shutil
+import re
 import yaml
 import csv
+import queue
+import gzip
+import threading
+import contextlib
+import datetime
+import decimal
+import math
 
 import logging
 
@@ -36,6 +44,439 @@ def delete_file(file):
             logger.debug("Could not delete file")
 
 
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst", "lz4": ".lz4"}
+
+
+def get_compression_extension(compression):
+    if not compression:
+        return ""
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError("temp_compression " + compression + " not supported")
+    return COMPRESSION_EXTENSIONS[compression]
+
+
+def get_compression(file_path):
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if str(file_path).endswith(extension):
+            return compression
+
+
+def strip_compression_extension(file_path):
+    compression = get_compression(file_path)
+    if compression:
+        return file_path[: -len(COMPRESSION_EXTENSIONS[compression])]
+    return file_path
+
+
+def open_file(file_path, mode="r", encoding="utf-8"):
+    # Opens plain and compressed files alike, compression given by the file extension
+    compression = get_compression(file_path)
+    if "b" in mode:
+        encoding = None
+    if not compression:
+        return open(file_path, mode, encoding=encoding)
+    if "b" not in mode and "t" not in mode:
+        mode += "t"
+    if compression == "gzip":
+        return gzip.open(file_path, mode, compresslevel=6, encoding=encoding)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("temp_compression zstd needs: pip install zstandard")
+        return zstandard.open(file_path, mode, encoding=encoding)
+    if compression == "lz4":
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ImportError("temp_compression lz4 needs: pip install lz4")
+        return lz4.frame.open(file_path, mode, encoding=encoding)
+
+
+def copy_file(from_path, to_path, chunk_size=1048576):
+    with open_file(from_path, "rb") as from_file:
+        with open_file(to_path, "wb") as to_file:
+            shutil.copyfileobj(from_file, to_file, chunk_size)
+
+
+def supports_fifo():
+    return hasattr(os, "mkfifo")
+
+
+def unblock_fifo(fifo_path, mode):
+    # Opens the other end of a fifo so a thread blocked in open() is released
+    try:
+        fd = os.open(fifo_path, mode | os.O_NONBLOCK)
+        os.close(fd)
+    except OSError:
+        pass
+
+
+def pipe_from_fifo(fifo_path, file_path, errors=None):
+    # Errors are kept in errors, to be raised when the pipe thread is joined
+    try:
+        copy_file(fifo_path, file_path)
+    except Exception as e:
+        logger.error(e)
+        if errors is not None:
+            errors.append(e)
+
+
+def pipe_to_fifo(file_path, fifo_path, errors=None):
+    try:
+        copy_file(file_path, fifo_path)
+    except BrokenPipeError:
+        logger.debug("Reader of " + fifo_path + " closed before end of file")
+    except Exception as e:
+        logger.error(e)
+        if errors is not None:
+            errors.append(e)
+
+
+@contextlib.contextmanager
+def compressed_output(file_path):
+    """Yields a plain path for a cli tool to write to. The data ends up
+    compressed in file_path, through a named pipe where supported."""
+    if not get_compression(file_path):
+        yield file_path
+        return
+
+    if not supports_fifo():
+        plain_path = strip_compression_extension(file_path) + ".tmp"
+        try:
+            yield plain_path
+            copy_file(plain_path, file_path)
+        finally:
+            delete_file(plain_path)
+        return
+
+    plain_path = file_path + ".fifo"
+    os.mkfifo(plain_path)
+    errors = []
+    compressor = threading.Thread(
+        target=pipe_from_fifo, args=(plain_path, file_path, errors)
+    )
+    compressor.start()
+    try:
+        yield plain_path
+    finally:
+        if compressor.is_alive():
+            unblock_fifo(plain_path, os.O_WRONLY)
+        compressor.join()
+        delete_file(plain_path)
+    # A failed compression fails the export
+    if errors:
+        raise errors[0]
+
+
+@contextlib.contextmanager
+def decompressed_input(file_path):
+    """Yields a plain path for a cli tool to read the decompressed content of
+    file_path from, through a named pipe where supported."""
+    if not get_compression(file_path):
+        yield file_path
+        return
+
+    if not supports_fifo():
+        plain_path = strip_compression_extension(file_path) + ".tmp"
+        try:
+            copy_file(file_path, plain_path)
+            yield plain_path
+        finally:
+            delete_file(plain_path)
+        return
+
+    plain_path = file_path + ".fifo"
+    os.mkfifo(plain_path)
+    errors = []
+    decompressor = threading.Thread(
+        target=pipe_to_fifo, args=(file_path, plain_path, errors)
+    )
+    decompressor.start()
+    try:
+        yield plain_path
+    finally:
+        if decompressor.is_alive():
+            unblock_fifo(plain_path, os.O_RDONLY)
+        decompressor.join()
+        delete_file(plain_path)
+    # A corrupt or truncated file fails the import, even if part of it was read
+    if errors:
+        raise errors[0]
+
+
+@contextlib.contextmanager
+def session_slot(semaphore=None):
+    # Holds one slot of a shared session limit, if any
+    if semaphore is None:
+        yield
+        return
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def get_min_max_batch(min_value, max_value, row_count, batch_size):
+    # Min, max and the key range for about batch_size rows in each batch. Timestamp
+    # keys gets whole seconds and date keys whole days
+    num_batches = row_count / batch_size if row_count else 1
+    if isinstance(min_value, datetime.datetime):
+        seconds = (max_value - min_value).total_seconds() / num_batches
+        batch_size_key = datetime.timedelta(seconds=max(math.ceil(seconds), 1))
+    elif isinstance(min_value, datetime.date):
+        days = (max_value - min_value).days / num_batches
+        batch_size_key = datetime.timedelta(days=max(math.ceil(days), 1))
+    else:
+        min_value = int(min_value)
+        max_value = int(max_value)
+        batch_size_key = max(math.ceil((max_value - min_value) / num_batches), 1)
+    return min_value, max_value, batch_size_key
+
+
+def merge_bucket_ranges(bucket_counts, min_value, batch_size_key, batch_size):
+    # Key ranges of the non empty buckets, merged up to batch_size rows. The ranges
+    # are contiguous, so the gaps between are exported by the next range
+    ranges = []
+    range_start = min_value
+    range_end = None
+    range_rows = 0
+    for bucket, rows in sorted(bucket_counts):
+        if not rows:
+            continue
+        if range_rows and range_rows + rows > batch_size:
+            ranges.append((range_start, range_end))
+            range_start = range_end + 1
+            range_rows = 0
+        range_end = min_value + (bucket + 1) * batch_size_key - 1
+        range_rows += rows
+    if range_rows:
+        ranges.append((range_start, range_end))
+    return ranges
+
+
+def split_range(start, end, parts):
+    # Splits the key range start to end into at most parts contiguous ranges
+    parts = max(min(parts, end - start + 1), 1)
+    size = math.ceil((end - start + 1) / parts)
+    ranges = []
+    while start <= end:
+        ranges.append((start, min(start + size - 1, end)))
+        start += size
+    return ranges
+
+
+def get_changed_ranges(source_hashes, target_hashes, min_value, batch_size_key):
+    # Key ranges of the buckets with other rows or hashes in the target than in the
+    # source. Adjacent buckets are merged into one range
+    ranges = []
+    for bucket in sorted(set(source_hashes) | set(target_hashes)):
+        if source_hashes.get(bucket) == target_hashes.get(bucket):
+            continue
+        start = min_value + bucket * batch_size_key
+        end = start + batch_size_key - 1
+        if ranges and ranges[-1][1] + 1 == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def get_sorted_keys(keys):
+    # Keys with values comparable between databases. Raises if the database sorts
+    # them in another order than python, since the merge would then be wrong
+    previous_key = None
+    for key in keys:
+        compare_key = tuple(
+            value if isinstance(value, (int, float, decimal.Decimal)) else str(value)
+            for value in key
+        )
+        if previous_key is not None and compare_key < previous_key:
+            raise ValueError(
+                "Keys not sorted in the same order as python at " + str(key)
+            )
+        previous_key = compare_key
+        yield compare_key, key
+
+
+def get_deleted_keys(source_keys, target_keys):
+    # Merges two sorted streams of keys, and yields the target keys missing in the
+    # source. Each stream is read once, so memory use doesn't grow with the keys
+    source_keys = get_sorted_keys(source_keys)
+    source_key = next(source_keys, None)
+    for compare_key, key in get_sorted_keys(target_keys):
+        while source_key is not None and source_key[0] < compare_key:
+            source_key = next(source_keys, None)
+        if source_key is None or source_key[0] != compare_key:
+            yield key
+
+
+def get_datetime_boundaries(min_value, max_value, interval):
+    # Boundaries every interval after min_value up to max_value. Day and hour
+    # intervals starts at midnight or on the whole hour
+    if interval in ("day", "hour"):
+        if isinstance(min_value, datetime.datetime):
+            min_value = min_value.replace(minute=0, second=0, microsecond=0)
+            if interval == "day":
+                min_value = min_value.replace(hour=0)
+        if interval == "hour" and isinstance(min_value, datetime.datetime):
+            interval = datetime.timedelta(hours=1)
+        else:
+            interval = datetime.timedelta(days=1)
+    elif isinstance(min_value, datetime.datetime):
+        min_value = min_value.replace(microsecond=0)
+
+    boundaries = []
+    boundary = min_value + interval
+    while boundary <= max_value:
+        boundaries.append(boundary)
+        boundary += interval
+    return boundaries
+
+
+def get_histogram_boundaries(histogram, batch_size):
+    # Picks batch boundaries from an ordered histogram of (upper value, rows) steps,
+    # so each batch holds about batch_size rows
+    boundaries = []
+    batch_rows = 0
+    for value, rows in histogram[:-1]:
+        batch_rows += rows
+        if batch_rows >= batch_size and value not in boundaries:
+            boundaries.append(value)
+            batch_rows = 0
+    return boundaries
+
+
+# Marks the unchanged toasted values of updates
+UNCHANGED_TOAST = object()
+
+TEST_DECODING_CHANGE = re.compile(
+    r"^table (.+?): (INSERT|UPDATE|DELETE|TRUNCATE):(.*)$", re.S
+)
+
+
+def parse_test_decoding_tuple(data):
+    # Column values of a test_decoding tuple: name[type]:value name[type]:value
+    values = {}
+    position = 0
+    while position < len(data):
+        if data[position] == " ":
+            position += 1
+            continue
+        # Quoted identifiers has "" for "
+        if data[position] == '"':
+            end = position + 1
+            while True:
+                end = data.index('"', end)
+                if data[end + 1 : end + 2] != '"':
+                    break
+                end += 2
+            name = data[position + 1 : end].replace('""', '"')
+            position = end + 1
+        else:
+            end = data.index("[", position)
+            name = data[position:end]
+            position = end
+        position = data.index("]:", position) + 2
+
+        # Literals are quoted with '' for '. Bit strings as B'...'
+        if data.startswith("B'", position):
+            position += 1
+        if data[position : position + 1] == "'":
+            end = position + 1
+            while True:
+                end = data.index("'", end)
+                if data[end + 1 : end + 2] != "'":
+                    break
+                end += 2
+            value = data[position + 1 : end].replace("''", "'")
+            position = end + 1
+        else:
+            end = data.find(" ", position)
+            if end == -1:
+                end = len(data)
+            value = data[position:end]
+            position = end
+            if value == "null":
+                value = None
+            elif value == "true":
+                value = "t"
+            elif value == "false":
+                value = "f"
+            elif value == "unchanged-toast-datum":
+                value = UNCHANGED_TOAST
+        values[name] = value
+    return values
+
+
+def parse_test_decoding(data):
+    # Table, action, new and old values of a test_decoding change. None for BEGIN
+    # and COMMIT. Old values are the key of deletes, and of updates that changes it
+    match = TEST_DECODING_CHANGE.match(data)
+    if not match:
+        return None
+    table_name, action, tuple_data = match.groups()
+    table_name = table_name.replace('"', "")
+    tuple_data = tuple_data.strip()
+    new_values = {}
+    old_values = {}
+    if action == "TRUNCATE" or tuple_data == "(no-tuple-data)":
+        pass
+    elif action == "DELETE":
+        old_values = parse_test_decoding_tuple(tuple_data)
+    elif tuple_data.startswith("old-key:"):
+        old_data, new_data = tuple_data[len("old-key:") :].split(" new-tuple:", 1)
+        old_values = parse_test_decoding_tuple(old_data)
+        new_values = parse_test_decoding_tuple(new_data)
+    else:
+        new_values = parse_test_decoding_tuple(tuple_data)
+    return table_name, action, new_values, old_values
+
+
+def get_latest_changes(changes, key_columns):
+    # The last change of each key, as an upsert "U" or a delete "D" with the values
+    latest = {}
+    for action, new_values, old_values in changes:
+        if action == "DELETE":
+            key = tuple(old_values[column] for column in key_columns)
+            latest[key] = ("D", old_values)
+            continue
+
+        if old_values:
+            old_key = tuple(old_values[column] for column in key_columns)
+            new_key = tuple(new_values[column] for column in key_columns)
+            if old_key != new_key:
+                latest[old_key] = ("D", old_values)
+
+        # Unchanged toasted values from the old row or the last change of the key
+        key = tuple(new_values[column] for column in key_columns)
+        values = dict(new_values)
+        for column, value in new_values.items():
+            if value is not UNCHANGED_TOAST:
+                continue
+            if column in old_values:
+                values[column] = old_values[column]
+            elif key in latest and latest[key][0] == "U":
+                values[column] = latest[key][1][column]
+            else:
+                raise ValueError(
+                    "Unchanged toasted value of "
+                    + column
+                    + ". Set REPLICA IDENTITY FULL on the table"
+                )
+        latest[key] = ("U", values)
+    return list(latest.values())
+
+
+def copy_text_value(value, delimiter="|"):
+    # A value in postgres COPY text format, like the exports of postgres sources
+    if value is None:
+        return "\\N"
+    value = value.replace("\\", "\\\\").replace(delimiter, "\\" + delimiter)
+    return value.replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+
+
 def load_yaml(stream):
     try:
         return yaml.safe_load(stream)
@@ -56,21 +497,41 @@ def load_file_contents(path, strip=True):
     return to_return
 
 
-def run_cmd(cmd, envs=None):
+def run_cmd(cmd, envs=None, cancel_event=None):
     try:
         my_env = os.environ
         if envs:
             for env in envs:
                 my_env[env[0]] = env[1]
-        res = subprocess.run(
+        if cancel_event is None:
+            res = subprocess.run(
+                cmd,
+                text=True,
+                capture_output=True,
+                check=True,
+                env=my_env,
+                encoding="ISO-8859-2",
+            )
+            return res.returncode, res.stdout
+
+        # Killed if cancel_event is set before the command is done
+        with subprocess.Popen(
             cmd,
             text=True,
-            capture_output=True,
-            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             env=my_env,
             encoding="ISO-8859-2",
-        )
-        return res.returncode, res.stdout
+        ) as process:
+            while True:
+                try:
+                    stdout, stderr = process.communicate(timeout=1)
+                    return process.returncode, stdout
+                except subprocess.TimeoutExpired:
+                    if cancel_event.is_set():
+                        process.kill()
+                        process.communicate()
+                        return -1, "Cancelled"
     except subprocess.CalledProcessError as error:
         return error.returncode, error.stdout
     except FileNotFoundError as error:
@@ -81,6 +542,30 @@ def run_cmd(cmd, envs=None):
         return -1, sys.exc_info()[0]
 
 
+@contextlib.contextmanager
+def cancel_on(cancel_event, cancel):
+    # Calls cancel if cancel_event is set before the block is done
+    if cancel_event is None:
+        yield
+        return
+
+    done = threading.Event()
+
+    def watch():
+        while not done.wait(0.5):
+            if cancel_event.is_set():
+                cancel()
+                return
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    try:
+        yield
+    finally:
+        done.set()
+        watcher.join()
+
+
 def export_csv(rows, filename, delimiter="|"):
     try:
         csv_file = open(filename, "a", encoding="utf-8")
@@ -110,3 +595,69 @@ def export_csv(rows, filename, delimiter="|"):
     except Exception as e:
         logger.error(e)
         return 0
+
+
+class StreamPipe:
+    """A bounded in-memory pipe between an export writing and an import reading
+    in separate threads. Writes are buffered into chunks of chunk_size bytes and
+    at most max_chunks chunks are held in memory, blocking the writer when full."""
+
+    def __init__(self, max_chunks=16, chunk_size=1048576):
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._chunk_size = chunk_size
+        self._write_buffer = bytearray()
+        self._read_buffer = memoryview(b"")
+        self._eof = False
+        self._closed = False
+        self._aborted = False
+
+    def _put(self, chunk):
+        while True:
+            if self._aborted:
+                raise BrokenPipeError("Stream reader aborted")
+            try:
+                self._queue.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._write_buffer += data
+        if len(self._write_buffer) >= self._chunk_size:
+            self._put(bytes(self._write_buffer))
+            self._write_buffer = bytearray()
+        return len(data)
+
+    def close(self):
+        if self._closed or self._aborted:
+            return
+        self._closed = True
+        if self._write_buffer:
+            self._put(bytes(self._write_buffer))
+            self._write_buffer = bytearray()
+        self._put(None)
+
+    def abort(self):
+        self._aborted = True
+
+    def read(self, size=-1):
+        if not self._read_buffer:
+            if self._eof:
+                return b""
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+                return b""
+            self._read_buffer = memoryview(chunk)
+        if size is None or size < 0:
+            chunks = []
+            while self._read_buffer:
+                chunks.append(bytes(self._read_buffer))
+                self._read_buffer = memoryview(b"")
+                self.read(0)
+            return b"".join(chunks)
+        data = bytes(self._read_buffer[:size])
+        self._read_buffer = self._read_buffer[size:]
+        return data
@@ -29,6 +29,10 @@ setup(
         'snowflake-connector-python>=1.8.4, <2.8',
         'filesplit==2.0.0',
     ],
+    extras_require={
+        'zstd': ['zstandard>=0.15'],
+        'lz4': ['lz4>=3'],
+    },
     entry_points={
             'console_scripts': ['eneel=eneel.main:main'],
         },
@@ -145,3 +145,221 @@ id_col integer)"""
         assert query_columns[1][2] == "str"
         assert query_columns[1][3] == 64
         assert query_columns[2][2] == "datetime.datetime"
+
+    def test_get_batch_boundaries(self, db):
+        db.execute("analyze test.test1")
+        db._table_parallel_batch_size = 1
+        boundaries = db.get_batch_boundaries("test", "test1", "id_col")
+
+        assert boundaries == ["2"]
+
+    def test_get_min_max_batch_datetime(self, db):
+        min, max, batch = db.get_min_max_batch("test.test1", "datetime_col")
+
+        assert min == datetime(2019, 10, 1, 11)
+        assert max == datetime(2019, 10, 3, 13)
+        assert batch > max - min
+
+    def test_get_block_range_wheres(self, db):
+        db.execute("create table test.test_blocks as select generate_series(1, 10000) as id_col")
+        db.execute("analyze test.test_blocks")
+        db._table_parallel_batch_size = 1000
+        wheres = db.get_block_range_wheres("test", "test_blocks")
+
+        assert len(wheres) > 1
+        row_count = 0
+        for where in wheres:
+            row_count += db.query("select count(*) from test.test_blocks where " + where)[0][0]
+        db.execute("drop table test.test_blocks")
+
+        assert row_count == 10000
+
+    def test_get_partitions(self, db):
+        db.execute(
+            """create table test.test_part(id_col int) partition by range (id_col);
+            create table test.test_part_1 partition of test.test_part for values from (0) to (10);
+            create table test.test_part_2 partition of test.test_part for values from (10) to (20);"""
+        )
+        partitions = db.get_partitions("test", "test_part")
+        export_query = db.generate_export_query(
+            [(1, "id_col")], "test", "test_part", partition=partitions[0]
+        )
+        db.execute("drop table test.test_part")
+
+        assert partitions == ["test.test_part_1", "test.test_part_2"]
+        assert export_query == "SELECT id_col FROM test.test_part_1"
+
+    def test_get_min_max_batch_catalog_stats(self, db):
+        db.execute("analyze test.test1")
+        db._table_parallel_use_catalog_stats = True
+        min, max, batch = db.get_min_max_batch("test.test1", "id_col")
+
+        assert min == 1
+        assert max == 3
+        assert batch > 0
+
+    def test_get_bucket_counts(self, db):
+        bucket_counts = db.get_bucket_counts("test.test1", "id_col", 1, 2)
+
+        assert sorted(bucket_counts) == [(0, 2), (1, 1)]
+
+    def test_merge_from_table_and_drop(self, db):
+        db.execute(
+            """create table test.test1_tmp(id_col int, name_col varchar(64), datetime_col timestamp);
+            insert into test.test1_tmp values(2, 'Old second', '2019-10-02 12:00:00');
+            insert into test.test1_tmp values(2, 'New second', '2019-10-05 12:00:00');
+            insert into test.test1_tmp values(4, 'Forth', '2019-10-04 12:00:00');"""
+        )
+        return_code = db.merge_from_table_and_drop(
+            "test",
+            "test1",
+            "test1_tmp",
+            ["id_col", "name_col", "datetime_col"],
+            ["id_col"],
+            "datetime_col",
+        )
+        rows = db.query("select id_col, name_col from test.test1 order by id_col")
+
+        assert return_code == "RUN"
+        assert db.check_table_exist("test.test1_tmp") is False
+        assert rows == [(1, "First"), (2, "New second"), (3, "Third"), (4, "Forth")]
+        assert db.has_unique_index("test", "test1", ["id_col"]) is True
+
+    def test_merge_from_table_and_drop_failed(self, db):
+        # Duplicate keys in the target, so no unique index can be created
+        db.execute(
+            """insert into test.test1 values(3, 'Third again', '2019-10-03 13:00:00');
+            create table test.test1_tmp(id_col int, name_col varchar(64), datetime_col timestamp);
+            insert into test.test1_tmp values(4, 'Forth', '2019-10-04 12:00:00');"""
+        )
+        return_code = db.merge_from_table_and_drop(
+            "test",
+            "test1",
+            "test1_tmp",
+            ["id_col", "name_col", "datetime_col"],
+            ["id_col"],
+        )
+        row_count = db.query("select count(*) from test.test1")[0][0]
+
+        assert return_code == "ERROR"
+        assert db.check_table_exist("test.test1_tmp") is True
+        assert row_count == 4
+        db.execute("drop table test.test1_tmp")
+
+    def test_apply_changes_from_table_and_drop(self, db):
+        db.execute(
+            """create table test.test1_tmp(id_col int, name_col varchar(64), datetime_col timestamp, eneel_op varchar(1));
+            insert into test.test1_tmp values(1, null, null, 'D');
+            insert into test.test1_tmp values(2, 'New second', '2019-10-05 12:00:00', 'U');
+            insert into test.test1_tmp values(4, 'Forth', '2019-10-04 12:00:00', 'U');"""
+        )
+        return_code = db.apply_changes_from_table_and_drop(
+            "test", "test1", "test1_tmp", ["id_col", "name_col", "datetime_col"], ["id_col"]
+        )
+        rows = db.query("select id_col, name_col from test.test1 order by id_col")
+
+        assert return_code == "RUN"
+        assert db.check_table_exist("test.test1_tmp") is False
+        assert rows == [(2, "New second"), (3, "Third"), (4, "Forth")]
+
+    def test_apply_changes_from_table_and_drop_failed(self, db):
+        # No op column, so the insert fails and the delete is rolled back
+        db.execute(
+            """create table test.test1_tmp(id_col int, name_col varchar(64), datetime_col timestamp);
+            insert into test.test1_tmp values(1, 'New first', '2019-10-05 12:00:00');"""
+        )
+        return_code = db.apply_changes_from_table_and_drop(
+            "test", "test1", "test1_tmp", ["id_col", "name_col", "datetime_col"], ["id_col"]
+        )
+        rows = db.query("select id_col, name_col from test.test1 order by id_col")
+
+        assert return_code == "ERROR"
+        assert db.check_table_exist("test.test1_tmp") is True
+        assert rows == [(1, "First"), (2, "Second"), (3, "Third")]
+        db.execute("drop table test.test1_tmp")
+
+    def test_get_range_hashes(self, db):
+        columns = db.table_columns("test", "test1")
+        range_hashes = db.get_range_hashes("test.test1", columns, "id_col", 1, 2)
+        db.execute("update test.test1 set name_col = 'Changed' where id_col = 3")
+        changed_hashes = db.get_range_hashes("test.test1", columns, "id_col", 1, 2)
+
+        assert sorted(range_hashes) == [0, 1]
+        assert range_hashes[0] == changed_hashes[0]
+        assert range_hashes[1] != changed_hashes[1]
+
+    def test_get_range_hashes_other_target_types(self, db):
+        # The target is created with real, timestamp and text columns
+        db.execute(
+            """create table test.test2(id_col bigint, float_col float8, ts_col timestamptz, name_col varchar(64));
+            insert into test.test2 values(1, 0.1, '2019-10-01 11:00:00+02', 'First');
+            insert into test.test2 values(2, 1.0/3, '2019-10-02 12:00:00+00', 'Second');
+            create table test.test2_tgt(id_col int, float_col real, ts_col timestamp, name_col text);
+            insert into test.test2_tgt select id_col, float_col, ts_col, name_col from test.test2;"""
+        )
+        columns = db.table_columns("test", "test2")
+        source_hashes = db.get_range_hashes("test.test2", columns, "id_col", 1, 2)
+        target_hashes = db.get_range_hashes("test.test2_tgt", columns, "id_col", 1, 2)
+        filtered_hashes = db.get_range_hashes(
+            "test.test2", columns, "id_col", 1, 2, where="id_col = 1"
+        )
+        db.execute("drop table test.test2; drop table test.test2_tgt")
+
+        assert source_hashes == target_hashes
+        assert filtered_hashes[0][0] == 1
+
+    def test_replace_ranges_from_table_and_drop(self, db):
+        db.execute(
+            """create table test.test1_tmp(id_col int, name_col varchar(64), datetime_col timestamp);
+            insert into test.test1_tmp values(2, 'New second', '2019-10-05 12:00:00');"""
+        )
+        return_code = db.replace_ranges_from_table_and_drop(
+            "test", "test1", "test1_tmp", ["id_col between 2 and 3"]
+        )
+        rows = db.query("select id_col, name_col from test.test1 order by id_col")
+
+        assert return_code == "RUN"
+        assert rows == [(1, "First"), (2, "New second")]
+
+        # A failed insert rolls back the deletes
+        db.execute(
+            """create table test.test1_tmp(id_col varchar(10));
+            insert into test.test1_tmp values('x');"""
+        )
+        return_code = db.replace_ranges_from_table_and_drop(
+            "test", "test1", "test1_tmp", ["id_col between 1 and 2"]
+        )
+        row_count = db.query("select count(*) from test.test1")[0][0]
+
+        assert return_code == "ERROR"
+        assert row_count == 2
+        db.execute("drop table test.test1_tmp")
+
+    def test_stream_and_delete_keys(self, db):
+        keys = list(db.stream_keys("test.test1", ["id_col"], batch_size=2))
+        deleted_row_count = db.delete_keys("test", "test1", ["id_col"], [(1,), (3,)])
+        rows = db.query("select id_col from test.test1")
+
+        assert keys == [(1,), (2,), (3,)]
+        assert deleted_row_count == 2
+        assert rows == [(2,)]
+
+    def test_stream_keys_text_binary_order(self, db):
+        db.execute("insert into test.test1 values(4, 'first', '2019-10-04 12:00:00')")
+        keys = list(db.stream_keys("test.test1", ["name_col"], text_columns=["name_col"]))
+
+        assert keys == [("First",), ("Second",), ("Third",), ("first",)]
+
+    def test_get_table_fingerprint(self, db):
+        fingerprint = db.get_table_fingerprint("test", "test1")
+        db.truncate_table("test.test1")
+        truncated_fingerprint = db.get_table_fingerprint("test", "test1")
+
+        assert fingerprint
+        assert fingerprint != truncated_fingerprint
+        assert db.get_table_fingerprint("test", "missing_table") is None
+
+    def test_get_column_types(self, db):
+        column_types = db.get_column_types("test", "test1")
+
+        assert column_types == ["integer", "character varying", "timestamp without time zone"]
@@ -146,3 +146,45 @@ class TestDatabaseSqlserver:
         assert query_columns[1][2] == "str"
         assert query_columns[1][3] == 64
         assert query_columns[2][2] == "datetime.datetime"
+
+
+def test_parse_histogram_key():
+    assert parse_histogram_key("date", "2019-10-01") == datetime(2019, 10, 1).date()
+    assert parse_histogram_key("datetime", "2019-10-01T11:00:00.123") == datetime(
+        2019, 10, 1, 11, 0, 0, 123000
+    )
+    assert parse_histogram_key("datetime2", "2019-10-01T11:00:00") == datetime(
+        2019, 10, 1, 11
+    )
+    assert parse_histogram_key("int", "42") == "42"
+
+
+def test_get_hash_column():
+    assert get_hash_column((1, "name_col", "str", 64, None, None)) == (
+        "CAST([name_col] AS nvarchar(64))"
+    )
+    assert get_hash_column((2, "text_col", "str", -1, None, None)) == (
+        "CAST([text_col] AS nvarchar(MAX))"
+    )
+    assert get_hash_column((3, "id_col", "int", None, 10, 0)) == (
+        "CAST([id_col] AS bigint)"
+    )
+    assert get_hash_column((4, "amount_col", "decimal.Decimal", None, 18, 2)) == (
+        "CAST([amount_col] AS numeric(18,2))"
+    )
+
+
+def test_get_bucket_counts_derived_table():
+    class FakeDatabase(Database):
+        def __init__(self):
+            self.sql = None
+
+        def query(self, sql, params=None):
+            self.sql = sql
+            return [(0, 5)]
+
+    db = FakeDatabase()
+    bucket_counts = db.get_bucket_counts("(SELECT id FROM t) q", "id", 1, 10)
+
+    assert bucket_counts == [(0, 5)]
+    assert "NOLOCK" not in db.sql
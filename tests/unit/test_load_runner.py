@@ -1,13 +1,34 @@
 from eneel.load_runner import *
 from eneel.adapters.postgres import *
+import eneel.adapters.oracle as oracle
 import datetime
 import pytest
+from time import sleep
 
 from dotenv import find_dotenv, load_dotenv
 
 load_dotenv(find_dotenv())
 
 
+class SessionSource:
+    # Fake source that records the most concurrent exports in all processes
+    def __init__(self, manager, max_sessions):
+        self._sessions = manager.BoundedSemaphore(max_sessions)
+        self._table_parallel_loads = 4
+        self._lock = manager.Lock()
+        self._active = manager.Value("i", 0)
+        self._max_active = manager.Value("i", 0)
+
+    def export_query(self, query, file_path, delimiter):
+        with self._lock:
+            self._active.value += 1
+            self._max_active.value = max(self._max_active.value, self._active.value)
+        sleep(0.05)
+        with self._lock:
+            self._active.value -= 1
+        return 1
+
+
 @pytest.fixture
 def run_project_fixture(tmp_path):
     project_yml = """# Project info
@@ -399,6 +420,132 @@ def test_strategy_full_table_load(db, tmp_path):
     assert import_row_count == 3
 
 
+def test_strategy_full_table_load_stream(db, tmp_path):
+    table_columns = db.table_columns("load_runner", "test1")
+    return_code, export_row_count, import_row_count = strategy_full_table_load(
+        "ERROR",
+        1,
+        1,
+        db,
+        "load_runner",
+        "test1",
+        table_columns,
+        tmp_path,
+        "|",
+        db,
+        "load_runner",
+        "test1_stream_target",
+        "id_col",
+        transfer_mode="stream",
+    )
+
+    assert return_code == "DONE"
+    assert export_row_count == 3
+    assert import_row_count == 3
+
+
+def test_strategy_full_table_load_pipeline(db, tmp_path):
+    table_columns = db.table_columns("load_runner", "test1")
+    pipeline_load_path = tmp_path / "pipeline_load"
+    pipeline_load_path.mkdir()
+    return_code, export_row_count, import_row_count = strategy_full_table_load(
+        "ERROR",
+        1,
+        1,
+        db,
+        "load_runner",
+        "test1",
+        table_columns,
+        pipeline_load_path,
+        "|",
+        db,
+        "load_runner",
+        "test1_pipeline_target",
+        "id_col",
+        transfer_mode="pipeline",
+    )
+
+    assert return_code == "DONE"
+    assert export_row_count == 3
+    assert import_row_count == 3
+
+
+def test_strategy_full_table_load_compressed(db, tmp_path):
+    table_columns = db.table_columns("load_runner", "test1")
+    compressed_load_path = tmp_path / "compressed_load"
+    compressed_load_path.mkdir()
+    return_code, export_row_count, import_row_count = strategy_full_table_load(
+        "ERROR",
+        1,
+        1,
+        db,
+        "load_runner",
+        "test1",
+        table_columns,
+        compressed_load_path,
+        "|",
+        db,
+        "load_runner",
+        "test1_compressed_target",
+        "id_col",
+        temp_compression="gzip",
+    )
+
+    assert return_code == "DONE"
+    assert export_row_count == 3
+    assert import_row_count == 3
+
+
+def test_strategy_full_table_load_fifo(db, tmp_path):
+    table_columns = db.table_columns("load_runner", "test1")
+    fifo_load_path = tmp_path / "fifo_load"
+    fifo_load_path.mkdir()
+    return_code, export_row_count, import_row_count = strategy_full_table_load(
+        "ERROR",
+        1,
+        1,
+        db,
+        "load_runner",
+        "test1",
+        table_columns,
+        fifo_load_path,
+        "|",
+        db,
+        "load_runner",
+        "test1_fifo_target",
+        "id_col",
+        transfer_mode="fifo",
+    )
+
+    assert return_code == "DONE"
+    assert export_row_count == 3
+    assert import_row_count == 3
+
+
+def test_strategy_full_query_load_parallel(db, tmp_path):
+    query = "select id_col, name_col from load_runner.test1"
+    query_columns = db.query_columns(query)
+    return_code, export_row_count, import_row_count = load_strategies.strategy_full_query_load(
+        "ERROR",
+        1,
+        1,
+        db,
+        "test_query",
+        query,
+        query_columns,
+        tmp_path,
+        "|",
+        db,
+        "load_runner",
+        "test1_query_target",
+        parallelization_key="id_col",
+    )
+
+    assert return_code == "DONE"
+    assert export_row_count == 3
+    assert import_row_count == 3
+
+
 def test_strategy_incremental(db, tmp_path):
     table_columns = db.table_columns("load_runner", "test1_inc_test")
     inc_load_path = tmp_path / "inc_load"
@@ -424,6 +571,61 @@ def test_strategy_incremental(db, tmp_path):
     assert import_row_count == 2
 
 
+def test_strategy_incremental_query(db, tmp_path):
+    query = "select id_col, name_col from load_runner.test1_inc_test"
+    query_columns = db.query_columns(query)
+
+    # Full load of the first rows when the target doesn't exist
+    return_code, export_row_count, import_row_count = load_strategies.strategy_incremental_query(
+        "ERROR",
+        1,
+        1,
+        db,
+        "test_inc_query",
+        query + " where id_col <= 2",
+        query_columns,
+        tmp_path,
+        "|",
+        db,
+        "load_runner",
+        "test1_inc_query_target",
+        "id_col",
+    )
+    assert return_code == "DONE"
+    assert import_row_count == 2
+
+    # Then only the new rows
+    return_code, export_row_count, import_row_count = load_strategies.strategy_incremental_query(
+        "ERROR",
+        1,
+        1,
+        db,
+        "test_inc_query",
+        query,
+        query_columns,
+        tmp_path,
+        "|",
+        db,
+        "load_runner",
+        "test1_inc_query_target",
+        "id_col",
+    )
+    assert return_code == "DONE"
+    assert export_row_count == 3
+    assert import_row_count == 3
+
+
+def test_get_export_querys_incremental_delta(db):
+    table_columns = db.table_columns("load_runner", "test1_inc_test")
+    db._table_parallel_batch_size = 1
+    querys = load_functions.get_export_querys(
+        db, "load_runner", "test1_inc_test", table_columns, "id_col", "2", "id_col"
+    )
+
+    assert len(querys) == 3
+    assert querys[0].endswith("WHERE id_col > '2' AND id_col between 3 and 3")
+
+
 def test_run_load(project_load):
     return_code = run_load(project_load)
 
@@ -435,3 +637,150 @@ def test_run_project(run_project_fixture, tmp_path):
     run_project("test_project", connections_path)
 
     assert run_project_fixture.check_table_exist("run_project_tgt.test1") is True
+
+
+def test_order_loads_by_cost():
+    loads = [{"load_order": 1}, {"load_order": 2}, {"load_order": 3}, {"load_order": 4}]
+    ordered_loads = order_loads_by_cost(loads, [10, None, 300, 20])
+
+    assert [load["load_order"] for load in ordered_loads] == [3, 2, 4, 1]
+
+
+def test_run_project_batch_queue(run_project_fixture, tmp_path):
+    project_yml_path = tmp_path / "test_project.yml"
+    project_yml = project_yml_path.read_text()
+    project_yml_path.write_text("batch_queue: shared\nbatch_workers: 2\n" + project_yml)
+
+    connections_path = tmp_path / "connections.yml"
+    run_project("test_project", connections_path)
+
+    assert run_project_fixture.check_table_exist("run_project_tgt.test1") is True
+
+
+def test_get_binary_copy_query():
+    query = load_functions.get_binary_copy_query(
+        "SELECT id_col, name_col FROM load_runner.test1", ["integer", "character varying"]
+    )
+
+    assert query == (
+        "SELECT q.c0::integer, q.c1::character varying "
+        "FROM (SELECT id_col, name_col FROM load_runner.test1) q(c0, c1)"
+    )
+
+
+def test_get_query_export_querys_oracle_spool():
+    class Source:
+        def get_min_max_batch(self, table_name, column):
+            return 1, 20, 10
+
+        def query_columns(self, query):
+            return [(1, "ID"), (2, "NAME")]
+
+    querys = load_functions.get_query_export_querys(
+        Source(), "SELECT id, name FROM t;", "ID"
+    )
+    spool_query = oracle.generate_spool_query(querys[0], "|")
+
+    assert querys[0] == (
+        "SELECT ID, NAME FROM (SELECT id, name FROM t) q WHERE ID between 1 and 10"
+    )
+    assert "REPLACE(*" not in spool_query
+    assert spool_query.startswith("SELECT REPLACE(ID,chr(0),'') || '|' || \n")
+    assert spool_query.endswith(
+        "FROM (SELECT id, name FROM t) q WHERE ID between 1 and 10;\n"
+    )
+
+
+def test_get_incremental_query_oracle_spool():
+    query = load_functions.get_incremental_query(
+        "SELECT id, name FROM t", [(1, "ID"), (2, "NAME")], "ID", "2"
+    )
+    spool_query = oracle.generate_spool_query(query, "|")
+
+    assert query == "SELECT ID, NAME FROM (SELECT id, name FROM t) q WHERE ID > '2'"
+    assert "REPLACE(*" not in spool_query
+    assert spool_query.endswith("FROM (SELECT id, name FROM t) q WHERE ID > '2';\n")
+
+
+def test_session_limit():
+    with Manager() as manager:
+        source = SessionSource(manager, 2)
+        querys = ["SELECT " + str(i) for i in range(4)]
+        file_paths = ["file_" + str(i) + ".csv" for i in range(4)]
+
+        # Batches in threads of several worker processes share the limit
+        with ProcessExecutor(max_workers=3) as executor:
+            futures = [
+                executor.submit(
+                    load_functions.run_export_querys, source, querys, file_paths, "|"
+                )
+                for _ in range(3)
+            ]
+            row_counts = [future.result() for future in futures]
+
+        assert row_counts == [4, 4, 4]
+        assert source._max_active.value == 2
+        # All sessions are released
+        assert all(source._sessions.acquire(blocking=False) for _ in range(2))
+        assert source._sessions.acquire(blocking=False) is False
+
+
+def test_run_export_ranges_split_straggler(tmp_path, monkeypatch):
+    monkeypatch.setattr(load_functions, "STRAGGLER_MIN_SECONDS", 0.1)
+
+    class Source:
+        _table_parallel_loads = 2
+
+        def __init__(self):
+            self.querys = []
+
+        def export_query(self, query, file_path, delimiter, cancel_event=None):
+            self.querys.append(query)
+            open(file_path, "w").close()
+            start, end = [int(value) for value in query.split()]
+            # The first range is slow until it is cancelled
+            if (start, end) == (1, 100):
+                cancel_event.wait(10)
+                return None
+            sleep(0.01)
+            return end - start + 1
+
+    source = Source()
+    ranges = [(1, 100), (101, 102), (103, 104), (105, 106)]
+    row_count = load_functions.run_export_ranges(
+        source,
+        ranges,
+        lambda batch_range: str(batch_range[0]) + " " + str(batch_range[1]),
+        str(tmp_path),
+        "test",
+        "|",
+    )
+
+    assert row_count == 106
+    assert sorted(source.querys[-2:]) == ["1 50", "51 100"]
+    # The file of the cancelled range is removed
+    assert len(list(tmp_path.iterdir())) == 5
+
+
+def test_get_load_costs():
+    class Project:
+        project_name = "test_project"
+        logdb = {"schema": "eneel", "table": "run_log"}
+        schema = {"source_schema": "s", "target_schema": "t"}
+        loads = [
+            {"schema": schema, "table": {"table_name": "a"}},
+            {"schema": schema, "table": {"table_name": "b"}},
+        ]
+
+    class Source:
+        def get_row_estimate(self, schema, table):
+            return 1000
+
+    class LogDb:
+        def get_load_durations(self, schema, table, project):
+            return [("t.a", 10.0, None)]
+
+    # Row estimates are not mixed with the seconds of the history
+    assert get_load_costs(Project(), Source(), LogDb()) == [10.0, None]
+    assert get_load_costs(Project(), Source()) == [1000, 1000]
+    assert get_load_costs(Project(), object()) == [None, None]
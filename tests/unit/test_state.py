@@ -0,0 +1,19 @@
+from eneel.state import *
+
+
+def test_state(tmp_path):
+    state_path = str(tmp_path / "state")
+
+    assert read_state(state_path, "public.test1") == {}
+
+    update_state(state_path, "public.test1", replication_key="id_col", max_replication_key="3")
+    update_state(state_path, "public.test1", max_replication_key="5")
+
+    assert read_state(state_path, "public.test1") == {
+        "replication_key": "id_col",
+        "max_replication_key": "5",
+    }
+
+    delete_state(state_path, "public.test1")
+
+    assert read_state(state_path, "public.test1") == {}
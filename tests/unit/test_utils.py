@@ -1,6 +1,7 @@
 from eneel.utils import *
 import pytest
 import os
+import threading
 
 
 @pytest.fixture
@@ -52,3 +53,208 @@ def test_run_cmd():
     cmd = "bcp"
     cmd_code, cmd_message = run_cmd(cmd)
     assert cmd_code == 1 and cmd_message
+
+
+def test_stream_pipe():
+    stream = StreamPipe(max_chunks=2, chunk_size=10)
+    rows = ["row " + str(i) + "\n" for i in range(100)]
+
+    def write_rows():
+        for row in rows:
+            stream.write(row)
+        stream.close()
+
+    writer = threading.Thread(target=write_rows)
+    writer.start()
+    data = b""
+    while True:
+        chunk = stream.read(8)
+        if not chunk:
+            break
+        data += chunk
+    writer.join()
+
+    assert data.decode("utf-8") == "".join(rows)
+
+
+def test_stream_pipe_abort():
+    stream = StreamPipe(max_chunks=1, chunk_size=1)
+    stream.write("a")
+    stream.abort()
+    with pytest.raises(BrokenPipeError):
+        stream.write("b")
+
+
+def test_open_file_gzip(tmp_path):
+    file_path = str(tmp_path / "test.csv.gz")
+    with open_file(file_path, "w") as file:
+        file.write("1|First\n")
+
+    assert get_compression(file_path) == "gzip"
+    with open_file(file_path, "r") as file:
+        assert file.read() == "1|First\n"
+
+
+def test_compressed_output(tmp_path):
+    file_path = str(tmp_path / "test.csv.gz")
+    with compressed_output(file_path) as plain_path:
+        with open(plain_path, "w") as file:
+            file.write("1|First\n")
+
+    with decompressed_input(file_path) as plain_path:
+        with open(plain_path, "r") as file:
+            assert file.read() == "1|First\n"
+    assert os.listdir(tmp_path) == ["test.csv.gz"]
+
+
+def test_decompressed_input_corrupt(tmp_path):
+    file_path = str(tmp_path / "test.csv.gz")
+    with open(file_path, "wb") as file:
+        file.write(b"not gzip data")
+
+    with pytest.raises(OSError):
+        with decompressed_input(file_path) as plain_path:
+            with open(plain_path, "r") as file:
+                file.read()
+
+
+def test_session_slot():
+    with session_slot():
+        pass
+
+    semaphore = threading.BoundedSemaphore(1)
+    with session_slot(semaphore):
+        assert not semaphore.acquire(blocking=False)
+    assert semaphore.acquire(blocking=False)
+    semaphore.release()
+
+    with pytest.raises(ValueError):
+        with session_slot(semaphore):
+            raise ValueError
+    assert semaphore.acquire(blocking=False)
+
+
+def test_get_histogram_boundaries():
+    histogram = [(10, 400), (20, 400), (1000, 400), (9000000000, 400), (9000000100, 400)]
+
+    assert get_histogram_boundaries(histogram, 800) == [20, 9000000000]
+    assert get_histogram_boundaries(histogram, 100) == [10, 20, 1000, 9000000000]
+    assert get_histogram_boundaries(histogram, 10000) == []
+
+
+def test_get_min_max_batch():
+    assert get_min_max_batch(1, 3000, 3000, 1000) == (1, 3000, 1000)
+    assert get_min_max_batch(5, 5, 1, 1000) == (5, 5, 1)
+
+    min_value, max_value, batch_size_key = get_min_max_batch(
+        datetime.datetime(2019, 10, 1), datetime.datetime(2019, 10, 11), 100, 10
+    )
+    assert batch_size_key == datetime.timedelta(days=1)
+
+    min_value, max_value, batch_size_key = get_min_max_batch(
+        datetime.date(2019, 10, 1), datetime.date(2019, 10, 3), 100, 10
+    )
+    assert batch_size_key == datetime.timedelta(days=1)
+
+
+def test_get_datetime_boundaries():
+    boundaries = get_datetime_boundaries(
+        datetime.datetime(2019, 10, 1, 11, 30), datetime.datetime(2019, 10, 3, 13), "day"
+    )
+    assert boundaries == [datetime.datetime(2019, 10, 2), datetime.datetime(2019, 10, 3)]
+
+    boundaries = get_datetime_boundaries(
+        datetime.datetime(2019, 10, 1, 11, 30), datetime.datetime(2019, 10, 1, 13), "hour"
+    )
+    assert boundaries == [datetime.datetime(2019, 10, 1, 12), datetime.datetime(2019, 10, 1, 13)]
+
+    boundaries = get_datetime_boundaries(
+        datetime.date(2019, 10, 1), datetime.date(2019, 10, 5), datetime.timedelta(days=2)
+    )
+    assert boundaries == [datetime.date(2019, 10, 3), datetime.date(2019, 10, 5)]
+
+
+def test_merge_bucket_ranges():
+    bucket_counts = [(0, 400), (1, 300), (5, 900), (6, 100), (399, 10)]
+
+    assert merge_bucket_ranges(bucket_counts, 1, 10, 1000) == [(1, 20), (21, 70), (71, 4000)]
+    assert merge_bucket_ranges(bucket_counts, 1, 10, 100000) == [(1, 4000)]
+    assert merge_bucket_ranges([], 1, 10, 1000) == []
+
+
+def test_split_range():
+    assert split_range(1, 100, 4) == [(1, 25), (26, 50), (51, 75), (76, 100)]
+    assert split_range(1, 10, 3) == [(1, 4), (5, 8), (9, 10)]
+    assert split_range(5, 6, 4) == [(5, 5), (6, 6)]
+
+
+def test_run_cmd_cancel_event():
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    assert run_cmd(["sleep", "10"], cancel_event=cancel_event) == (-1, "Cancelled")
+    assert run_cmd(["echo", "done"], cancel_event=threading.Event()) == (0, "done\n")
+
+
+def test_parse_test_decoding():
+    insert = "table public.test1: INSERT: id_col[integer]:1 name_col[character varying]:'It''s' datetime_col[timestamp without time zone]:null"
+    update = "table public.test1: UPDATE: old-key: id_col[integer]:1 new-tuple: id_col[integer]:2 name_col[character varying]:'Second'"
+    delete = 'table "Public"."Test1": DELETE: id_col[integer]:2'
+
+    assert parse_test_decoding("BEGIN") is None
+    assert parse_test_decoding(insert) == (
+        "public.test1",
+        "INSERT",
+        {"id_col": "1", "name_col": "It's", "datetime_col": None},
+        {},
+    )
+    assert parse_test_decoding(update) == (
+        "public.test1",
+        "UPDATE",
+        {"id_col": "2", "name_col": "Second"},
+        {"id_col": "1"},
+    )
+    assert parse_test_decoding(delete) == ("Public.Test1", "DELETE", {}, {"id_col": "2"})
+
+
+def test_get_latest_changes():
+    changes = [
+        ("INSERT", {"id": "1", "name": "First"}, {}),
+        ("UPDATE", {"id": "1", "name": UNCHANGED_TOAST}, {}),
+        ("UPDATE", {"id": "2", "name": "Second"}, {"id": "1"}),
+        ("DELETE", {}, {"id": "3"}),
+    ]
+
+    assert get_latest_changes(changes, ["id"]) == [
+        ("D", {"id": "1"}),
+        ("U", {"id": "2", "name": "Second"}),
+        ("D", {"id": "3"}),
+    ]
+    with pytest.raises(ValueError):
+        get_latest_changes([("UPDATE", {"id": "4", "name": UNCHANGED_TOAST}, {})], ["id"])
+
+
+def test_copy_text_value():
+    assert copy_text_value(None) == "\\N"
+    assert copy_text_value("a|b\\c\nd") == "a\\|b\\\\c\\nd"
+
+
+def test_get_changed_ranges():
+    source_hashes = {0: (10, "a"), 1: (10, "b"), 2: (10, "c"), 3: (10, "d")}
+    target_hashes = {0: (10, "a"), 1: (10, "x"), 2: (9, "c"), 3: (10, "d"), 5: (1, "e")}
+
+    assert get_changed_ranges(source_hashes, target_hashes, 1, 10) == [(11, 30), (51, 60)]
+    assert get_changed_ranges(source_hashes, source_hashes, 1, 10) == []
+
+
+def test_get_deleted_keys():
+    source_keys = [(1, "a"), (3, "a"), (5, "b")]
+    target_keys = [(1, "a"), (2, "a"), (3, "a"), (3, "b"), (6, "a")]
+
+    assert list(get_deleted_keys(iter(source_keys), iter(target_keys))) == [
+        (2, "a"),
+        (3, "b"),
+        (6, "a"),
+    ]
+    with pytest.raises(ValueError):
+        list(get_deleted_keys(iter(source_keys), iter([(2, "a"), (1, "a")])))